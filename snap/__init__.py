@@ -19,8 +19,12 @@ import config, callback
 from snap.osregistry        import OS, OSUtils
 from snap.exceptions        import InsufficientPermissionError
 from snap.filemanager       import FileManager
+from snap.copier            import FileCopier
 from snap.snapshottarget    import SnapshotTarget
 from snap.metadata.snapfile import SnapFile
+from snap.metadata.archive  import DirectArchive
+from snap.metadata.restore  import DirectRestore
+from snap.metadata.sfile    import SFile
 from snap.outputformatter   import OutputFormatter
 
 class SnapBase:
@@ -73,24 +77,36 @@ class SnapBase:
 
         self.check_permission()
 
+        FileCopier.reset()
+
         # temp directory used to construct tarball 
         construct_dir = tempfile.mkdtemp()
         FileManager.make_dir(construct_dir)
 
-        backends = self.load_backends()
-        configured_targets = backends.keys()
-        for target in SnapshotTarget.BACKENDS: # load from SnapshotTarget to preserve order
-          if target in configured_targets:
-            backend = backends[target]
-            includes = config.options.target_includes[target]
-            excludes = config.options.target_excludes[target]
-            backend.backup(construct_dir, include=includes, exclude=excludes)
-
-        OutputFormatter.create(config.options.outputformat,
-                 outfile=config.options.snapfile,
-                 snapdirectory=construct_dir,
-                 encryption_password=config.options.encryption_password)
-
+        # stream backed up files straight into the snapfile rather
+        # than staging copies of them in the temp directory
+        if config.options.direct_archive and config.options.outputformat == "snapfile":
+            DirectArchive.register(construct_dir)
+
+        try:
+            backends = self.load_backends()
+            configured_targets = backends.keys()
+            for target in SnapshotTarget.BACKENDS: # load from SnapshotTarget to preserve order
+              if target in configured_targets:
+                backend = backends[target]
+                includes = config.options.target_includes[target]
+                excludes = config.options.target_excludes[target]
+                backend.backup(construct_dir, include=includes, exclude=excludes)
+
+            OutputFormatter.create(config.options.outputformat,
+                     outfile=config.options.snapfile,
+                     snapdirectory=construct_dir,
+                     encryption_password=config.options.encryption_password)
+        finally:
+            DirectArchive.unregister(construct_dir)
+
+        if config.options.log_level_at_least('verbose') and FileCopier.summary() is not None:
+            callback.snapcallback.message(FileCopier.summary())
         if config.options.log_level_at_least('normal'):
             callback.snapcallback.message("Snapshot completed")
 
@@ -105,23 +121,63 @@ class SnapBase:
 
         self.check_permission()
 
+        FileCopier.reset()
+
         # temp directory used to extract tarball
         construct_dir = tempfile.mkdtemp()
         FileManager.make_dir(construct_dir)
 
-        OutputFormatter.retrieve(config.options.outputformat,
-                 infile=config.options.snapfile,
-                 snapdirectory=construct_dir,
-                 encryption_password=config.options.encryption_password)
+        # if only restoring specific files, only extract those and the
+        # files record file, and only restore the files target
+        only = None
+        if config.options.restore_only:
+            only = ['files.xml']
+            for path in config.options.restore_only:
+                only.append(SFile(path).escaped_path(construct_dir))
 
         backends = self.load_backends()
-        configured_targets = backends.keys()
-        for target in SnapshotTarget.BACKENDS: # load from SnapShotTarget to preserve order
-          if target in configured_targets:
-            backend = backends[target]
-            backend.restore(construct_dir)
 
+        # extract the recorded files straight to their original locations
+        # rather than staging them in the temp directory, for which the
+        # files record is extracted first, so the snapfile cannot be read from stdin
+        if config.options.direct_restore and config.options.outputformat == "snapfile" and \
+           config.options.snapfile != '-' and 'files' in backends and hasattr(backends['files'], 'fs_root'):
+            OutputFormatter.retrieve(config.options.outputformat,
+                     infile=config.options.snapfile,
+                     snapdirectory=construct_dir,
+                     encryption_password=config.options.encryption_password,
+                     only=['files.xml'])
+            DirectRestore.register(construct_dir, backends['files'].fs_root)
+
+        try:
+            OutputFormatter.retrieve(config.options.outputformat,
+                     infile=config.options.snapfile,
+                     snapdirectory=construct_dir,
+                     encryption_password=config.options.encryption_password,
+                     only=only)
+
+            configured_targets = backends.keys()
+            for target in SnapshotTarget.BACKENDS: # load from SnapShotTarget to preserve order
+              if target in configured_targets and (only is None or target == 'files'):
+                backend = backends[target]
+                backend.restore(construct_dir)
+        finally:
+            DirectRestore.unregister(construct_dir)
+
+        if config.options.log_level_at_least('verbose') and FileCopier.summary() is not None:
+            callback.snapcallback.message(FileCopier.summary())
         if config.options.log_level_at_least('normal'):
             callback.snapcallback.message("Restore completed")
 
         FileManager.rm_dir(construct_dir)
+
+    def list(self):
+        '''
+        list the contents of the snapfile
+        '''
+        names = OutputFormatter.list(config.options.outputformat,
+                 infile=config.options.snapfile,
+                 snapdirectory=tempfile.gettempdir(),
+                 encryption_password=config.options.encryption_password)
+        for name in names:
+            callback.snapcallback.message(name)
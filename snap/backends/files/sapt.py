@@ -12,16 +12,30 @@
 # GNU General Public License for more details.
 
 import os
-import re
 import apt
 
 import snap
+from snap.digest         import FileDigest
 from snap.filemanager    import FileManager
+from snap.filematcher    import FileMatcher
+from snap.incremental    import Incremental
+from snap.pipeline       import FilePipeline
+from snap.statcache      import StatCache
+from snap.metadata.attributes import AttributeReplicator
+from snap.metadata.hardlinks import HardLinks
 from snap.metadata.sfile import SFile, FilesRecordFile
+from snap.metadata.restore import DirectRestore
 
 class Sapt(snap.snapshottarget.SnapshotTarget):
     '''implements the snap! files target backend using the apt package system'''
 
+    DPKG_INFO_DIR = '/var/lib/dpkg/info'
+
+    DPKG_STATUS_FILE = '/var/lib/dpkg/status'
+
+    # flags which may follow a path in a dpkg conffiles list
+    CONFFILE_FLAGS = ['obsolete', 'remove-on-upgrade']
+
     def __init__(self):
         self.fs_root='/'
 
@@ -36,6 +50,66 @@ class Sapt(snap.snapshottarget.SnapshotTarget):
                 for pfile in pkg.installed_files:
                     self.installed_file_packages[pfile] = pkg
 
+        # set of all the files dpkg tracks as conffiles
+        self.conffiles = set()
+
+        # index of installed files -> md5sums dpkg recorded for them,
+        # only loaded when comparing file contents
+        self.installed_file_digests = {}
+
+        self.__index_dpkg_info()
+
+        # cache of package names -> mtimes of their dpkg file lists
+        self.pkg_list_mtimes = {}
+
+    def __index_dpkg_info(self):
+        '''parse the conffiles and md5sums of all installed packages in a single pass'''
+        file_digests = snap.config.options.file_digests
+        if file_digests:
+            self.__index_conffile_digests()
+
+        for entry in FileManager.scan_dir(Sapt.DPKG_INFO_DIR):
+            if file_digests and entry.name.endswith('.md5sums'):
+                c = FileManager.read_file(entry.path)
+                for line in c.splitlines():
+                    # lines are of the form '<md5>  <path relative to root>'
+                    fields = line.split(None, 1)
+                    if len(fields) == 2:
+                        self.installed_file_digests['/' + fields[1]] = fields[0]
+
+            elif entry.name.endswith('.conffiles'):
+                c = FileManager.read_file(entry.path)
+                for line in c.splitlines():
+                    # lines may be suffixed with flags such as 'obsolete'
+                    conffile = line.strip()
+                    for flag in Sapt.CONFFILE_FLAGS:
+                        if conffile.endswith(' ' + flag):
+                            conffile = conffile[:-len(flag) - 1]
+                    if conffile != '':
+                        self.conffiles.add(conffile)
+
+    def __index_conffile_digests(self):
+        '''parse the md5sums of conffiles out of the dpkg status file, these
+           are not included in the packages' md5sums lists'''
+        in_conffiles = False
+        for line in FileManager.read_file(Sapt.DPKG_STATUS_FILE).splitlines():
+            if line.startswith('Conffiles:'):
+                in_conffiles = True
+            elif in_conffiles and line.startswith(' '):
+                # lines are of the form ' <path> <md5> [flags]'
+                fields = line.split()
+                if len(fields) >= 2:
+                    self.installed_file_digests[fields[0]] = fields[1]
+            else:
+                in_conffiles = False
+
+    def __pkg_list_mtime(self, pkg):
+        '''return the modification time of the dpkg file list of the specified package'''
+        if not pkg.name in self.pkg_list_mtimes:
+            list_file = os.path.join(Sapt.DPKG_INFO_DIR, pkg.name + '.list')
+            self.pkg_list_mtimes[pkg.name] = os.stat(list_file).st_mtime
+        return self.pkg_list_mtimes[pkg.name]
+
     def __file_modified(self,file_name):
         '''return true if package has been modified since installation, else false'''
 
@@ -50,7 +124,7 @@ class Sapt(snap.snapshottarget.SnapshotTarget):
 
         # seems that comparing the modified_time against this time is the only way togo
         # http://lists.netisland.net/archives/plug/plug-2008-02/msg00205.html
-        pkg_modified_time = os.stat('/var/lib/dpkg/info/' + pkg.name + '.list').st_mtime
+        pkg_modified_time = self.__pkg_list_mtime(pkg)
         
         if modified_time > pkg_modified_time:
             return True
@@ -58,13 +132,26 @@ class Sapt(snap.snapshottarget.SnapshotTarget):
         # finally if the file is a deb conffile, we just assume its modified since
         # there is no way to determine if the file was modified before the package
         # was updated (see the link above)
-        conf_file='/var/lib/dpkg/info/' + pkg.name + '.conffiles'
-        if os.path.isfile(conf_file):
-            c = FileManager.read_file(conf_file)
-            if len(re.findall(file_name, c)) > 0:
-                return True
+        return file_name in self.conffiles
+
+    def __file_digest(self, file_name):
+        '''return the (size, digest, algorithm) dpkg recorded for the file or None if
+           its contents cannot be compared'''
+        if not file_name in self.installed_file_digests or os.path.islink(file_name):
+            return None
 
-        return False
+        # dpkg does not record file sizes
+        return (None, self.installed_file_digests[file_name], 'md5')
+
+    def __file_context(self, file_name):
+        '''return the string describing what the file is compared against, the
+           cached verdicts of the file are discarded when this changes'''
+        if not file_name in self.installed_file_packages:
+            return repr((snap.config.options.file_digests, None))
+
+        pkg = self.installed_file_packages[file_name]
+        return repr((snap.config.options.file_digests, pkg.name, self.__pkg_list_mtime(pkg),
+                     file_name in self.conffiles, self.installed_file_digests.get(file_name)))
 
     def backup(self, basedir, include=[], exclude=[]):
         """backup the files modified outside the apt package system"""
@@ -83,21 +170,40 @@ class Sapt(snap.snapshottarget.SnapshotTarget):
         include = list(set(include))
         exclude = list(set(exclude))
 
-        # determine which files have been modified since installation
-        #   and copy those to basedir
+        # determine which readable files have been modified since installation
+        #   and copy those to basedir, classifying and copying in parallel
+        #   reusing what previous backups determined about unchanged files
         sfiles = []
-        files = FileManager.get_all_files(include, exclude)
-        for tfile in files:
-            if self.__file_modified(tfile):
-                if snap.config.options.log_level_at_least('verbose'):
-                    snap.callback.snapcallback.message("Backing up file " + tfile);
-                sfile = SFile(tfile)
-                sfile.copy_to(basedir)
-                sfiles.append(sfile)
+        cache = StatCache.configured()
+        pipeline = FilePipeline(cache=cache)
+        files = FileManager.iter_files(include, FileMatcher(exclude))
+        if snap.config.options.file_digests:
+            classified = FileDigest.classify(files, self.__file_digest, self.__file_modified,
+                                             pipeline.jobs, cache, self.__file_context)
+        else:
+            classified = pipeline.classify(files, self.__file_modified, self.__file_context)
+
+        # if incremental, files unchanged since the parent snapshot are inherited
+        incremental = Incremental.parent()
+        parent = None
+        if incremental is not None:
+            parent = incremental.manifest()
+
+        for sfile in pipeline.copy(classified, basedir, parent):
+            if snap.config.options.log_level_at_least('verbose') and not sfile.inherited:
+                snap.callback.snapcallback.message("Backing up file " + sfile.path);
+            sfiles.append(sfile)
+
+        if cache is not None:
+            cache.close()
 
         # write record file to basedir
         record = FilesRecordFile(basedir + "/files.xml")
-        record.write(sfiles)
+        if incremental is None:
+            record.write(sfiles)
+        else:
+            record.write(sfiles, incremental.snapfile,
+                         incremental.deleted(parent, sfiles, self.fs_root))
 
 
     def restore(self, basedir):
@@ -109,12 +215,31 @@ class Sapt(snap.snapshottarget.SnapshotTarget):
         if snap.config.options.log_level_at_least('verbose'):
             snap.callback.snapcallback.message("Restoring files using apt backend");
 
-        # read files from the record file
+        # read files from the record file as they are restored
         record = FilesRecordFile(basedir + "/files.xml")
         sfiles = record.read()
 
-        # restore those to their original locations
+        # retrieve the files inherited from the chain of parent snapshots,
+        # reading the record file again to restore the files after
+        if record.parent is not None:
+            Incremental(record.parent, snap.config.options.encryption_password).restore_inherited(sfiles, basedir)
+            sfiles = record.read()
+
+        # restore those to their original locations, skipping
+        # those already extracted there by a direct restore, and
+        # replicate their attributes once they have all been copied,
+        # files linked together in the snapshot are linked once restored
+        restored = DirectRestore.lookup(basedir)
+        attributes = AttributeReplicator()
+        links = HardLinks()
         for sfile in sfiles:
+            if restored is not None and restored.is_restored(sfile.path):
+                continue
             if snap.config.options.log_level_at_least('verbose'):
                 snap.callback.snapcallback.message("Restoring file " + sfile.path);
-            sfile.copy_to(self.fs_root, basedir)
+            sfile.copy_to(self.fs_root, basedir, attributes=attributes, links=links)
+        attributes.apply()
+
+        # remove the files deleted since the parent snapshot
+        if not snap.config.options.restore_only:
+            Incremental.remove_deleted(record.deleted, self.fs_root)
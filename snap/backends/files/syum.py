@@ -12,38 +12,81 @@
 # GNU General Public License for more details.
 
 import os
-import yum
+import rpm
 
 import snap
+from snap.digest         import FileDigest
 from snap.filemanager    import FileManager
+from snap.filematcher    import FileMatcher
+from snap.incremental    import Incremental
+from snap.pipeline       import FilePipeline
+from snap.statcache      import StatCache
+from snap.metadata.attributes import AttributeReplicator
+from snap.metadata.hardlinks import HardLinks
 from snap.metadata.sfile import SFile, FilesRecordFile
+from snap.metadata.restore import DirectRestore
 
 class Syum(snap.snapshottarget.SnapshotTarget):
     '''implements the snap! files target backend using the yum package system'''
 
     def __init__(self):
-        self.yum = yum.YumBase();
         self.fs_root='/'
 
+        # build index of installed files -> (package, buildtime, size, digest, mode)
+        self.installed_files = {}
+
+        # packages -> the hashlib names of the algorithms of their file digests
+        self.package_digest_algorithms = {}
+
+        self.__index_installed_files()
+
+    def __index_installed_files(self):
+        '''load the file lists of all installed packages in a single pass over the rpmdb'''
+        # headers are streamed one at a time rather than loaded as yum packages
+        ts = rpm.TransactionSet()
+        for hdr in ts.dbMatch():
+            name = hdr[rpm.RPMTAG_NAME]
+            buildtime = hdr[rpm.RPMTAG_BUILDTIME]
+            algorithm = hdr[rpm.RPMTAG_FILEDIGESTALGO]
+            self.package_digest_algorithms[name] = FileDigest.RPM_ALGORITHMS.get(algorithm, 'md5')
+            pfiles = zip(hdr[rpm.RPMTAG_FILENAMES], hdr[rpm.RPMTAG_FILESIZES],
+                         hdr[rpm.RPMTAG_FILEDIGESTS], hdr[rpm.RPMTAG_FILEMODES])
+
+            for pfile, size, digest, mode in pfiles:
+                # when multiple packages provide a file, the one built
+                # earliest is the one it is compared against
+                current = self.installed_files.get(pfile)
+                if current is None or buildtime < current[1]:
+                    self.installed_files[pfile] = (name, buildtime, size, digest, mode)
+
     def __file_modified(self,file_name):
         '''return true if package has been modified since installation, else false'''
 
-        # Get all packages that provide the file
-        pkgs = self.yum.rpmdb.getProvides(file_name)
-
         # If no package provides it, file has been modified
-        if len(pkgs) == 0:
+        if not file_name in self.installed_files:
             return True
 
-        modified_time = os.stat(file_name).st_mtime
+        # if file modification time > buildtime
+        buildtime = self.installed_files[file_name][1]
+        return os.stat(file_name).st_mtime > buildtime
+
+    def __file_digest(self, file_name):
+        '''return the (size, digest, algorithm) rpm recorded for the file or None if
+           its contents cannot be compared'''
+        if not file_name in self.installed_files:
+            return None
 
-        # need just one failure
-        for pkg in pkgs:
-            # if file modification time > buildtime
-            if  modified_time > pkg.hdr["buildtime"]:
-                return True
+        # only regular files have digests
+        pkg, buildtime, size, digest, mode = self.installed_files[file_name]
+        if not digest or os.path.islink(file_name):
+            return None
 
-        return False
+        return (size, digest, self.package_digest_algorithms[pkg])
+
+    def __file_context(self, file_name):
+        '''return the string describing what the file is compared against, the
+           cached verdicts of the file are discarded when this changes'''
+        return repr((snap.config.options.file_digests, self.installed_files.get(file_name)))
 
     def backup(self, basedir, include=[], exclude=[]):
         """backup the files modified outside the yum package system"""
@@ -63,20 +106,39 @@ class Syum(snap.snapshottarget.SnapshotTarget):
         exclude = list(set(exclude))
 
         # determine which readable files have been modified since installation
-        #   and copy those to basedir
+        #   and copy those to basedir, classifying and copying in parallel
+        #   reusing what previous backups determined about unchanged files
         sfiles = []
-        files = FileManager.get_all_files(include, exclude)
-        for tfile in files:
-            if self.__file_modified(tfile) and os.access(tfile, os.R_OK):
-                if snap.config.options.log_level_at_least('verbose'):
-                    snap.callback.snapcallback.message("Backing up file " + tfile);
-                sfile = SFile(tfile)
-                sfile.copy_to(basedir)
-                sfiles.append(sfile)
+        cache = StatCache.configured()
+        pipeline = FilePipeline(cache=cache)
+        files = FileManager.iter_files(include, FileMatcher(exclude))
+        if snap.config.options.file_digests:
+            classified = FileDigest.classify(files, self.__file_digest, self.__file_modified,
+                                             pipeline.jobs, cache, self.__file_context)
+        else:
+            classified = pipeline.classify(files, self.__file_modified, self.__file_context)
+
+        # if incremental, files unchanged since the parent snapshot are inherited
+        incremental = Incremental.parent()
+        parent = None
+        if incremental is not None:
+            parent = incremental.manifest()
+
+        for sfile in pipeline.copy(classified, basedir, parent):
+            if snap.config.options.log_level_at_least('verbose') and not sfile.inherited:
+                snap.callback.snapcallback.message("Backing up file " + sfile.path);
+            sfiles.append(sfile)
+
+        if cache is not None:
+            cache.close()
 
         # write record file to basedir
         record = FilesRecordFile(basedir + "/files.xml")
-        record.write(sfiles)
+        if incremental is None:
+            record.write(sfiles)
+        else:
+            record.write(sfiles, incremental.snapfile,
+                         incremental.deleted(parent, sfiles, self.fs_root))
 
 
     def restore(self, basedir):
@@ -88,12 +150,31 @@ class Syum(snap.snapshottarget.SnapshotTarget):
         if snap.config.options.log_level_at_least('verbose'):
             snap.callback.snapcallback.message("Restoring files using yum backend");
 
-        # read files from the record file
+        # read files from the record file as they are restored
         record = FilesRecordFile(basedir + "/files.xml")
         sfiles = record.read()
 
-        # restore those to their original locations
+        # retrieve the files inherited from the chain of parent snapshots,
+        # reading the record file again to restore the files after
+        if record.parent is not None:
+            Incremental(record.parent, snap.config.options.encryption_password).restore_inherited(sfiles, basedir)
+            sfiles = record.read()
+
+        # restore those to their original locations, skipping
+        # those already extracted there by a direct restore, and
+        # replicate their attributes once they have all been copied,
+        # files linked together in the snapshot are linked once restored
+        restored = DirectRestore.lookup(basedir)
+        attributes = AttributeReplicator()
+        links = HardLinks()
         for sfile in sfiles:
+            if restored is not None and restored.is_restored(sfile.path):
+                continue
             if snap.config.options.log_level_at_least('verbose'):
                 snap.callback.snapcallback.message("Restoring file " + sfile.path);
-            sfile.copy_to(basedir=self.fs_root, path_prefix=basedir)
+            sfile.copy_to(basedir=self.fs_root, path_prefix=basedir, attributes=attributes, links=links)
+        attributes.apply()
+
+        # remove the files deleted since the parent snapshot
+        if not snap.config.options.restore_only:
+            Incremental.remove_deleted(record.deleted, self.fs_root)
@@ -17,7 +17,9 @@ import re
 import snap
 from snap.osregistry import OSUtils
 from snap.filemanager    import FileManager
+from snap.filematcher    import FileMatcher
 from snap.metadata.sfile import SFile, FilesRecordFile
+from snap.metadata.restore import DirectRestore
 
 class Win(snap.snapshottarget.SnapshotTarget):
     '''implements the snap! files target backend on windows'''
@@ -66,13 +68,12 @@ class Win(snap.snapshottarget.SnapshotTarget):
         # determine which files have been modified since installation
         #   and copy those to basedir
         sfiles = []
-        files = FileManager.get_all_files(include, exclude)
-        for tfile in files:
+        for tfile in FileManager.iter_files(include, FileMatcher(exclude)):
             if snap.config.options.log_level_at_least('verbose'):
                 snap.callback.snapcallback.message("Backing up file " + tfile);
             try:
                 sfile = SFile(tfile)
-                sfile.copy_to(basedir)
+                sfile.stage_to(basedir)
                 sfiles.append(sfile)
             except:
                 pass
@@ -95,8 +96,12 @@ class Win(snap.snapshottarget.SnapshotTarget):
         record = FilesRecordFile(os.path.join(basedir, "files.xml"))
         sfiles = record.read()
 
-        # restore those to their original locations
+        # restore those to their original locations, skipping
+        # those already extracted there by a direct restore
+        restored = DirectRestore.lookup(basedir)
         for sfile in sfiles:
+            if restored is not None and restored.is_restored(sfile.path):
+                continue
             if snap.config.options.log_level_at_least('verbose'):
                 snap.callback.snapcallback.message("Restoring file " + sfile.path);
             try:
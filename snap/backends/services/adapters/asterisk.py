@@ -17,6 +17,7 @@ import subprocess
 import snap
 from snap.osregistry import OS, OSUtils
 from snap.metadata.sfile import SFile, FilesRecordFile
+from snap.metadata.attributes import AttributeReplicator
 from snap.backends.services.dispatcher import Dispatcher
 
 
@@ -56,9 +57,10 @@ class Asterisk:
     @classmethod
     def backup(cls, basedir):
         # backup the confd
-        files = snap.filemanager.FileManager.get_all_files(
-                             include=[d for d in Asterisk.DIRS.itervalues()])
-        sfiles = [SFile(tfile).copy_to(basedir)
+        files = snap.filemanager.FileManager.iter_files(
+                             include=[d for d in Asterisk.DIRS.itervalues()],
+                             exclude=Dispatcher.service_excludes('asterisk'))
+        sfiles = [SFile(tfile).stage_to(basedir)
                              for tfile in files if os.access(tfile, os.R_OK)]
 
         # write record file to basedir
@@ -83,9 +85,12 @@ class Asterisk:
         record = FilesRecordFile(record_file)
         sfiles = record.read()
 
-        # restore those to their original locations
+        # restore those to their original locations, replicating
+        # their attributes once they have all been copied
+        attributes = AttributeReplicator()
         for sfile in sfiles:
-            sfile.copy_to(path_prefix=basedir)
+            sfile.copy_to(path_prefix=basedir, attributes=attributes)
+        attributes.apply()
 
         # start the service
         dispatcher.start_service(Asterisk.DAEMON)
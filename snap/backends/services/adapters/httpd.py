@@ -17,6 +17,7 @@ import subprocess
 import snap
 from snap.osregistry import OS, OSUtils
 from snap.metadata.sfile import SFile, FilesRecordFile
+from snap.metadata.attributes import AttributeReplicator
 from snap.backends.services.dispatcher import Dispatcher
 
 class Httpd:
@@ -62,11 +63,12 @@ class Httpd:
     def backup(self, basedir):
        # backup the webroot, confd
        sfiles = []
-       files = snap.filemanager.FileManager.get_all_files(include=[Httpd.DOCUMENT_ROOT, Httpd.CONF_D])
+       files = snap.filemanager.FileManager.iter_files(include=[Httpd.DOCUMENT_ROOT, Httpd.CONF_D],
+                                                       exclude=Dispatcher.service_excludes('httpd'))
        for tfile in files:
            if os.access(tfile, os.R_OK):
                sfile = SFile(tfile)
-               sfile.copy_to(basedir)
+               sfile.stage_to(basedir)
                sfiles.append(sfile)
 
        # write record file to basedir
@@ -90,9 +92,12 @@ class Httpd:
         record = FilesRecordFile(record_file)
         sfiles = record.read()
 
-        # restore those to their original locations
+        # restore those to their original locations, replicating
+        # their attributes once they have all been copied
+        attributes = AttributeReplicator()
         for sfile in sfiles:
-            sfile.copy_to(path_prefix=basedir)
+            sfile.copy_to(path_prefix=basedir, attributes=attributes)
+        attributes.apply()
 
         # ensure the various subdirs exists even if empty
         if OS.is_linux() and not os.path.isdir(os.path.join(Httpd.DOCUMENT_ROOT, "html")):
@@ -37,11 +37,12 @@ class Iis:
     def backup(self, basedir):
         # backup the configuration directory
         sfiles = []
-        files = snap.filemanager.FileManager.get_all_files(include=[Iis.CONFIG_ROOT])
+        files = snap.filemanager.FileManager.iter_files(include=[Iis.CONFIG_ROOT],
+                                                        exclude=Dispatcher.service_excludes('iis'))
         for tfile in files:
             if os.access(tfile, os.R_OK):
                 sfile = SFile(tfile)
-                sfile.copy_to(basedir)
+                sfile.stage_to(basedir)
                 sfiles.append(sfile)
 
         # write record file to basedir
@@ -20,6 +20,10 @@ class Mock:
     backup_called  = False
     restore_called = False
 
+    # directories the service was last backed up to and restored from
+    backup_dir  = None
+    restore_dir = None
+
     def is_available(self):
         """simply flag that this has been called"""
         Mock.is_available_called = True
@@ -32,7 +36,9 @@ class Mock:
     def backup(self, basedir):
         """simply flag that backup has been called"""
         Mock.backup_called = True
+        Mock.backup_dir = basedir
 
     def restore(self, basedir):
         """simply flag that restore has been called"""
         Mock.restore_called = True
+        Mock.restore_dir = basedir
@@ -17,10 +17,32 @@ import subprocess
 
 import snap
 from snap.osregistry import OS, OSUtils
+from snap.parallel import Parallel
 from snap.backends.services.dispatcher import Dispatcher
 from snap.filemanager import FileManager
 
 class Mysql:
+    """Backs up each mysql database to its own compressed dump, the dumps of
+       the databases are made and loaded concurrently.
+
+       With the mysql_dump_tables service option set, each table of a database
+       is dumped on its own as well, after a dump of the schema of the database
+       which is loaded first. The triggers of the database are dumped on their
+       own to be loaded after the tables, so they are not fired by the load.
+
+       Each dump is taken in a single transaction, consistent on its own. The
+       dumps of the tables of a database are separate transactions though, so
+       they are only consistent with one another if the database is not written
+       to while it is backed up."""
+
+    # directory under the service directory the databases are dumped to
+    DUMPDIR = 'databases'
+
+    # databases generated by the server, which are not dumped
+    SYSTEM_DATABASES = ['information_schema', 'performance_schema', 'sys']
+
+    # database holding the users and privileges, loaded before the others
+    PRIVILEGES_DATABASE = 'mysql'
 
     if snap.osregistry.OS.yum_based():
         DAEMON = 'mysqld'
@@ -60,6 +82,7 @@ class Mysql:
         MYSQL_CMD = None
         MYSQLADMIN_CMD = None
         MYSQLDSAFE_CMD = None
+        MYSQLDUMP_CMD = None
 
     def db_exists(dbname):
         '''helper to return boolean indicating if the db w/ the specified name exists'''
@@ -68,12 +91,37 @@ class Mysql:
         # retrieve list of db names from mysql
         c = FileManager.capture_output([Mysql.MYSQL_CMD, "-e", "show databases", "-u", "root", "-p" + mysql_password])
 
-        # determine if the specified one is among them
-        has_db = len(re.findall(dbname, c))
+        # determine if the specified one is among them, matching whole
+        # names so that the databases it prefixes are not mistaken for it
+        has_db = len(re.findall('^\s*' + re.escape(dbname) + '\s*$', c, re.MULTILINE))
 
         return has_db
     db_exists = staticmethod(db_exists)
 
+    def __query(query, dbname=None):
+        '''helper to return the rows of the results of the query, as lists of fields'''
+        null = open(OSUtils.null_file(), 'w')
+        mysql_password = snap.config.options.service_options['mysql_password']
+
+        command = [Mysql.MYSQL_CMD, "-N", "-B", "-u", "root", "-p" + mysql_password, "-e", query]
+        if dbname is not None:
+            command.append(dbname)
+        popen = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=null)
+        output = popen.communicate()[0]
+        null.close()
+        return [line.split("\t") for line in output.splitlines() if line != '']
+    __query = staticmethod(__query)
+
+    def databases():
+        '''helper to return the names of the databases on the server'''
+        return [row[0] for row in Mysql.__query("show databases")]
+    databases = staticmethod(databases)
+
+    def tables(dbname):
+        '''helper to return the names of the tables of the specified database, not including views'''
+        return [row[0] for row in Mysql.__query("show full tables where Table_type = 'BASE TABLE'", dbname)]
+    tables = staticmethod(tables)
+
     def flush_privileges():
         '''helper to flush database privileges'''
         null = open(OSUtils.null_file(), 'w')
@@ -133,6 +181,46 @@ class Mysql:
             dispatcher.start_service(Mysql.DAEMON)
     set_root_pass = staticmethod(set_root_pass)
 
+    def __load_databases(dumpdir, mysql):
+        '''helper to load the dumps of the databases in the specified directory, the
+           privileges database first and the others in parallel, creating each beforehand
+
+        @param dumpdir - the directory the databases were dumped to
+        @param mysql - the mysql client command to load them with'''
+        if not os.path.isdir(dumpdir):
+            return
+
+        databases = []
+        for name in sorted(os.listdir(dumpdir)):
+            if name.endswith(".mysql") and not name.endswith(".triggers.mysql"):
+                databases.append(name[:-len(".mysql")])
+
+        def load(dbname):
+            if not Mysql.db_exists(dbname):
+                Mysql.create_db(dbname)
+            Dispatcher.load_command(os.path.join(dumpdir, dbname + ".mysql"), mysql + [dbname])
+
+        # the schemas of the databases, or their entire dumps if they were not
+        # dumped by table, then the tables of all the databases and last their triggers
+        if Mysql.PRIVILEGES_DATABASE in databases:
+            databases.remove(Mysql.PRIVILEGES_DATABASE)
+            load(Mysql.PRIVILEGES_DATABASE)
+        Parallel.run(load, databases)
+
+        tables = []
+        triggers = []
+        for dbname in databases + [Mysql.PRIVILEGES_DATABASE]:
+            tabledir = os.path.join(dumpdir, dbname)
+            if os.path.isdir(tabledir):
+                tables += [(os.path.join(tabledir, table), mysql + [dbname])
+                           for table in sorted(os.listdir(tabledir))]
+            triggerfile = os.path.join(dumpdir, dbname + ".triggers.mysql")
+            if os.path.isfile(triggerfile):
+                triggers.append((triggerfile, mysql + [dbname]))
+        Parallel.run(lambda table: Dispatcher.load_command(*table), tables)
+        Parallel.run(lambda trigger: Dispatcher.load_command(*trigger), triggers)
+    __load_databases = staticmethod(__load_databases)
+
     def is_available(self):
         '''return true if we're on a linux system and the init script is available'''
         return Mysql.DATADIR and os.path.isdir(Mysql.DATADIR)
@@ -148,7 +236,6 @@ class Mysql:
 
     def backup(self, basedir):
         dispatcher = Dispatcher.os_dispatcher()
-        null = open(OSUtils.null_file(), 'w')
 
         if OS.is_linux():
             Mysql.set_root_pass()
@@ -161,11 +248,41 @@ class Mysql:
         # start the mysql server
         dispatcher.start_service(Mysql.DAEMON)
 
-        # use a pipe to invoke mysqldump and capture output
-        outfile = file(basedir + "/dump.mysql", "w")
-        popen = subprocess.Popen([Mysql.MYSQLDUMP_CMD, "-u", "root", "-p" + mysql_password, "--all-databases"],
-                                 stdout=outfile, stderr=null)
-        popen.wait()
+        # dump each database, and each of its tables if configured to,
+        # to its own compressed file in parallel
+        dumpdir = os.path.join(basedir, Mysql.DUMPDIR)
+        if not os.path.isdir(dumpdir):
+            os.makedirs(dumpdir)
+        dump_tables = snap.config.ConfigFile.string_to_bool(
+                          snap.config.options.service_options.get('mysql_dump_tables'))
+
+        mysqldump = [Mysql.MYSQLDUMP_CMD, "-u", "root", "-p" + mysql_password, "--single-transaction"]
+        dumps = []
+        for dbname in Mysql.databases():
+            if dbname in Mysql.SYSTEM_DATABASES:
+                continue
+            dumpfile = os.path.join(dumpdir, dbname + ".mysql")
+            if not dump_tables:
+                dumps.append((mysqldump + [dbname], dumpfile))
+                continue
+
+            dumps.append((mysqldump + ["--no-data", "--skip-triggers", dbname], dumpfile))
+            dumps.append((mysqldump + ["--no-data", "--no-create-info", dbname],
+                          os.path.join(dumpdir, dbname + ".triggers.mysql")))
+            tabledir = os.path.join(dumpdir, dbname)
+            if not os.path.isdir(tabledir):
+                os.mkdir(tabledir)
+            for table in Mysql.tables(dbname):
+                dumps.append((mysqldump + ["--no-create-info", "--skip-triggers", dbname, table],
+                              os.path.join(tabledir, table + ".mysql")))
+        statuses = Parallel.run(lambda dump: Dispatcher.dump_command(*dump), dumps)
+
+        # remove the dumps which failed, so they are not mistaken for empty ones on restore
+        for (command, dumpfile), status in zip(dumps, statuses):
+            if status != 0:
+                snap.callback.snapcallback.warn("mysqldump to " + os.path.relpath(dumpfile, dumpdir) +
+                                                " failed with exit status " + str(status))
+                os.remove(dumpfile)
 
         # if mysql was stopped b4hand, start up again
         if not already_running:
@@ -173,7 +290,6 @@ class Mysql:
 
     def restore(self, basedir):
         dispatcher = Dispatcher.os_dispatcher()
-        null = open(OSUtils.null_file(), 'w')
 
         if OS.is_linux():
             Mysql.set_root_pass()
@@ -183,11 +299,13 @@ class Mysql:
         # start the mysql server
         dispatcher.start_service(Mysql.DAEMON)
 
-        # use pipe to invoke mysql, restoring database
-        infile = file(basedir + "/dump.mysql", "r")
-        popen = subprocess.Popen([Mysql.MYSQL_CMD, "-u", "root", "-p" + mysql_password],
-                                 stdin=infile, stdout=null, stderr=null)
-        popen.wait()
+        mysql = [Mysql.MYSQL_CMD, "-u", "root", "-p" + mysql_password]
+
+        # snapshots taken by earlier versions of snap contain a single dump of all databases
+        if os.path.isfile(os.path.join(basedir, "dump.mysql")):
+            Dispatcher.load_command(os.path.join(basedir, "dump.mysql"), mysql)
+        else:
+            Mysql.__load_databases(os.path.join(basedir, Mysql.DUMPDIR), mysql)
 
         # flush privileges incase any roles were restored and whatnot
         Mysql.flush_privileges()
@@ -17,16 +17,41 @@ import subprocess
 
 import snap
 from snap.osregistry import OS, OSUtils
+from snap.parallel import Parallel
 from snap.backends.services.dispatcher import Dispatcher
 from snap.filemanager import FileManager
 
 class Postgresql:
+    """Backs up the postgresql server with pg_dumpall, or with the
+       postgresql_parallel_dump service option set, dumps the globals once and
+       each database with a parallel directory format pg_dump, which is loaded
+       by a parallel pg_restore. The databases are dumped and restored
+       concurrently as well, the configured number of jobs shared between them.
+       Databases which do not exist are created by pg_restore from the dump, so
+       that their owner, encoding, locale and settings are restored with them."""
+
+    # query listing the databases on the server
+    DATABASES_QUERY = "select datname from pg_database"
+
+    # databases which cannot be connected to, and so are not dumped
+    UNDUMPED_DATABASES = ['template0']
+
+    # file under the service directory the roles and tablespaces are dumped to
+    GLOBALS_FILE = 'globals.psql'
+
+    # directory under the service directory the databases are dumped to
+    DUMPDIR = 'databases'
+
+    # database pg_restore connects to when creating the databases it restores
+    MAINTENANCE_DATABASE = 'postgres'
 
     if OS.yum_based():
         DATADIR = '/var/lib/pgsql/data'
         DAEMON = 'postgresql'
         PSQL_CMD = '/usr/bin/psql'
         PGDUMPALL_CMD = '/usr/bin/pg_dumpall'
+        PGDUMP_CMD = '/usr/bin/pg_dump'
+        PGRESTORE_CMD = '/usr/bin/pg_restore'
 
         # hack until we re-introduce package system abstraction:
         PREREQ_INSTALL_COMMAND = 'yum install -y postgresql-server postgresql'
@@ -37,6 +62,8 @@ class Postgresql:
         DAEMON = 'postgresql'
         PSQL_CMD = '/usr/bin/psql'
         PGDUMPALL_CMD = '/usr/bin/pg_dumpall'
+        PGDUMP_CMD = '/usr/bin/pg_dump'
+        PGRESTORE_CMD = '/usr/bin/pg_restore'
 
         # hack until we re-introduce package system abstraction:
         PREREQ_INSTALL_COMMAND = 'apt-get install -y postgresql'
@@ -47,6 +74,8 @@ class Postgresql:
         DAEMON = 'postgresql-x64-' + VERSION # FIXME also support 32 bit
         PSQL_CMD = os.path.join("C:\Program Files\PostgreSQL", VERSION, "bin\psql.exe")
         PGDUMPALL_CMD = os.path.join("C:\Program Files\PostgreSQL", VERSION, "bin\pg_dumpall.exe")
+        PGDUMP_CMD = os.path.join("C:\Program Files\PostgreSQL", VERSION, "bin\pg_dump.exe")
+        PGRESTORE_CMD = os.path.join("C:\Program Files\PostgreSQL", VERSION, "bin\pg_restore.exe")
     
     else:
         VERSION = None
@@ -54,6 +83,8 @@ class Postgresql:
         DAEMON = None
         PSQL_CMD = None
         PGDUMPALL_CMD = None
+        PGDUMP_CMD = None
+        PGRESTORE_CMD = None
     
     def set_pgpassword_env():
         '''helper to set the postgres password in the env from the config'''
@@ -69,14 +100,69 @@ class Postgresql:
         penv = Postgresql.set_pgpassword_env()
 
         # retrieve list of db names from postgres
-        c = FileManager.capture_output([Postgresql.PSQL_CMD, "--username", "postgres", "-t", "-c", "select datname from pg_database"], env=penv)
+        c = FileManager.capture_output([Postgresql.PSQL_CMD, "--username", "postgres", "-t", "-c", Postgresql.DATABASES_QUERY], env=penv)
 
-        # determine if the specified one is among them
-        has_db = len(re.findall(dbname, c))
+        # determine if the specified one is among them, matching whole
+        # names so that the databases it prefixes are not mistaken for it
+        has_db = len(re.findall('^\s*' + re.escape(dbname) + '\s*$', c, re.MULTILINE))
 
         return has_db
     db_exists = staticmethod(db_exists)
     
+    def databases():
+        '''helper to return the names of the databases on the server, which can be dumped'''
+        null = open(OSUtils.null_file(), 'w')
+
+        # get the env containing the postgres password
+        penv = Postgresql.set_pgpassword_env()
+
+        popen = subprocess.Popen([Postgresql.PSQL_CMD, "--username", "postgres", "-t", "-A", "-c", Postgresql.DATABASES_QUERY],
+                                 env=penv, stdout=subprocess.PIPE, stderr=null)
+        output = popen.communicate()[0]
+        null.close()
+        return [dbname for dbname in output.splitlines()
+                if dbname != '' and not dbname in Postgresql.UNDUMPED_DATABASES]
+    databases = staticmethod(databases)
+
+    def parallel_dump():
+        '''helper to return true if the databases are to be dumped individually in parallel'''
+        return snap.config.ConfigFile.string_to_bool(
+                   snap.config.options.service_options.get('postgresql_parallel_dump')) == True
+    parallel_dump = staticmethod(parallel_dump)
+
+    def __split_jobs(count):
+        '''helper to return the number of databases to process at once and the number
+           of jobs to run each with, sharing the configured number of jobs between them'''
+        jobs = Parallel.jobs()
+        concurrent = max(1, min(jobs, count))
+        return concurrent, max(1, jobs / concurrent)
+    __split_jobs = staticmethod(__split_jobs)
+
+    def quote_identifier(name):
+        '''helper to return the specified name quoted for use as an identifier in sql'''
+        return '"' + name.replace('"', '""') + '"'
+    quote_identifier = staticmethod(quote_identifier)
+
+    def run_command(command, penv, description):
+        '''helper to run the specified postgresql command, warning with its error
+           output if it fails
+
+        @param command - array containing executable to run w/ parameters
+        @param penv - environment containing the postgres password
+        @param description - description of the command to report if it fails
+        @returns - the exit status of the command'''
+        null = open(OSUtils.null_file(), 'w')
+        try:
+            popen = subprocess.Popen(command, env=penv, stdout=null, stderr=subprocess.PIPE)
+            errors = popen.communicate()[1]
+        finally:
+            null.close()
+        if popen.returncode != 0:
+            snap.callback.snapcallback.warn(description + " failed with exit status " +
+                                            str(popen.returncode) + ": " + errors.strip())
+        return popen.returncode
+    run_command = staticmethod(run_command)
+
     def create_db(dbname):
         '''helper to create the specified database'''
         null = open(OSUtils.null_file(), 'w')
@@ -85,7 +171,7 @@ class Postgresql:
         penv = Postgresql.set_pgpassword_env()
 
         # create the db
-        popen = subprocess.Popen([Postgresql.PSQL_CMD, "--username", "postgres", "-c", "CREATE DATABASE " + dbname],
+        popen = subprocess.Popen([Postgresql.PSQL_CMD, "--username", "postgres", "-c", "CREATE DATABASE " + Postgresql.quote_identifier(dbname)],
                                  env=penv, stdout=null, stderr=null)
         popen.wait()
     create_db = staticmethod(create_db)
@@ -98,7 +184,7 @@ class Postgresql:
         penv = Postgresql.set_pgpassword_env()
 
         # destroy the db
-        popen = subprocess.Popen([Postgresql.PSQL_CMD, "--username", "postgres", "-c", "DROP DATABASE " + dbname],
+        popen = subprocess.Popen([Postgresql.PSQL_CMD, "--username", "postgres", "-c", "DROP DATABASE " + Postgresql.quote_identifier(dbname)],
                                  env=penv, stdout=null, stderr=null)
         popen.wait()
     drop_db = staticmethod(drop_db)
@@ -122,6 +208,55 @@ class Postgresql:
         popen.wait()
     init_db = staticmethod(init_db)
 
+    def __dump_databases(basedir, penv):
+        '''helper to dump the globals of the server to a compressed file and each
+           database to its own directory format dump, compressed by pg_dump'''
+        status = Dispatcher.dump_command([Postgresql.PGDUMPALL_CMD, "--username", "postgres", "--globals-only"],
+                                         os.path.join(basedir, Postgresql.GLOBALS_FILE), env=penv)
+        if status != 0:
+            snap.callback.snapcallback.warn("pg_dumpall of the globals failed with exit status " + str(status))
+
+        dumpdir = os.path.join(basedir, Postgresql.DUMPDIR)
+        if not os.path.isdir(dumpdir):
+            os.makedirs(dumpdir)
+
+        databases = Postgresql.databases()
+        concurrent, jobs = Postgresql.__split_jobs(len(databases))
+
+        def dump(dbname):
+            Postgresql.run_command([Postgresql.PGDUMP_CMD, "--username", "postgres", "-Fd", "-Z", "6", "-j", str(jobs),
+                                    "-f", os.path.join(dumpdir, dbname), dbname],
+                                   penv, "pg_dump of database " + dbname)
+        Parallel.run(dump, databases, concurrent)
+    __dump_databases = staticmethod(__dump_databases)
+
+    def __restore_databases(basedir, penv):
+        '''helper to restore the globals and then the databases dumped by __dump_databases.
+           Databases which do not exist are created by pg_restore as they were dumped,
+           the others such as postgres and template1 are restored into'''
+        globals_file = os.path.join(basedir, Postgresql.GLOBALS_FILE)
+        if os.path.isfile(globals_file):
+            status = Dispatcher.load_command(globals_file, [Postgresql.PSQL_CMD, "--username", "postgres"], env=penv)
+            if status != 0:
+                snap.callback.snapcallback.warn("psql restore of the globals failed with exit status " + str(status))
+
+        dumpdir = os.path.join(basedir, Postgresql.DUMPDIR)
+        if not os.path.isdir(dumpdir):
+            return
+        databases = sorted(os.listdir(dumpdir))
+        concurrent, jobs = Postgresql.__split_jobs(len(databases))
+
+        def restore(dbname):
+            if Postgresql.db_exists(dbname):
+                target = ["-d", dbname]
+            else:
+                target = ["-C", "-d", Postgresql.MAINTENANCE_DATABASE]
+            Postgresql.run_command([Postgresql.PGRESTORE_CMD, "--username", "postgres", "-j", str(jobs)] +
+                                   target + [os.path.join(dumpdir, dbname)],
+                                   penv, "pg_restore of database " + dbname)
+        Parallel.run(restore, databases, concurrent)
+    __restore_databases = staticmethod(__restore_databases)
+
     def is_available(self):
         '''return true postgres is available locally'''
         return Postgresql.DATADIR and os.path.isdir(Postgresql.DATADIR)
@@ -149,10 +284,16 @@ class Postgresql:
         # get env containing postgres password
         penv = Postgresql.set_pgpassword_env()
 
-        outfile = file(basedir + "/dump.psql", "w")
-        pipe = subprocess.Popen([Postgresql.PGDUMPALL_CMD, "--username", "postgres"],
-                                env=penv, stdout=outfile, stderr=null)
-        pipe.wait()
+        if Postgresql.parallel_dump():
+            Postgresql.__dump_databases(basedir, penv)
+        else:
+            outfile = file(basedir + "/dump.psql", "w")
+            pipe = subprocess.Popen([Postgresql.PGDUMPALL_CMD, "--username", "postgres"],
+                                    env=penv, stdout=outfile, stderr=null)
+            status = pipe.wait()
+            outfile.close()
+            if status != 0:
+                snap.callback.snapcallback.warn("pg_dumpall failed with exit status " + str(status))
 
         # if postgresql was running b4hand, start up again
         if not already_running:
@@ -174,6 +315,11 @@ class Postgresql:
         # get env containing the postgresql password
         penv = Postgresql.set_pgpassword_env()
 
+        # snapshots of the individual databases are restored in parallel
+        if not os.path.isfile(basedir + "/dump.psql"):
+            Postgresql.__restore_databases(basedir, penv)
+            return
+
         # use pipe to invoke postgres, restoring database
         infile = file(basedir + "/dump.psql", "r")
         popen = subprocess.Popen([Postgresql.PSQL_CMD, "--username", "postgres"],
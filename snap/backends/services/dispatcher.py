@@ -12,9 +12,16 @@
 # GNU General Public License for more details.
 
 import os
+import errno
+import subprocess
+import multiprocessing.pool
 
 import snap
-from snap.osregistry import OS
+from snap.osregistry import OS, OSUtils
+from snap.compression import Compression
+from snap.parallel import Parallel
+from snap.callback import TaggedCallback
+from snap.filematcher import FileMatcher
 from snap.metadata.service import Service, ServicesRecordFile
 
 class Dispatcher(snap.snapshottarget.SnapshotTarget):
@@ -30,6 +37,72 @@ class Dispatcher(snap.snapshottarget.SnapshotTarget):
             return snap.backends.services.linuxdispatcher.LinuxDispatcher
     os_dispatcher = staticmethod(os_dispatcher)
 
+    def service_excludes(service):
+        '''helper to compile the file excludes configured for the specified service
+           via the <service>_exclude option in the services config section'''
+        excludes = snap.config.options.service_options.get(service + '_exclude')
+        if excludes is None:
+            return FileMatcher()
+        return FileMatcher(snap.config.ConfigFile.string_to_array(excludes))
+    service_excludes = staticmethod(service_excludes)
+
+    def dump_command(command, path, env=None):
+        '''helper to run the specified command, compressing its output to the file at
+           the specified path as it is streamed, with the configured codec
+
+        @param command - array containing executable to run w/ parameters
+        @param path - the path to the file to write
+        @param env - optional environment to set for command
+        @returns - the exit status of the command'''
+        null = open(OSUtils.null_file(), 'w')
+        outfile = open(path, 'wb')
+        try:
+            # the dumps of services are run in parallel with one another
+            # so each is compressed on the thread reading it
+            compressed = Compression.writer(outfile, snap.config.options.compression, jobs=1)
+            popen = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=null)
+            while True:
+                data = popen.stdout.read(Compression.BLOCKSIZE)
+                if len(data) == 0:
+                    break
+                compressed.write(data)
+            compressed.close()
+            return popen.wait()
+        finally:
+            outfile.close()
+            null.close()
+    dump_command = staticmethod(dump_command)
+
+    def load_command(path, command, env=None):
+        '''helper to run the specified command, streaming the decompressed contents of
+           the file at the specified path to its input. Uncompressed files are streamed as is
+
+        @param path - the path to the file to read
+        @param command - array containing executable to run w/ parameters
+        @param env - optional environment to set for command
+        @returns - the exit status of the command'''
+        null = open(OSUtils.null_file(), 'w')
+        infile = open(path, 'rb')
+        try:
+            reader = Compression.reader(infile)
+            popen = subprocess.Popen(command, env=env, stdin=subprocess.PIPE, stdout=null, stderr=null)
+            try:
+                while True:
+                    data = reader.read(Compression.READSIZE)
+                    if len(data) == 0:
+                        break
+                    popen.stdin.write(data)
+                popen.stdin.close()
+            except IOError, e:
+                # the command exited before reading everything
+                if e.errno != errno.EPIPE:
+                    raise
+            return popen.wait()
+        finally:
+            infile.close()
+            null.close()
+    load_command = staticmethod(load_command)
+
     def load_service(self, service):
         '''initialize the specified service adapter'''
 
@@ -44,18 +117,62 @@ class Dispatcher(snap.snapshottarget.SnapshotTarget):
 
         return service_instance
 
+    def service_directory(service):
+        '''return the directory, relative to the snap working directory, the
+           specified service is backed up to'''
+        return os.path.join("services", service)
+    service_directory = staticmethod(service_directory)
+
+    def __run(self, func, services):
+        '''helper to run func on each of the named services across a thread pool
+           bounded by the configured number of jobs, the messages logged by each are
+           tagged with the name of its service
+
+        @param func - callable taking the name and index of a service
+        @returns - list of the results of func, in the order of the services'''
+        if len(services) == 0:
+            return []
+        jobs = min(Parallel.jobs(), len(services))
+        callback = TaggedCallback(snap.callback.snapcallback)
+
+        def run(item):
+            index, service = item
+            callback.tag(service)
+            try:
+                return func(service, index)
+            finally:
+                callback.tag(None)
+
+        snap.callback.snapcallback = callback
+        pool = multiprocessing.pool.ThreadPool(jobs)
+        try:
+            results = list(Parallel.imap(pool, run, enumerate(services), jobs))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            snap.callback.snapcallback = callback.callback
+        return results
+
     def backup(self, basedir, include=[], exclude=[]):
-        """run backup on each of the services included"""
-        services = []
+        """run backup on each of the services included, concurrently, each
+           to its own directory under basedir"""
 
-        for service in include:
+        def backup_service(service, index):
             if snap.config.options.log_level_at_least('verbose'):
                 snap.callback.snapcallback.message("Backing up service " + service);
             service_instance = self.load_service(service)
             # check if service is running / available on machine b4 backing up
-            if service_instance.is_available():
-                sservice = service_instance.backup(basedir)
-                services.append(Service(name=service))
+            if not service_instance.is_available():
+                return None
+            directory = Dispatcher.service_directory(service)
+            if not os.path.isdir(os.path.join(basedir, directory)):
+                os.makedirs(os.path.join(basedir, directory))
+            service_instance.backup(os.path.join(basedir, directory))
+            return Service(name=service, directory=directory)
+
+        services = [sservice for sservice in self.__run(backup_service, include)
+                    if sservice is not None]
 
         record = ServicesRecordFile(basedir + "/services.xml")
         record.write(services)
@@ -67,19 +184,32 @@ class Dispatcher(snap.snapshottarget.SnapshotTarget):
             return
 
         record = ServicesRecordFile(basedir + "/services.xml")
-        services = record.read()
+        services = list(record.read())
 
+        # install the prerequisites of the services which are not available
+        # one at a time, package managers do not permit concurrent installs
+        instances = []
         for sservice in services:
-            if snap.config.options.log_level_at_least('verbose'):
-                snap.callback.snapcallback.message("Restoring service " + sservice.name);
             service_instance = self.load_service(sservice.name)
-            # install the prerequisites if the services is not available
             if not service_instance.is_available():
                 service_instance.install_prereqs()
-            
+            instances.append(service_instance)
+
+        def restore_service(service, index):
+            sservice = services[index]
+            service_instance = instances[index]
             if service_instance.is_available():
-                service_instance.restore(basedir)
-                
-            # if service is still not available, log this and skip it    
+                if snap.config.options.log_level_at_least('verbose'):
+                    snap.callback.snapcallback.message("Restoring service " + sservice.name);
+
+                # services backed up by earlier versions of snap are in basedir itself
+                service_dir = basedir
+                if sservice.directory is not None:
+                    service_dir = os.path.join(basedir, sservice.directory)
+                service_instance.restore(service_dir)
+
+            # if service is still not available, log this and skip it
             elif snap.config.options.log_level_at_least('normal'):
                 snap.callback.snapcallback.message("Could not restore " + sservice.name + " service")
+
+        self.__run(restore_service, [sservice.name for sservice in services])
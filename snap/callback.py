@@ -12,6 +12,8 @@
 # GNU General Public License for more details.
 #
 
+import threading
+
 class Callback:
     """Base callback interface through which snap informs clients of progress"""
     
@@ -39,5 +41,43 @@ class Callback:
         '''
         pass
 
+class TaggedCallback(Callback):
+    """Callback prefixing the messages sent from each thread with the tag
+       set on that thread before passing them on to another callback, so that
+       the progress of operations run concurrently can be told apart"""
+
+    def __init__(self, callback):
+        '''
+        initialize the callback
+
+        @param - the callback to pass the tagged messages on to
+        '''
+        self.callback = callback
+        self.local = threading.local()
+
+    def tag(self, tag):
+        '''
+        set the tag of the messages sent from the current thread
+
+        @param - the string tag, None to send them untagged
+        '''
+        self.local.tag = tag
+
+    def __tagged(self, msg):
+        '''helper to return the message prefixed with the tag of the current thread'''
+        tag = getattr(self.local, 'tag', None)
+        if tag is None:
+            return msg
+        return "[" + tag + "] " + msg
+
+    def message(self, msg):
+        self.callback.message(self.__tagged(msg))
+
+    def warn(self, warning):
+        self.callback.warn(self.__tagged(warning))
+
+    def error(self, error):
+        self.callback.error(self.__tagged(error))
+
 # assign this to your SnapCallbackBase-derived callback to hookup the callback system
 snapcallback=Callback()
@@ -0,0 +1,394 @@
+# Block parallel compression codecs used to write and read snapfiles
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import zlib
+import struct
+import collections
+import multiprocessing.pool
+
+from snap.parallel   import Parallel
+from snap.exceptions import ArgError, InvalidOperationError
+
+# xz and zstd support are optional
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class _Passthrough(object):
+    """Decompressor for uncompressed data"""
+
+    unused_data = ''
+
+    def decompress(self, data):
+        return data
+
+class Codec(object):
+    """A compression codec, data is compressed in independent blocks which
+       are written one after another as concatenated gzip members / xz streams /
+       zstd frames, all of which the standard tools decompress as a whole"""
+
+    # the name the codec is selected by
+    name = None
+
+    # the bytes the compressed data starts with
+    magic = None
+
+    def available(self):
+        '''return true if the libraries needed by the codec are present'''
+        return True
+
+    def compress(self, block):
+        '''return the block compressed as a self contained member'''
+        raise NotImplementedError()
+
+    def decompressor(self):
+        '''return a new decompressor for a single member, which must provide
+           decompress(data) and set unused_data once the member is complete'''
+        raise NotImplementedError()
+
+    # the length of the footer, 0 if the codec cannot carry one
+    FOOTER_SIZE = 0
+
+    def footer(self, offset, size):
+        '''return a fixed size footer recording the offset and size of a trailing
+           index, in a form the standard tools skip over when decompressing'''
+        return None
+
+    def parse_footer(self, data):
+        '''return the (offset, size) stored in the footer or None if data is not one'''
+        return None
+
+class NoneCodec(Codec):
+    name = 'none'
+
+    def compress(self, block):
+        return block
+
+    def decompressor(self):
+        return _Passthrough()
+
+class GzipCodec(Codec):
+    name = 'gzip'
+    magic = '\x1f\x8b'
+
+    LEVEL = 6
+
+    def compress(self, block):
+        compressor = zlib.compressobj(GzipCodec.LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush()
+
+    def decompressor(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    # the footer is an empty gzip member carrying the offsets in an extra field
+    FOOTER_HEADER = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' + struct.pack('<H', 20) + 'SX' + struct.pack('<H', 16)
+    FOOTER_TRAILER = '\x03\x00' + struct.pack('<II', 0, 0)
+    FOOTER_SIZE = len(FOOTER_HEADER) + 16 + len(FOOTER_TRAILER)
+
+    def footer(self, offset, size):
+        return GzipCodec.FOOTER_HEADER + struct.pack('<QQ', offset, size) + GzipCodec.FOOTER_TRAILER
+
+    def parse_footer(self, data):
+        header = len(GzipCodec.FOOTER_HEADER)
+        if len(data) != GzipCodec.FOOTER_SIZE or not data.startswith(GzipCodec.FOOTER_HEADER) or \
+           not data.endswith(GzipCodec.FOOTER_TRAILER):
+            return None
+        return struct.unpack('<QQ', data[header:header + 16])
+
+class XzCodec(Codec):
+    name = 'xz'
+    magic = '\xfd7zXZ\x00'
+
+    PRESET = 6
+
+    def available(self):
+        return lzma is not None
+
+    def compress(self, block):
+        return lzma.compress(block, preset=XzCodec.PRESET)
+
+    def decompressor(self):
+        return lzma.LZMADecompressor()
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    magic = '\x28\xb5\x2f\xfd'
+
+    LEVEL = 3
+
+    def available(self):
+        return zstandard is not None
+
+    def compress(self, block):
+        return zstandard.ZstdCompressor(level=ZstdCodec.LEVEL).compress(block)
+
+    def decompressor(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    # the footer is a skippable frame
+    FOOTER_HEADER = struct.pack('<II', 0x184D2A5E, 16)
+    FOOTER_SIZE = len(FOOTER_HEADER) + 16
+
+    def footer(self, offset, size):
+        return ZstdCodec.FOOTER_HEADER + struct.pack('<QQ', offset, size)
+
+    def parse_footer(self, data):
+        if len(data) != ZstdCodec.FOOTER_SIZE or not data.startswith(ZstdCodec.FOOTER_HEADER):
+            return None
+        return struct.unpack('<QQ', data[len(ZstdCodec.FOOTER_HEADER):])
+
+class Compression:
+    """Selects codecs and wraps file objects to compress / decompress them"""
+
+    CODECS = [GzipCodec(), XzCodec(), ZstdCodec(), NoneCodec()]
+
+    # the codec used if none is configured
+    DEFAULT = 'gzip'
+
+    # the number of uncompressed bytes compressed as a single member
+    BLOCKSIZE = 1024 * 1024
+
+    # the number of bytes read at a time when decompressing
+    READSIZE = 64 * 1024
+
+    def codec(name):
+        '''return the codec with the specified name
+
+        @raises ArgError - if there is no such codec
+        @raises InvalidOperationError - if the libraries the codec requires are not installed'''
+        for codec in Compression.CODECS:
+            if codec.name == name:
+                if not codec.available():
+                    raise InvalidOperationError(name + " compression is not supported on this system")
+                return codec
+        raise ArgError("invalid compression codec " + str(name))
+    codec = staticmethod(codec)
+
+    def detect(head):
+        '''return the codec the data starting with the specified bytes was compressed with'''
+        for codec in Compression.CODECS:
+            if codec.magic is not None and head.startswith(codec.magic):
+                return Compression.codec(codec.name)
+        return Compression.codec('none')
+    detect = staticmethod(detect)
+
+    def writer(fileobj, name=None, jobs=None):
+        '''return a write only file object compressing the data written to it into fileobj
+
+        @param fileobj - the file object to write the compressed data to
+        @param name - the name of the codec to use, defaults to gzip
+        @param jobs - the number of blocks to compress in parallel, defaults
+                      to the configured number of jobs'''
+        if name is None:
+            name = Compression.DEFAULT
+        codec = Compression.codec(name)
+        if jobs is None:
+            jobs = Parallel.jobs()
+        if isinstance(codec, NoneCodec):
+            jobs = 1 # nothing to parallelize
+        return CompressedWriter(fileobj, codec, jobs)
+    writer = staticmethod(writer)
+
+    def reader(fileobj):
+        '''return a read only file object decompressing the contents of fileobj,
+           the codec is detected from the data'''
+        head = fileobj.read(max(len(codec.magic or '') for codec in Compression.CODECS))
+        return DecompressedReader(fileobj, Compression.detect(head), head)
+    reader = staticmethod(reader)
+
+    def read_index(fileobj):
+        '''return the codec of the seekable file object and the index written after
+           its compressed data, the index is None if there is not one'''
+        codec = Compression.detect(fileobj.read(max(len(codec.magic or '') for codec in Compression.CODECS)))
+        if codec.FOOTER_SIZE == 0:
+            return codec, None
+
+        fileobj.seek(0, 2)
+        if fileobj.tell() < codec.FOOTER_SIZE:
+            return codec, None
+        fileobj.seek(-codec.FOOTER_SIZE, 2)
+        footer = codec.parse_footer(fileobj.read(codec.FOOTER_SIZE))
+        if footer is None:
+            return codec, None
+
+        offset, size = footer
+        fileobj.seek(offset)
+        return codec, DecompressedReader(FileSection(fileobj, size), codec).read()
+    read_index = staticmethod(read_index)
+
+class CompressedWriter(object):
+    """Write only file object compressing blocks of data across a thread pool,
+       compressed blocks are written in order and at most a few per thread are
+       held in memory at a time"""
+
+    def __init__(self, fileobj, codec, jobs):
+        self.fileobj = fileobj
+        self.codec = codec
+
+        # (uncompressed offset, compressed offset) of each block written
+        self.chunks = []
+        self.offset = 0
+        self.compressed = 0
+
+        self.window = jobs * 4
+        self.pool = None
+        if jobs > 1:
+            self.pool = multiprocessing.pool.ThreadPool(jobs)
+        self.pending = collections.deque()
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= Compression.BLOCKSIZE:
+            data = ''.join(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+            for offset in range(0, len(data) - Compression.BLOCKSIZE + 1, Compression.BLOCKSIZE):
+                self.__submit(data[offset:offset + Compression.BLOCKSIZE])
+            remainder = len(data) % Compression.BLOCKSIZE
+            if remainder > 0:
+                self.buffer.append(data[-remainder:])
+                self.buffered = remainder
+
+    def __submit(self, block):
+        '''helper to compress the block in the pool, writing out the oldest
+           blocks once the window is full'''
+        offset = self.offset
+        self.offset += len(block)
+        if self.pool is None:
+            self.__write(offset, self.codec.compress(block))
+            return
+        self.pending.append((offset, self.pool.apply_async(self.codec.compress, (block,))))
+        while len(self.pending) >= self.window:
+            self.__write_pending()
+
+    def __write(self, offset, data):
+        '''helper to write out a compressed block, recording where it starts'''
+        self.chunks.append((offset, self.compressed))
+        self.fileobj.write(data)
+        self.compressed += len(data)
+
+    def __write_pending(self):
+        '''helper to wait for and write out the oldest pending block'''
+        offset, result = self.pending.popleft()
+        self.__write(offset, result.get())
+
+    def write_index(self, index):
+        '''write the specified index after the compressed data, followed by a footer
+           locating it, must be called after close. Nothing is written if the codec
+           does not support footers
+
+        @param index - the data of the index to write
+        @returns - boolean indicating if the index was written'''
+        offset = self.compressed
+        data = self.codec.compress(index)
+        footer = self.codec.footer(offset, len(data))
+        if footer is None:
+            return False
+        self.fileobj.write(data)
+        self.fileobj.write(footer)
+        self.compressed += len(data) + len(footer)
+        return True
+
+    def close(self):
+        '''compress and write out any remaining data, the underlying file
+           object is left open'''
+        try:
+            if self.buffered > 0:
+                self.__submit(''.join(self.buffer))
+                self.buffer = []
+                self.buffered = 0
+            while self.pending:
+                self.__write_pending()
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+
+class DecompressedReader(object):
+    """Read only file object decompressing a stream of concatenated members"""
+
+    def __init__(self, fileobj, codec, head=''):
+        '''initialize the reader
+
+        @param fileobj - the file object to read the compressed data from
+        @param codec - the codec the data was compressed with
+        @param head - any data already read from the start of fileobj'''
+        self.fileobj = fileobj
+        self.codec = codec
+        self.head = head
+        self.decompressor = None
+        self.buffer = ''
+        self.offset = 0
+        self.eof = False
+
+    def __fill(self):
+        '''helper to decompress the next chunk of data into the buffer'''
+        data = self.head or self.fileobj.read(Compression.READSIZE)
+        self.head = ''
+        if len(data) == 0:
+            self.eof = True
+            return
+
+        output = []
+        while len(data) > 0:
+            if self.decompressor is None:
+                self.decompressor = self.codec.decompressor()
+            output.append(self.decompressor.decompress(data))
+
+            # start a new member with whatever follows the end of this one
+            data = getattr(self.decompressor, 'unused_data', '')
+            if len(data) > 0 or getattr(self.decompressor, 'eof', False):
+                self.decompressor = None
+        self.buffer = self.buffer[self.offset:] + ''.join(output)
+        self.offset = 0
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) - self.offset < size):
+            self.__fill()
+        end = len(self.buffer)
+        if size >= 0:
+            end = min(end, self.offset + size)
+        data = self.buffer[self.offset:end]
+        self.offset = end
+        return data
+
+    def close(self):
+        '''the underlying file object is left open'''
+        pass
+
+class FileSection(object):
+    """Read only file object limited to the next size bytes of another"""
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
@@ -27,6 +27,10 @@ class ConfigOptions:
     # modes of operation
     RESTORE = 0
     BACKUP = 1
+    LIST = 2
+
+    # formats the record files may be written in
+    RECORD_FORMATS = ['manifest', 'xml']
 
     def __init__(self):
         '''initialize configuration'''
@@ -59,6 +63,44 @@ class ConfigOptions:
         # hash of key/value pairs of service-specific options
         self.service_options = {}
 
+        # detect modified files by comparing their contents against the
+        # digests recorded by the package system instead of their mtimes
+        self.file_digests = False
+
+        # number of files to process in parallel, if left as None
+        # the number of cpus will be used
+        self.jobs = None
+
+        # stream backed up files straight into the snapfile instead of
+        # first copying them to a temporary directory
+        self.direct_archive = False
+
+        # extract restored files straight to their original locations
+        # instead of first extracting them to a temporary directory
+        self.direct_restore = False
+
+        # codec to compress the snapfile with, if left as None gzip will be used
+        self.compression = None
+
+        # paths of the files to restore, if empty everything will be restored
+        self.restore_only = []
+
+        # parent snapfile to take an incremental snapshot against, if left
+        # as None a full snapshot will be taken
+        self.incremental_from = None
+
+        # directory of the chunk store snapshots taken with the chunkstore
+        # output format are deduplicated into
+        self.chunk_store = '/var/lib/snap/store'
+
+        # location of the cache of what previous backups determined about
+        # each file, if left empty the cache will not be used
+        self.stat_cache = '/var/cache/snap/statcache.db'
+
+        # format to write the record files of the snapshot in, xml record
+        # files may be read by earlier versions of snap
+        self.record_format = 'manifest'
+
         for backend in SnapshotTarget.BACKENDS:
             self.target_backends[backend] = False
             self.target_includes[backend] = []
@@ -171,6 +213,15 @@ class ConfigFile:
         sf = self.__get_string('snapfile')
         ll = self.__get_string('loglevel')
         enp = self.__get_string('encryption_password')
+        fd = self.__get_bool('file_digests')
+        jobs = self.__get_string('jobs')
+        da = self.__get_bool('direct_archive')
+        dr = self.__get_bool('direct_restore')
+        comp = self.__get_string('compression')
+        inc = self.__get_string('incremental_from')
+        cs = self.__get_string('chunk_store')
+        sc = self.__get_string('stat_cache')
+        rf = self.__get_string('record_format')
         
         if of != None:
             snap.config.options.outputformat = of
@@ -180,6 +231,24 @@ class ConfigFile:
             snap.config.options.log_level = ll
         if enp != None:
             snap.config.options.encryption_password = enp
+        if fd != None:
+            snap.config.options.file_digests = fd
+        if jobs != None:
+            snap.config.options.jobs = int(jobs)
+        if da != None:
+            snap.config.options.direct_archive = da
+        if dr != None:
+            snap.config.options.direct_restore = dr
+        if comp != None:
+            snap.config.options.compression = comp
+        if inc != None:
+            snap.config.options.incremental_from = inc
+        if cs != None:
+            snap.config.options.chunk_store = cs
+        if sc != None:
+            snap.config.options.stat_cache = sc
+        if rf != None:
+            snap.config.options.record_format = rf
             
         services = self.__get_array('services')
         if services:
@@ -210,10 +279,21 @@ class Config:
         self.parser = optparse.OptionParser(usage, version=SNAP_VERSION)
         self.parser.add_option('', '--restore', dest='restore', action='store_true', default=False, help='Restore snapshot')
         self.parser.add_option('', '--backup', dest='backup', action='store_true', default=False, help='Take snapshot')
+        self.parser.add_option('', '--list', dest='list', action='store_true', default=False, help='List the contents of the snapshot')
+        self.parser.add_option('', '--incremental-from', dest='incremental_from', action='store', default=None, help='Only back up files changed since the specified snapfile')
+        self.parser.add_option('', '--only', dest='restore_only', action='store', default=None, help='Only restore the specified files')
         self.parser.add_option('-l', '--log-level', dest='log_level', action='store', default="normal", help='Log level (quiet, normal, verbose, debug)')
         self.parser.add_option('-o', '--outputformat', dest='outputformat', action='store', default=None, help='Output file format')
         self.parser.add_option('-f', '--snapfile', dest='snapfile', action='store', default=None, help='Snapshot file, use - for stdout')
         self.parser.add_option('-p', '--password', dest='encryption_password', action='store', default=None, help='Snapshot File Encryption/Decryption Password')
+        self.parser.add_option('-j', '--jobs', dest='jobs', action='store', type='int', default=None, help='Number of files to process in parallel')
+        self.parser.add_option('', '--file-digests', dest='file_digests', action='store_true', default=None, help='Detect modified files by comparing their contents against package digests')
+        self.parser.add_option('', '--direct-archive', dest='direct_archive', action='store_true', default=None, help='Stream files straight into the snapfile without staging copies')
+        self.parser.add_option('', '--direct-restore', dest='direct_restore', action='store_true', default=None, help='Extract files straight to their original locations without staging copies')
+        self.parser.add_option('-z', '--compression', dest='compression', action='store', default=None, help='Snapfile compression (gzip, xz, zstd, none)')
+        self.parser.add_option('', '--chunk-store', dest='chunk_store', action='store', default=None, help='Chunk store directory used by the chunkstore output format')
+        self.parser.add_option('', '--stat-cache', dest='stat_cache', action='store', default=None, help='Cache of unchanged files to skip when backing up, empty to disable')
+        self.parser.add_option('', '--record-format', dest='record_format', action='store', default=None, help='Format to write the snapshot records in (manifest, xml)')
         # FIXME how to permit parameter lists for some of these
         for backend in SnapshotTarget.BACKENDS:
             self.parser.add_option('', '--' + backend, dest=backend, action='store_true', help='Enable ' + backend + ' snapshots/restoration')
@@ -224,6 +304,12 @@ class Config:
             snap.config.options.mode = ConfigOptions.RESTORE
         if options.backup != False:
             snap.config.options.mode = ConfigOptions.BACKUP
+        if options.list != False:
+            snap.config.options.mode = ConfigOptions.LIST
+        if options.incremental_from != None:
+            snap.config.options.incremental_from = options.incremental_from
+        if options.restore_only != None:
+            snap.config.options.restore_only = ConfigFile.string_to_array(options.restore_only)
         if options.log_level:
             snap.config.options.log_level = options.log_level
         if options.outputformat != None:
@@ -232,6 +318,22 @@ class Config:
             snap.config.options.snapfile = options.snapfile
         if options.encryption_password != None:
             snap.config.options.encryption_password = options.encryption_password
+        if options.file_digests != None:
+            snap.config.options.file_digests = options.file_digests
+        if options.jobs != None:
+            snap.config.options.jobs = options.jobs
+        if options.direct_archive != None:
+            snap.config.options.direct_archive = options.direct_archive
+        if options.direct_restore != None:
+            snap.config.options.direct_restore = options.direct_restore
+        if options.compression != None:
+            snap.config.options.compression = options.compression
+        if options.chunk_store != None:
+            snap.config.options.chunk_store = options.chunk_store
+        if options.stat_cache != None:
+            snap.config.options.stat_cache = options.stat_cache
+        if options.record_format != None:
+            snap.config.options.record_format = options.record_format
         for backend in SnapshotTarget.BACKENDS:
             val = getattr(options, backend)
             if val != None:
@@ -259,6 +361,8 @@ class Config:
         # TODO verify output format is one of permitted types
         if snap.config.options.outputformat == None: # need to specify output format
             raise snap.exceptions.ArgError("Must specify valid output format")
+        if not snap.config.options.record_format in ConfigOptions.RECORD_FORMATS:
+            raise snap.exceptions.ArgError("Must specify valid record format")
 
 # static shared options
 options = ConfigOptions()
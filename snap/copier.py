@@ -0,0 +1,280 @@
+# Copies file contents with the cheapest mechanism the filesystem supports
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import errno
+import shutil
+import threading
+
+from snap.sparse import SparseFile
+
+# the kernel copy mechanisms are optional, they are only
+# available on linux and through libc when python lacks them
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import ctypes, ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except (ImportError, OSError, TypeError):
+    _libc = None
+
+def _libc_function(name, argtypes):
+    '''return the specified libc function, None if it is not available'''
+    function = getattr(_libc, name, None)
+    if function is not None:
+        function.argtypes = argtypes
+        function.restype = ctypes.c_ssize_t
+    return function
+
+if _libc is not None:
+    _copy_file_range = _libc_function('copy_file_range', [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                                                           ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint])
+    _sendfile = _libc_function('sendfile', [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+else:
+    _copy_file_range = _sendfile = None
+
+class FileCopier:
+    """Copies the contents of files, trying in turn a reflink sharing the
+       extents of the source (FICLONE), copy_file_range, sendfile and finally
+       a buffered copy through userspace.
+
+       The first three never move the data through snap, and a reflink does
+       not copy it at all. A mechanism failing part way through a file is
+       picked up from where it left off by the next one. Mechanisms which
+       fail outright between a pair of filesystems are not tried for them
+       again. The number of files and bytes copied with each mechanism are
+       counted so their effectiveness can be reported.
+
+       Only the data regions of sparse files are copied, the holes between
+       them are left unwritten so the copies are as sparse as the sources."""
+
+    REFLINK = 'reflink'
+    COPY_FILE_RANGE = 'copy_file_range'
+    SENDFILE = 'sendfile'
+    BUFFERED = 'buffered'
+
+    METHODS = [REFLINK, COPY_FILE_RANGE, SENDFILE, BUFFERED]
+
+    # linux ioctl sharing the extents of one file with another
+    FICLONE = 0x40049409
+
+    # the maximum number of bytes requested of the kernel at a time
+    BLOCKSIZE = 8 * 1024 * 1024
+
+    # errors indicating a mechanism is not supported for the files
+    UNSUPPORTED = tuple(getattr(errno, name) for name in
+                        ('ENOSYS', 'EXDEV', 'EINVAL', 'ENOTSUP', 'EOPNOTSUPP', 'ENOTTY', 'EBADF')
+                        if hasattr(errno, name))
+
+    # method -> [files, bytes] copied with it
+    counters = dict((method, [0, 0]) for method in METHODS)
+
+    # (source device, destination device) -> set of methods unsupported between them
+    unsupported = {}
+
+    lock = threading.Lock()
+
+    def copy(source, destination):
+        '''copy the contents of the source file to the destination, replacing it
+
+        @param source - the path to the file to copy
+        @param destination - the path to copy it to
+        @returns - the method the contents were copied with
+        @raises shutil.Error - if the source and destination are the same file, as shutil.copyfile would'''
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            raise shutil.Error("`%s` and `%s` are the same file" % (source, destination))
+        src = open(source, 'rb')
+        try:
+            dst = open(destination, 'wb')
+            try:
+                return FileCopier.copyfileobj(src, dst)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+    copy = staticmethod(copy)
+
+    def copyfileobj(src, dst):
+        '''copy the contents of the source file object from its current
+           position to the destination file object, which must be empty
+
+        @returns - the method the bulk of the contents were copied with'''
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+        key = (os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev)
+        with FileCopier.lock:
+            unsupported = FileCopier.unsupported.setdefault(key, set())
+
+        copied = {}
+        regions = None
+        if src.tell() == 0:
+            regions = SparseFile.regions(src)
+        if regions is None:
+            FileCopier.__copy_range(src, dst, None, unsupported, copied)
+
+        # a reflink shares the holes of a sparse file along with its data,
+        # else each data region is copied and the size set after the last
+        elif FileCopier.__copy_range(src, dst, None, unsupported, copied, [FileCopier.REFLINK]) == 0:
+            size = os.fstat(src.fileno()).st_size
+            for offset, length in regions:
+                src.seek(offset)
+                dst.seek(offset)
+                FileCopier.__copy_range(src, dst, length, unsupported, copied)
+            dst.truncate(size)
+
+        used = FileCopier.BUFFERED
+        if len(copied) > 0:
+            used = max(copied, key=copied.get)
+        with FileCopier.lock:
+            FileCopier.counters[used][0] += 1
+            for method, nbytes in copied.items():
+                FileCopier.counters[method][1] += nbytes
+        return used
+    copyfileobj = staticmethod(copyfileobj)
+
+    def __copy_range(src, dst, length, unsupported, copied, methods=METHODS):
+        '''helper trying each method in turn until one copies the rest of the range
+
+        @param length - the number of bytes to copy, None to copy the rest of the source
+        @param unsupported - the set of methods unsupported for the files, added to
+        @param copied - dict of the number of bytes copied with each method, added to
+        @returns - the number of bytes copied'''
+        total = 0
+        for method in methods:
+            if method in unsupported:
+                continue
+            remaining = None
+            if length is not None:
+                remaining = length - total
+            try:
+                nbytes = FileCopier.__copy(method, src, dst, remaining)
+                if nbytes > 0:
+                    copied[method] = copied.get(method, 0) + nbytes
+                    total += nbytes
+                    break
+            except _Unsupported, e:
+                if e.nbytes > 0:
+                    copied[method] = copied.get(method, 0) + e.nbytes
+                    total += e.nbytes
+                else:
+                    with FileCopier.lock:
+                        unsupported.add(method)
+        return total
+    __copy_range = staticmethod(__copy_range)
+
+    def __copy(method, src, dst, length=None):
+        '''helper to copy the rest of the source, or the specified number of bytes
+           of it, with the specified method
+
+        @returns - the number of bytes copied, 0 if the method could not be used for the file
+        @raises _Unsupported - if the method failed, with the number of bytes it copied first'''
+        if method == FileCopier.BUFFERED:
+            start = dst.tell()
+            if length is None:
+                shutil.copyfileobj(src, dst, FileCopier.BLOCKSIZE)
+            else:
+                remaining = length
+                while remaining > 0:
+                    data = src.read(min(remaining, FileCopier.BLOCKSIZE))
+                    if len(data) == 0:
+                        break
+                    dst.write(data)
+                    remaining -= len(data)
+            dst.flush()
+            return dst.tell() - start
+
+        if method == FileCopier.REFLINK:
+            if fcntl is None:
+                raise _Unsupported(0)
+            if src.tell() != 0 or length is not None:
+                return 0
+            try:
+                fcntl.ioctl(dst.fileno(), FileCopier.FICLONE, src.fileno())
+            except IOError, e:
+                if e.errno in FileCopier.UNSUPPORTED:
+                    raise _Unsupported(0)
+                raise
+            nbytes = os.fstat(src.fileno()).st_size
+            src.seek(nbytes)
+            dst.seek(nbytes)
+            return nbytes
+
+        if method == FileCopier.COPY_FILE_RANGE:
+            function = _copy_file_range
+            call = lambda src_fd, dst_fd, count: function(src_fd, None, dst_fd, None, count, 0)
+        else:
+            function = _sendfile
+            call = lambda src_fd, dst_fd, count: function(dst_fd, src_fd, None, count)
+        if function is None:
+            raise _Unsupported(0)
+
+        # the kernel copies from and to the current offsets of the files,
+        # which python's buffers must agree with
+        dst.flush()
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+        os.lseek(src_fd, src.tell(), os.SEEK_SET)
+        os.lseek(dst_fd, dst.tell(), os.SEEK_SET)
+        nbytes = 0
+        try:
+            while length is None or nbytes < length:
+                count = FileCopier.BLOCKSIZE
+                if length is not None:
+                    count = min(count, length - nbytes)
+                n = call(src_fd, dst_fd, count)
+                if n < 0:
+                    error = ctypes.get_errno()
+                    if error == errno.EINTR:
+                        continue
+                    if error in FileCopier.UNSUPPORTED:
+                        raise _Unsupported(nbytes)
+                    raise OSError(error, os.strerror(error))
+                if n == 0:
+                    break
+                nbytes += n
+        finally:
+            src.seek(os.lseek(src_fd, 0, os.SEEK_CUR))
+            dst.seek(os.lseek(dst_fd, 0, os.SEEK_CUR))
+
+        # files such as those in /proc appear empty to the kernel, 0
+        # is returned for them so the next method is tried
+        return nbytes
+    __copy = staticmethod(__copy)
+
+    def reset():
+        '''reset the counters of the bytes copied with each method'''
+        with FileCopier.lock:
+            for counter in FileCopier.counters.values():
+                counter[0] = counter[1] = 0
+    reset = staticmethod(reset)
+
+    def summary():
+        '''return a message describing the bytes copied with each method, None if nothing has been'''
+        with FileCopier.lock:
+            counted = [(method, FileCopier.counters[method]) for method in FileCopier.METHODS
+                       if FileCopier.counters[method][1] > 0]
+        if len(counted) == 0:
+            return None
+        return "Copied " + ", ".join(["%d bytes of %d files with %s" % (nbytes, files, method)
+                                      for method, (files, nbytes) in counted])
+    summary = staticmethod(summary)
+
+class _Unsupported(Exception):
+    """Raised internally when a copy method cannot copy the rest of a file"""
+
+    def __init__(self, nbytes):
+        Exception.__init__(self)
+        self.nbytes = nbytes
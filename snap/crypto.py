@@ -11,54 +11,398 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
-import os, random, struct
+import os, struct
+import hmac
 import hashlib
+import collections
+import multiprocessing
 from Crypto.Cipher import AES
+from Crypto.Util   import Counter
+
+from snap.parallel   import Parallel
+from snap.exceptions import IntegrityError
+
+def _encrypt_chunk(task):
+    '''encrypt and authenticate a chunk, module level so it may be run in a process pool
+
+    @param task - tuple of the encryption and mac keys, the container header,
+                  the index of the chunk, whether it is the final one and its plaintext
+    @returns - the ciphertext of the chunk followed by its tag'''
+    enc_key, mac_key, header, index, final, data = task
+    ciphertext = Crypto.chunk_cipher(enc_key, index).encrypt(data)
+    return ciphertext + Crypto.chunk_tag(mac_key, header, index, final, ciphertext)
+
+def _decrypt_chunk(task):
+    '''verify and decrypt a chunk, module level so it may be run in a process pool
+
+    @param task - tuple of the encryption and mac keys, the container header,
+                  the index of the chunk, whether it is the final one and its
+                  ciphertext followed by its tag
+    @returns - the plaintext of the chunk, None if it failed verification'''
+    enc_key, mac_key, header, index, final, data = task
+    ciphertext = data[:-Crypto.TAG_SIZE]
+    if not hmac.compare_digest(data[-Crypto.TAG_SIZE:],
+                               Crypto.chunk_tag(mac_key, header, index, final, ciphertext)):
+        return None
+    return Crypto.chunk_cipher(enc_key, index).decrypt(ciphertext)
 
 class Crypto:
+    """Encryption of snapshots.
+
+       Snapshots are encrypted into a versioned container consisting of a
+       header and a sequence of independently encrypted and authenticated chunks.
+       The header is MAGIC followed by the salt, the number of PBKDF2-SHA256
+       iterations the keys are derived from the password with and the chunk size.
+       Each chunk is CHUNKSIZE bytes of plaintext encrypted with AES in CTR mode,
+       keyed by the chunk index, followed by the HMAC-SHA256 of the header, the
+       chunk index, a flag marking the final chunk and the ciphertext. The final
+       chunk is always shorter than CHUNKSIZE, possibly empty, so truncated,
+       reordered or modified chunks are all detected before any of their
+       plaintext is returned.
+
+       Chunks are encrypted and decrypted across a process pool, and as the
+       location of each is known, containers can be read from arbitrary offsets."""
+
+    MAGIC = 'SNAPENC2'
+
+    SALT_SIZE = 16
+
+    HEADER_FORMAT = '>II'
+
+    HEADER_SIZE = len(MAGIC) + SALT_SIZE + struct.calcsize(HEADER_FORMAT)
+
+    TAG_SIZE = hashlib.sha256().digest_size
+
+    # the number of bytes of plaintext in each chunk
+    CHUNKSIZE = 1024 * 1024
+
+    # the number of PBKDF2 iterations new containers are keyed with
+    ITERATIONS = 100000
+
+    # the header is not authenticated until a chunk is verified, containers
+    # whose header specifies more than these are rejected before keys are
+    # derived or chunks read with the values it specifies
+    MAX_ITERATIONS = 100 * ITERATIONS
+    MAX_CHUNKSIZE = 64 * CHUNKSIZE
+
     def generate_key(password):
-        '''generate a encyption/decryption key from the specified password'''
+        '''generate a encyption/decryption key from the specified password, as used
+           by snapshots encrypted before the container format was introduced'''
         return hashlib.sha256(password).digest()
     generate_key=staticmethod(generate_key)
 
-    def encrypt_file(key, in_filename, out_filename=None, chunksize=64*1024):
+    def derive_keys(password, salt, iterations):
+        '''return the (encryption key, mac key) derived from the specified password'''
+        keys = hashlib.pbkdf2_hmac('sha256', password, salt, iterations, 64)
+        return keys[:32], keys[32:]
+    derive_keys=staticmethod(derive_keys)
+
+    def chunk_cipher(enc_key, index):
+        '''return the AES CTR cipher for the chunk with the specified index'''
+        return AES.new(enc_key, AES.MODE_CTR,
+                       counter=Counter.new(64, prefix=struct.pack('>Q', index), initial_value=0))
+    chunk_cipher=staticmethod(chunk_cipher)
+
+    def chunk_tag(mac_key, header, index, final, ciphertext):
+        '''return the tag authenticating the chunk'''
+        return hmac.new(mac_key, header + struct.pack('>QB', index, final) + ciphertext,
+                        hashlib.sha256).digest()
+    chunk_tag=staticmethod(chunk_tag)
+
+    def writer(password, fileobj, jobs=None):
+        '''return a write only file object encrypting the data written to it into fileobj
+
+        @param password - the password to derive the keys from
+        @param fileobj - the file object to write the container to
+        @param jobs - the number of chunks to encrypt in parallel, defaults
+                      to the configured number of jobs'''
+        if jobs is None:
+            jobs = Parallel.jobs()
+        return EncryptedWriter(password, fileobj, jobs)
+    writer=staticmethod(writer)
+
+    def reader(password, fileobj, jobs=None):
+        '''return a read only file object decrypting the contents of fileobj, snapshots
+           encrypted before the container format was introduced are also supported
+
+        @param password - the password the data was encrypted with
+        @param fileobj - the file object to read the encrypted data from
+        @param jobs - the number of chunks to decrypt in parallel, defaults
+                      to the configured number of jobs'''
+        if jobs is None:
+            jobs = Parallel.jobs()
+        header = fileobj.read(Crypto.HEADER_SIZE)
+        if header.startswith(Crypto.MAGIC):
+            return DecryptedReader(password, fileobj, header, jobs)
+        return LegacyDecryptedReader(Crypto.generate_key(password), fileobj, header)
+    reader=staticmethod(reader)
+
+    def encrypt_file(password, in_filename, out_filename=None, chunksize=64*1024):
         if not out_filename:
             out_filename = in_filename + '.enc'
 
-        iv = ''.join(chr(random.randint(0, 0xFF)) for i in range(16))
-        encryptor = AES.new(key, AES.MODE_CBC, iv)
-        filesize = os.path.getsize(in_filename)
-
         with open(in_filename, 'rb') as infile:
             with open(out_filename, 'wb') as outfile:
-                outfile.write(struct.pack('<Q', filesize))
-                outfile.write(iv)
-
-                while True:
-                    chunk = infile.read(chunksize)
-                    if len(chunk) == 0:
-                        break
-                    elif len(chunk) % 16 != 0:
-                        chunk += ' ' * (16 - len(chunk) % 16)
-
-                    outfile.write(encryptor.encrypt(chunk))
+                encrypted = Crypto.writer(password, outfile)
+                try:
+                    while True:
+                        chunk = infile.read(chunksize)
+                        if len(chunk) == 0:
+                            break
+                        encrypted.write(chunk)
+                finally:
+                    encrypted.close()
     encrypt_file=staticmethod(encrypt_file)
 
-    def decrypt_file(key, in_filename, out_filename=None, chunksize=24*1024):
+    def decrypt_file(password, in_filename, out_filename=None, chunksize=24*1024):
         if not out_filename:
             out_filename = os.path.splitext(in_filename)[0]
-    
+
         with open(in_filename, 'rb') as infile:
-            origsize = struct.unpack('<Q', infile.read(struct.calcsize('Q')))[0]
-            iv = infile.read(16)
-            decryptor = AES.new(key, AES.MODE_CBC, iv)
-    
-            with open(out_filename, 'wb') as outfile:
-                while True:
-                    chunk = infile.read(chunksize)
-                    if len(chunk) == 0:
-                        break
-                    outfile.write(decryptor.decrypt(chunk))
-    
-                outfile.truncate(origsize)
+            decrypted = Crypto.reader(password, infile)
+            try:
+                with open(out_filename, 'wb') as outfile:
+                    while True:
+                        chunk = decrypted.read(chunksize)
+                        if len(chunk) == 0:
+                            break
+                        outfile.write(chunk)
+            finally:
+                decrypted.close()
     decrypt_file=staticmethod(decrypt_file)
+
+class EncryptedWriter(object):
+    """Write only file object encrypting chunks of data across a process pool,
+       encrypted chunks are written in order and at most a few per process are
+       held in memory at a time"""
+
+    def __init__(self, password, fileobj, jobs):
+        self.fileobj = fileobj
+        salt = os.urandom(Crypto.SALT_SIZE)
+        self.header = Crypto.MAGIC + salt + struct.pack(Crypto.HEADER_FORMAT, Crypto.ITERATIONS, Crypto.CHUNKSIZE)
+        self.enc_key, self.mac_key = Crypto.derive_keys(password, salt, Crypto.ITERATIONS)
+        self.fileobj.write(self.header)
+
+        self.index = 0
+        self.jobs = jobs
+        self.window = jobs * 4
+        self.pool = None
+        self.pending = collections.deque()
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= Crypto.CHUNKSIZE:
+            data = ''.join(self.buffer)
+            end = len(data) - len(data) % Crypto.CHUNKSIZE
+            for offset in range(0, end, Crypto.CHUNKSIZE):
+                self.__submit(data[offset:offset + Crypto.CHUNKSIZE], False)
+            self.buffer = [data[end:]]
+            self.buffered = len(data) - end
+
+    def __submit(self, chunk, final):
+        '''helper to encrypt the chunk in the pool, writing out the oldest
+           chunks once the window is full'''
+        task = (self.enc_key, self.mac_key, self.header, self.index, final, chunk)
+        self.index += 1
+
+        # the pool is only started once there is more than one chunk
+        if self.pool is None and self.jobs > 1 and not final:
+            self.pool = multiprocessing.Pool(self.jobs)
+        if self.pool is None:
+            self.fileobj.write(_encrypt_chunk(task))
+            return
+        self.pending.append(self.pool.apply_async(_encrypt_chunk, (task,)))
+        while len(self.pending) >= self.window:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def close(self):
+        '''encrypt and write out the remaining data as the final chunk, the
+           underlying file object is left open'''
+        try:
+            if self.buffer is not None:
+                self.__submit(''.join(self.buffer), True)
+                self.buffer = None
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().get())
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+
+class DecryptedReader(object):
+    """Read only file object verifying and decrypting the chunks of a container
+       across a process pool. Chunks are read ahead of the data requested, the
+       readahead growing as the container is read sequentially and starting
+       over when it is seeked, which it may be if the underlying file object
+       supports it.
+
+       @raises IntegrityError - when the header is invalid or when reading
+                                from a chunk which fails verification"""
+
+    def __init__(self, password, fileobj, header, jobs):
+        '''initialize the reader
+
+        @param password - the password the data was encrypted with
+        @param fileobj - the file object positioned after the header
+        @param header - the header read from fileobj
+        @param jobs - the number of chunks to decrypt in parallel'''
+        if len(header) != Crypto.HEADER_SIZE:
+            raise IntegrityError("truncated encryption header")
+        salt = header[len(Crypto.MAGIC):len(Crypto.MAGIC) + Crypto.SALT_SIZE]
+        iterations, self.chunksize = struct.unpack(Crypto.HEADER_FORMAT,
+                                                   header[len(Crypto.MAGIC) + Crypto.SALT_SIZE:])
+        if not 0 < iterations <= Crypto.MAX_ITERATIONS:
+            raise IntegrityError("invalid encryption header iterations " + str(iterations))
+        if not 0 < self.chunksize <= Crypto.MAX_CHUNKSIZE:
+            raise IntegrityError("invalid encryption header chunk size " + str(self.chunksize))
+        self.enc_key, self.mac_key = Crypto.derive_keys(password, salt, iterations)
+        self.header = header
+        self.fileobj = fileobj
+
+        self.jobs = jobs
+        self.pool = None
+        self.pending = collections.deque()
+        self.readahead = 1
+
+        # the index of the next chunk to read from fileobj
+        self.index = 0
+        self.done = False
+
+        # the decrypted data of the current chunk and the position in it
+        self.buffer = ''
+        self.position = 0
+        self.offset = 0
+
+    def __next_task(self):
+        '''helper to read the next chunk from the file, None once the final one has been read'''
+        if self.done:
+            return None
+        data = self.fileobj.read(self.chunksize + Crypto.TAG_SIZE)
+        final = len(data) < self.chunksize + Crypto.TAG_SIZE
+        if final:
+            self.done = True
+            if len(data) < Crypto.TAG_SIZE:
+                raise IntegrityError("encrypted snapfile is truncated")
+        task = (self.enc_key, self.mac_key, self.header, self.index, final, data)
+        self.index += 1
+        return task
+
+    def __fill(self):
+        '''helper to decrypt the next chunk into the buffer, False at the end of the data'''
+        # the pool is only started once the container is read past the first chunk
+        if self.pool is None and self.readahead > 1 and self.jobs > 1:
+            self.pool = multiprocessing.Pool(self.jobs)
+
+        while len(self.pending) < self.readahead:
+            task = self.__next_task()
+            if task is None:
+                break
+            if self.pool is None:
+                self.pending.append((task[3], _decrypt_chunk(task), False))
+            else:
+                self.pending.append((task[3], self.pool.apply_async(_decrypt_chunk, (task,)), True))
+        if not self.pending:
+            return False
+
+        # read further ahead the longer the container is read sequentially
+        self.readahead = min(self.readahead * 2, self.jobs * 4)
+
+        index, result, pooled = self.pending.popleft()
+        if pooled:
+            result = result.get()
+        if result is None:
+            raise IntegrityError("encrypted snapfile chunk " + str(index) + " failed verification")
+        self.buffer = result
+        self.position = 0
+        return True
+
+    def read(self, size=-1):
+        output = []
+        while size != 0:
+            if self.position == len(self.buffer) and not self.__fill():
+                break
+            end = len(self.buffer)
+            if size > 0:
+                end = min(end, self.position + size)
+                size -= end - self.position
+            output.append(self.buffer[self.position:end])
+            self.offset += end - self.position
+            self.position = end
+        return ''.join(output)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.offset
+        elif whence == 2:
+            self.fileobj.seek(0, 2)
+            stored = self.fileobj.tell() - Crypto.HEADER_SIZE
+            chunks = (stored + self.chunksize + Crypto.TAG_SIZE - 1) // (self.chunksize + Crypto.TAG_SIZE)
+            offset += stored - chunks * Crypto.TAG_SIZE
+
+        # start over from the chunk containing the offset
+        self.index = offset // self.chunksize
+        self.fileobj.seek(Crypto.HEADER_SIZE + self.index * (self.chunksize + Crypto.TAG_SIZE))
+        self.done = False
+        self.pending.clear()
+        self.readahead = 1
+        self.buffer = ''
+        self.position = 0
+        self.offset = self.index * self.chunksize
+        self.read(offset - self.offset)
+
+    def tell(self):
+        return self.offset
+
+    def close(self):
+        '''the underlying file object is left open'''
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+class LegacyDecryptedReader(object):
+    """Read only file object decrypting the contents of another, encrypted
+       in AES CBC mode preceeded by the size of the plaintext and the iv"""
+
+    def __init__(self, key, fileobj, head=''):
+        '''initialize the reader
+
+        @param key - the key the data was encrypted with
+        @param fileobj - the file object to read the encrypted data from
+        @param head - any data already read from the start of fileobj'''
+        sizelen = struct.calcsize('Q')
+        if len(head) < sizelen + AES.block_size:
+            head += fileobj.read(sizelen + AES.block_size - len(head))
+        self.fileobj = fileobj
+        self.remaining = struct.unpack('<Q', head[:sizelen])[0]
+        self.cipher = AES.new(key, AES.MODE_CBC, head[sizelen:sizelen + AES.block_size])
+
+        # any ciphertext read along with the header
+        self.pending = head[sizelen + AES.block_size:]
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            # cbc decrypts whole blocks at a time
+            chunk = self.pending + self.fileobj.read(64 * 1024)
+            self.pending = ''
+            chunk += self.fileobj.read(-len(chunk) % AES.block_size)
+            if len(chunk) == 0:
+                break
+            self.buffer += self.cipher.decrypt(chunk)
+
+        # the plaintext was padded to a whole number of blocks
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        '''the underlying file object is left open'''
+        pass
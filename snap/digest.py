@@ -0,0 +1,126 @@
+# Routines to detect file modifications by comparing file contents
+#  against the digests recorded by the package system
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import hashlib
+import multiprocessing
+
+from snap.parallel import Parallel
+
+def _digest_modified(item):
+    '''compare a file against its expected digest, module level so it may
+       be run in a process pool
+
+    @param item - tuple of the path, the modified flag to return if there is
+                  no digest to compare against and the expected (size, digest, algorithm)
+    @returns - tuple of the path and boolean indicating if it was modified'''
+    path, modified, expected = item
+    if expected is None:
+        return path, modified
+    size, digest, algorithm = expected
+    return path, not FileDigest.matches(path, size, digest, algorithm)
+
+class FileDigest:
+    """Helpers to compute and compare the digests of file contents"""
+
+    # rpm PGPHASHALGO identifiers -> hashlib algorithm names
+    RPM_ALGORITHMS = { 1 : 'md5', 2 : 'sha1', 8 : 'sha256',
+                       9 : 'sha384', 10 : 'sha512', 11 : 'sha224' }
+
+    # number of files sent to each hashing process at a time
+    CHUNKSIZE = 16
+
+    def hash_file(path, algorithm='md5', chunksize=1024*1024):
+        '''return the hex digest of the contents of the specified file, streaming
+           it in chunks so memory use is independent of the file size'''
+        digest = hashlib.new(algorithm)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunksize)
+                if len(chunk) == 0:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+    hash_file = staticmethod(hash_file)
+
+    def matches(path, size, digest, algorithm='md5'):
+        '''return true if the specified file has the expected contents, the size is
+           compared first so that files of differing sizes are never hashed
+
+        @param path - the path to the file to check
+        @param size - the expected size of the file, None if unknown
+        @param digest - the expected hex digest of the file
+        @param algorithm - the hashlib name of the digest algorithm'''
+        try:
+            if size is not None and os.lstat(path).st_size != size:
+                return False
+            return FileDigest.hash_file(path, algorithm) == digest.lower()
+        except (IOError, OSError):
+            return False
+    matches = staticmethod(matches)
+
+    def classify(files, digest_for, modified, processes=None, cache=None, context_for=None):
+        '''generator yielding a (path, modified) tuple for each of the specified files,
+        in order, hashing the files across a pool of processes.
+
+        If a StatCache is specified, files unchanged since they were last classified
+        are not hashed again, the verdicts of those which are hashed are cached
+
+        @param files - iterable of paths to classify
+        @param digest_for - callable returning the expected (size, digest, algorithm)
+                            of a path or None if there is nothing to compare against
+        @param modified - callable used to classify paths without a digest
+        @param processes - the number of hashing processes, defaults to the configured number of jobs
+        @param cache - optional StatCache to look up and record verdicts in
+        @param context_for - callable returning the context string of a path, required with cache'''
+        if processes is None:
+            processes = Parallel.jobs()
+
+        # path -> (lstat result, context) of the files being hashed, to cache their verdicts
+        hashing = {}
+
+        def items():
+            for path in files:
+                expected = digest_for(path)
+                if expected is None:
+                    yield (path, modified(path), None)
+                    continue
+
+                if cache is not None:
+                    try:
+                        fs = os.lstat(path)
+                    except OSError:
+                        yield (path, None, expected)
+                        continue
+                    context = context_for(path)
+                    verdict = cache.verdict(path, fs, context)
+                    if verdict is not None:
+                        yield (path, verdict, None)
+                        continue
+                    hashing[path] = (fs, context)
+                yield (path, None, expected)
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            for path, is_modified in Parallel.imap(pool, _digest_modified, items(),
+                                                   processes, FileDigest.CHUNKSIZE):
+                if path in hashing:
+                    fs, context = hashing.pop(path)
+                    cache.record(path, fs, context, is_modified)
+                yield path, is_modified
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    classify = staticmethod(classify)
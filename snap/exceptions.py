@@ -60,3 +60,8 @@ class InvalidOperationError(SnapError):
     def __init__(self,message = ''):
         SnapError.__init__(self, message)
 
+class IntegrityError(SnapError):
+    """Data failed an integrity check, it has been corrupted or tampered with"""
+
+    def __init__(self,message = ''):
+        SnapError.__init__(self, message)
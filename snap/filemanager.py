@@ -12,11 +12,60 @@
 # GNU General Public License for more details.
 
 import os
+import stat
 import shutil
 import tempfile
 import subprocess
 
 import snap.exceptions
+from snap.filematcher import FileMatcher
+
+# use the native scandir if available, falling back to the scandir
+# backport and finally to a listdir / lstat based implementation
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+class _DirEntry(object):
+    """Minimal stand-in for os.DirEntry used when scandir is not available
+       and for the top level includes, caches the stat results of the path"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._lstat = None
+        self._stat  = None
+
+    def stat(self, follow_symlinks=True):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        if not follow_symlinks or not stat.S_ISLNK(self._lstat.st_mode):
+            return self._lstat
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_file(self, follow_symlinks=True):
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        try:
+            return stat.S_ISLNK(self.stat(False).st_mode)
+        except OSError:
+            return False
 
 class FileManager:
     """Snap file manager, performs many high level file operations"""
@@ -116,47 +165,115 @@ class FileManager:
         return stdout
     capture_output = staticmethod(capture_output)
 
+    def scan_dir(directory):
+        '''return an iterator over the DirEntries in the specified directory - static method
+
+        @param directory - the directory to scan
+        @raises OSError - if the directory could not be read'''
+        if scandir is not None:
+            return scandir(directory)
+        return [_DirEntry(os.path.join(directory, name)) for name in os.listdir(directory)]
+    scan_dir = staticmethod(scan_dir)
+
+    def walk(include=[], exclude=[], recursive=True, dirs=False):
+        '''generator yielding a DirEntry for each file in one or more directories - static method
+
+        Directories are scanned iteratively and only once, excluded directories are
+        pruned before they are descended into and symlinks to directories are yielded
+        rather than followed. The stat data cached on each DirEntry is available to
+        the caller.
+
+        @param include - list of files/directories/globs to include
+        @param exclude - list of files/directories/globs to exclude or a compiled FileMatcher
+        @param recursive - descend into subdirectories, if false the immediate children
+                           (including subdirectories) of each included directory are yielded
+        @param dirs - also yield entries for the subdirectories descended into'''
+        if len(include) == 0:
+            include = [snap.osregistry.OS.get_root()]
+        matcher = exclude
+        if not isinstance(matcher, FileMatcher):
+            matcher = FileMatcher(exclude)
+
+        for top in FileManager.__toplevel(FileMatcher.expand(include)):
+            if matcher.excludes(top):
+                continue
+
+            # includes are followed if they are symlinks to directories
+            top_entry = _DirEntry(top)
+            if not top_entry.is_dir():
+                if top_entry.is_file():
+                    yield top_entry
+                continue
+
+            # each directory to scan is paired with its node in the exclude trie
+            stack = [(top, matcher.subtree(top))]
+            while stack:
+                directory, node = stack.pop()
+                subdirs = []
+                try:
+                    for entry in FileManager.scan_dir(directory):
+                        excluded, child = matcher.excludes_child(node, entry.name, entry.path)
+                        if excluded:
+                            continue
+                        if recursive and entry.is_dir(follow_symlinks=False):
+                            if dirs:
+                                yield entry
+                            subdirs.append((entry.path, child))
+                        else:
+                            yield entry
+                except OSError:
+                    pass # silently ignore unreadable directories
+
+                # preserve listing order when descending
+                subdirs.reverse()
+                stack.extend(subdirs)
+    walk = staticmethod(walk)
+
+    def iter_files(include=[], exclude=[], recursive=True):
+        '''generator yielding the paths of the files in one or more directories - static method
+
+        @param include - list of files/directories/globs to include
+        @param exclude - list of files/directories/globs to exclude or a compiled FileMatcher
+        @param recursive - descend into subdirectories'''
+        for entry in FileManager.walk(include, exclude, recursive):
+            yield entry.path
+    iter_files = staticmethod(iter_files)
+
     def get_all_files(include=[], exclude=[], recursive=True):
         '''return a list of paths corresponding to files in one or more directories - static method
 
-        @param include - list of files/directories to include
-        @param exclude - list of files/directories to exclude'''
-        if len(include) == 0:
-            include.append(snap.osregistry.OS.get_root())
-        
-        files = []
-        # iterate over each include in the list
-        for ifile in include:
-            try:
-                # if its a file, simple add if we haven't already
-                if os.path.isfile(ifile):
-                    if not ifile in files and \
-                       not ifile in exclude:
-                        files.append(ifile)
-
-                # if its a directory add all files in it and its subdirs
-                elif os.path.isdir(ifile):
-                    idir = ifile
-
-                    children = os.listdir(idir) + \
-                               FileManager.get_all_subdirectories(idir)
-
-                    for child in children:
-                        fullpath = os.path.join(idir, child)
-                        if not fullpath in exclude:
-                            cfiles = [fullpath]
-                            if recursive and os.path.isdir(fullpath):
-                                cfiles = FileManager.get_all_files(cfiles, exclude)
-                            for cpath in cfiles:
-                                if not cpath in files and \
-                                   not cpath in exclude:
-                                    files.append(cpath)
-
-            except:
-                pass # silently ignore errors
-        return files
+        @param include - list of files/directories/globs to include
+        @param exclude - list of files/directories/globs to exclude or a compiled FileMatcher'''
+        return list(FileManager.iter_files(include, exclude, recursive))
     get_all_files = staticmethod(get_all_files)
 
+    def __toplevel(include):
+        '''helper to remove duplicate includes and those nested under other includes
+        so that no part of the tree is walked more than once'''
+        tops = set()
+        for path in sorted(set(include), key=len):
+            parent = path
+            nested = False
+            while True:
+                if parent in tops:
+                    nested = True
+                    break
+                next_parent = os.path.dirname(parent)
+                if next_parent == parent:
+                    break
+                parent = next_parent
+            if not nested:
+                tops.add(path)
+
+        # preserve the order the includes were specified in
+        toplevel = []
+        for path in include:
+            if path in tops:
+                toplevel.append(path)
+                tops.remove(path)
+        return toplevel
+    __toplevel = staticmethod(__toplevel)
+
     def get_all_subdirectories(directory=None, recursive=False):
         '''return a list of full paths to subdirectories under the specified directory
         
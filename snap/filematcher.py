@@ -0,0 +1,179 @@
+# Compiled include / exclude matcher for file targets
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import re
+import glob
+
+# key marking an excluded node in the exclude trie
+_EXCLUDED = None
+
+class FileMatcher(object):
+    """Matches paths against a set of excludes compiled once up front.
+
+       Excludes may be specified as:
+         - plain paths, excluding the file or the entire directory subtree
+         - globs without a path seperator (eg '*.log'), matched against file names
+         - globs with a path seperator (eg '/home/*/.cache'), matched against full paths
+         - regular expressions prefixed with 're:', matched against full paths
+
+       Plain paths are stored in a trie of path components so that a directory
+       walk can check each entry in constant time, all globs and regexes are
+       combined into a single regular expression each."""
+
+    REGEX_PREFIX = 're:'
+
+    GLOB_CHARS = re.compile('[*?[]')
+
+    def __init__(self, exclude=[]):
+        '''compile the matcher
+
+        @param exclude - list of paths / globs / regexes to exclude'''
+        self.trie = {}
+
+        name_patterns = []
+        path_patterns = []
+        for pattern in exclude:
+            if pattern.startswith(FileMatcher.REGEX_PREFIX):
+                path_patterns.append(pattern[len(FileMatcher.REGEX_PREFIX):])
+            elif FileMatcher.is_glob(pattern):
+                if os.sep in pattern:
+                    path_patterns.append(FileMatcher.translate(os.path.normpath(pattern)))
+                else:
+                    name_patterns.append(FileMatcher.translate(pattern))
+            else:
+                node = self.trie
+                for component in FileMatcher.split(pattern):
+                    node = node.setdefault(component, {})
+                node[_EXCLUDED] = True
+
+        self.name_re = FileMatcher.__combine(name_patterns)
+        self.path_re = FileMatcher.__combine(path_patterns)
+
+    def is_glob(pattern):
+        '''return true if the specified pattern contains glob characters'''
+        return FileMatcher.GLOB_CHARS.search(pattern) is not None
+    is_glob = staticmethod(is_glob)
+
+    def split(path):
+        '''split the specified path into its components, the root of an
+           absolute path is represented by a leading empty component'''
+        path = os.path.normpath(path).rstrip(os.sep)
+        if path == '':
+            return ['']
+        return path.split(os.sep)
+    split = staticmethod(split)
+
+    def translate(pattern):
+        '''convert the specified glob into a regular expression, '*' and '?'
+           do not match path seperators, '**' matches across directories'''
+        sep = re.escape(os.sep)
+        i, n = 0, len(pattern)
+        res = ''
+        while i < n:
+            c = pattern[i]
+            i += 1
+            if c == '*':
+                if i < n and pattern[i] == '*':
+                    i += 1
+                    res += '.*'
+                else:
+                    res += '[^' + sep + ']*'
+            elif c == '?':
+                res += '[^' + sep + ']'
+            elif c == '[':
+                j = pattern.find(']', i + 1 if i < n and pattern[i] in '!]' else i)
+                if j == -1:
+                    res += '\\['
+                else:
+                    stuff = pattern[i:j].replace('\\', '\\\\')
+                    if stuff.startswith('!'):
+                        stuff = '^' + stuff[1:]
+                    res += '[' + stuff + ']'
+                    i = j + 1
+            else:
+                res += re.escape(c)
+        return res
+    translate = staticmethod(translate)
+
+    def __combine(patterns):
+        '''helper to compile the patterns into a single anchored regex'''
+        if len(patterns) == 0:
+            return None
+        # the anchor applies to the whole alternation, not just its last pattern
+        return re.compile('(?:(?:' + ')|(?:'.join(patterns) + '))\\Z')
+    __combine = staticmethod(__combine)
+
+    def expand(include):
+        '''return the includes with any globs expanded to the paths they match'''
+        expanded = []
+        for path in include:
+            if FileMatcher.is_glob(path):
+                expanded += sorted(glob.glob(path))
+            else:
+                expanded.append(path)
+        return expanded
+    expand = staticmethod(expand)
+
+    def matches_pattern(self, path, name):
+        '''return true if the specified path matches any of the glob / regex excludes'''
+        return (self.name_re is not None and self.name_re.match(name) is not None) or \
+               (self.path_re is not None and self.path_re.match(path) is not None)
+
+    def excludes(self, path):
+        '''return true if the specified path, or any directory containing it, is excluded
+
+        @param path - the path to check
+        @returns - boolean indicating if the path is excluded'''
+        node = self.trie
+        current = None
+        for component in FileMatcher.split(path):
+            if current is None:
+                current = component or os.sep
+            elif current.endswith(os.sep):
+                current += component
+            else:
+                current += os.sep + component
+
+            if node is not None:
+                node = node.get(component)
+                if node is not None and _EXCLUDED in node:
+                    return True
+            if component and self.matches_pattern(current, component):
+                return True
+        return False
+
+    def subtree(self, path):
+        '''return the trie node corresponding to the specified directory, or None if
+           there are no plain path excludes underneath it'''
+        node = self.trie
+        for component in FileMatcher.split(path):
+            node = node.get(component)
+            if node is None:
+                return None
+        return node
+
+    def excludes_child(self, node, name, path):
+        '''check a directory entry against the matcher during a walk, the parent
+           directory is assumed to already have been checked
+
+        @param node - the trie node of the parent directory as returned by subtree / excludes_child
+        @param name - the name of the entry
+        @param path - the full path of the entry
+        @returns - tuple of a boolean indicating if the entry is excluded and its trie node'''
+        child = None
+        if node is not None:
+            child = node.get(name)
+            if child is not None and _EXCLUDED in child:
+                return True, child
+        return self.matches_pattern(path, name), child
@@ -0,0 +1,128 @@
+# Helpers to take and restore snapshots incrementally against a parent snapfile
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import tempfile
+
+import snap
+from snap.filemanager        import FileManager
+from snap.metadata.sfile     import SFile, FilesRecordFile
+from snap.metadata.snapfile  import SnapFile
+from snap.metadata.snapindex import SnapIndex
+
+class Incremental:
+    """A parent snapfile, the files record of which later snapshots are
+       taken against. Files unchanged since the parent are recorded as
+       inherited rather than being archived again, restoring a snapshot
+       replays the chain of parents to retrieve them"""
+
+    def __init__(self, snapfile, encryption_password=None):
+        '''initialize the incremental parent
+
+        @param snapfile - the path to the parent snapfile
+        @param encryption_password - the password the parent was encrypted with, if any'''
+        self.snapfile = os.path.abspath(snapfile)
+        self.encryption_password = encryption_password
+
+    def parent():
+        '''return the parent configured to take the backup against, else None'''
+        if snap.config.options.incremental_from is None:
+            return None
+        return Incremental(snap.config.options.incremental_from,
+                           snap.config.options.encryption_password)
+    parent = staticmethod(parent)
+
+    def record(self):
+        '''return the files record of the parent snapfile, read without
+           extracting anything else from it
+
+        @returns - tuple of the record file and the SFiles it contains'''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            SnapFile(self.snapfile, tmpdir, self.encryption_password).extract_only(['files.xml'])
+            record = FilesRecordFile(os.path.join(tmpdir, "files.xml"))
+            if not os.path.isfile(record.recordfile):
+                return record, []
+            # read in full, the record file is removed along with the directory
+            return record, list(record.read())
+        finally:
+            FileManager.rm_dir(tmpdir)
+
+    def manifest(self):
+        '''return a dict of the paths recorded by the parent snapshot to their SFiles'''
+        record, sfiles = self.record()
+        return dict((sfile.path, sfile) for sfile in sfiles)
+
+    def extract_inherited(self, paths, basedir):
+        '''extract the contents of the specified inherited files into basedir,
+           from whichever snapfile in the chain of parents archived them
+
+        @param paths - the paths of the inherited files, as recorded
+        @param basedir - the snap working directory to extract them to
+        @returns - the paths which could not be found in the chain'''
+        remaining = set(paths)
+        snapfile = self.snapfile
+        while len(remaining) > 0 and snapfile is not None:
+            if snap.config.options.log_level_at_least('verbose'):
+                snap.callback.snapcallback.message("Retrieving inherited files from " + snapfile)
+
+            parent = Incremental(snapfile, self.encryption_password)
+            record, sfiles = parent.record()
+            archived = [sfile.path for sfile in sfiles
+                        if not sfile.inherited and sfile.path in remaining]
+            if len(archived) > 0:
+                SnapFile(snapfile, basedir, self.encryption_password).extract_only(archived)
+                remaining.difference_update(archived)
+            snapfile = record.parent
+        return remaining
+
+    def deleted(self, manifest, sfiles, fs_root):
+        '''return the paths recorded by the parent which have since been deleted
+
+        @param manifest - the manifest of the parent, as returned by manifest()
+        @param sfiles - the SFiles recorded by the current snapshot
+        @param fs_root - the root of the filesystem the paths are relative to'''
+        current = set(sfile.path for sfile in sfiles)
+        return [path for path in manifest if not path in current and
+                not os.path.lexists(Incremental.__restore_path(path, fs_root))]
+
+    def restore_inherited(self, sfiles, basedir):
+        '''extract the inherited files among those specified into basedir, only
+           those being restored are retrieved if restoring specific files
+
+        @param sfiles - the SFiles recorded by the snapshot being restored
+        @param basedir - the snap working directory to extract them to'''
+        inherited = [sfile.path for sfile in sfiles if sfile.inherited]
+        if snap.config.options.restore_only:
+            targets = SnapIndex.targets([SFile(path).escaped_path(basedir)
+                                         for path in snap.config.options.restore_only])
+            inherited = [path for path in inherited if SnapIndex.matches(SnapIndex.archive_name(path), targets)]
+
+        for path in self.extract_inherited(inherited, basedir):
+            if snap.config.options.log_level_at_least('normal'):
+                snap.callback.snapcallback.warn("Could not find inherited file " + path)
+
+    def remove_deleted(paths, fs_root):
+        '''remove the files recorded as deleted since the parent snapshot'''
+        for path in paths:
+            target = Incremental.__restore_path(path, fs_root)
+            if os.path.isfile(target) or os.path.islink(target):
+                if snap.config.options.log_level_at_least('verbose'):
+                    snap.callback.snapcallback.message("Removing deleted file " + target)
+                FileManager.rm(target)
+    remove_deleted = staticmethod(remove_deleted)
+
+    def __restore_path(path, fs_root):
+        '''helper to return the location a recorded path is restored to'''
+        return os.path.join(fs_root, SFile(path).escaped_path(fs_root))
+    __restore_path = staticmethod(__restore_path)
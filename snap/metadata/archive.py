@@ -0,0 +1,90 @@
+# Entries streamed directly from the filesystem into the snapfile
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import threading
+
+class ArchiveEntry(object):
+    """A file to be written to the snapfile straight from its original location"""
+
+    def __init__(self, source, name, fs):
+        '''initialize the entry
+
+        @param source - the path to the file on the filesystem
+        @param name - the path of the file relative to the snap working directory
+        @param fs - the lstat result of the source file'''
+        self.source = source
+        self.name = name
+        self.fs = fs
+
+class DirectArchive(object):
+    """Files registered to be streamed into the snapfile when it is created.
+
+       When a direct archive is registered for a snap working directory,
+       backends record the files they back up here instead of copying them
+       into the working directory, only the small record files are staged
+       there. The snapfile then writes the registered entries after the
+       contents of the working directory, in the order they were added."""
+
+    # snap working directory -> DirectArchive registered for it
+    archives = {}
+
+    def __init__(self, basedir):
+        '''initialize the direct archive
+
+        @param basedir - the snap working directory the entries are relative to'''
+        self.basedir = basedir
+        self.entries = []
+        self.lock = threading.Lock()
+
+    def register(basedir):
+        '''create and return a direct archive for the specified working directory'''
+        basedir = os.path.abspath(basedir)
+        archive = DirectArchive(basedir)
+        DirectArchive.archives[basedir] = archive
+        return archive
+    register = staticmethod(register)
+
+    def unregister(basedir):
+        '''discard the direct archive registered for the specified working directory'''
+        DirectArchive.archives.pop(os.path.abspath(basedir), None)
+    unregister = staticmethod(unregister)
+
+    def lookup(basedir):
+        '''return the direct archive registered for the specified working directory, or
+           the working directory it is under, else None'''
+        if len(DirectArchive.archives) == 0:
+            return None
+        basedir = os.path.abspath(basedir)
+        while True:
+            archive = DirectArchive.archives.get(basedir)
+            parent = os.path.dirname(basedir)
+            if archive is not None or parent == basedir:
+                return archive
+            basedir = parent
+    lookup = staticmethod(lookup)
+
+    def add(self, source, name):
+        '''register the specified file to be written to the snapfile, files which
+           no longer exist are skipped
+
+        @param source - the path to the file on the filesystem
+        @param name - the path of the file relative to the working directory
+        @returns - boolean indicating if the file was registered'''
+        try:
+            fs = os.lstat(source)
+        except OSError:
+            return False
+        with self.lock:
+            self.entries.append(ArchiveEntry(source, name, fs))
+        return True
@@ -0,0 +1,210 @@
+# Batched replication of the ownership, permissions and times of copied files
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import stat
+import errno
+import base64
+import urllib
+import threading
+import multiprocessing.pool
+
+import snap
+from snap.parallel import Parallel
+
+# extended attribute support is optional, posix acls are stored
+# as extended attributes and are replicated along with them
+try:
+    import xattr
+except ImportError:
+    xattr = None
+
+class AttributeReplicator:
+    """Replicates the attributes of source files onto their copies.
+
+       Rather than being applied as each file is copied, the attributes are
+       queued here, from stat results already collected, and applied in
+       batches across a thread pool. Each path is changed once, directories
+       only when everything has been copied so that copying their contents
+       does not change their times. The extended attributes of the source,
+       including its acls, are copied if the xattr module is available.
+       See ArchivedAttributes for how they are carried through snapfiles."""
+
+    # number of queued files at which their attributes are applied
+    BATCHSIZE = 4096
+
+    # number of paths handed to a worker thread at a time
+    CHUNKSIZE = 64
+
+    # errors copying extended attributes which are ignored, the destination
+    # filesystem may not support them or the attribute may be privileged
+    XATTR_ERRORS = tuple(getattr(errno, name) for name in ('ENOTSUP', 'EOPNOTSUPP', 'EPERM', 'EACCES', 'ENODATA')
+                         if hasattr(errno, name))
+
+    def __init__(self, jobs=None):
+        '''initialize the replicator
+
+        @param jobs - the number of threads to apply the attributes with, defaults to the configured number of jobs'''
+        if jobs is None:
+            jobs = Parallel.jobs()
+        self.jobs = jobs
+        self.lock = threading.Lock()
+
+        # lists of (path, lstat result of the source, source path) to apply
+        self.files = []
+        self.directories = []
+
+    def add(self, path, fs, source=None):
+        '''queue the attributes of the source to be applied to the path
+
+        @param path - the path to the copy
+        @param fs - the lstat result of the source
+        @param source - the path to the source to copy extended attributes from, if any'''
+        item = (path, fs, source)
+        with self.lock:
+            if stat.S_ISDIR(fs.st_mode):
+                self.directories.append(item)
+                return
+            self.files.append(item)
+            if len(self.files) < AttributeReplicator.BATCHSIZE:
+                return
+            batch = self.files
+            self.files = []
+        self.__apply(batch)
+
+    def apply(self):
+        '''apply the attributes of everything queued, directories last and the
+           deepest of them first'''
+        with self.lock:
+            files = self.files
+            directories = self.directories
+            self.files = []
+            self.directories = []
+        self.__apply(files)
+        directories.sort(key=lambda item: item[0].count(os.sep), reverse=True)
+        self.__apply(directories)
+
+    def __apply(self, items):
+        '''helper to apply the attributes of the items across a thread pool'''
+        if len(items) == 0:
+            return
+        if len(items) <= AttributeReplicator.CHUNKSIZE:
+            for item in items:
+                AttributeReplicator.replicate(*item)
+            return
+
+        pool = multiprocessing.pool.ThreadPool(self.jobs)
+        try:
+            for result in Parallel.imap(pool, lambda item: AttributeReplicator.replicate(*item),
+                                        items, self.jobs, AttributeReplicator.CHUNKSIZE):
+                pass
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def replicate(path, fs, source=None):
+        '''apply the ownership, permissions, times and extended attributes of a source to the path
+
+        @param path - the path to the copy
+        @param fs - the lstat result of the source
+        @param source - the path to the source to copy extended attributes from, if any'''
+        if snap.osregistry.OS.is_linux():
+            os.lchown(path, fs.st_uid, fs.st_gid)
+        if stat.S_ISLNK(fs.st_mode):
+            return
+        if source is not None and xattr is not None:
+            AttributeReplicator.__copy_xattrs(source, path)
+        os.chmod(path, stat.S_IMODE(fs.st_mode))
+        os.utime(path, (fs.st_atime, fs.st_mtime))
+    replicate = staticmethod(replicate)
+
+    def __copy_xattrs(source, path):
+        '''helper to copy the extended attributes of the source to the path'''
+        try:
+            names = xattr.listxattr(source, True)
+        except (IOError, OSError), e:
+            if e.errno in AttributeReplicator.XATTR_ERRORS:
+                return
+            raise
+        for name in names:
+            try:
+                xattr.setxattr(path, name, xattr.getxattr(source, name, True), 0, True)
+            except (IOError, OSError), e:
+                if not e.errno in AttributeReplicator.XATTR_ERRORS:
+                    raise
+    __copy_xattrs = staticmethod(__copy_xattrs)
+
+class ArchivedAttributes:
+    """Extended attributes, including acls, stored with the members of snapfiles.
+
+       The attributes of a member are written as pax records before its header,
+       in the LIBARCHIVE.xattr.<name> form bsdtar uses: the name is url encoded
+       and the value base64 encoded. Binary values therefore survive python 2's
+       tarfile, which decodes every pax record as utf-8. The SCHILY.xattr.<name>
+       records GNU tar writes are also applied when restoring, if they could be
+       decoded. Nothing is stored or applied if the xattr module is unavailable."""
+
+    PREFIX = 'LIBARCHIVE.xattr.'
+
+    SCHILY_PREFIX = 'SCHILY.xattr.'
+
+    def pax_headers(path):
+        '''return the pax records storing the extended attributes of the path
+
+        @param path - the path to read the extended attributes of, links are not followed
+        @returns - dict of the records, empty if there are no attributes to store'''
+        if xattr is None:
+            return {}
+        try:
+            names = xattr.listxattr(path, True)
+        except (IOError, OSError), e:
+            if e.errno in AttributeReplicator.XATTR_ERRORS:
+                return {}
+            raise
+
+        headers = {}
+        for name in names:
+            try:
+                value = xattr.getxattr(path, name, True)
+            except (IOError, OSError), e:
+                if e.errno in AttributeReplicator.XATTR_ERRORS:
+                    continue
+                raise
+            headers[unicode(ArchivedAttributes.PREFIX + urllib.quote(name))] = unicode(base64.b64encode(value))
+        return headers
+    pax_headers = staticmethod(pax_headers)
+
+    def restore(tarinfo, path):
+        '''apply the extended attributes stored with the member to the path, failures
+           to do so are ignored as they are when copying them
+
+        @param tarinfo - the TarInfo of the member
+        @param path - the path the member was extracted to'''
+        if xattr is None or len(tarinfo.pax_headers) == 0:
+            return
+        for key, value in tarinfo.pax_headers.items():
+            if key.startswith(ArchivedAttributes.PREFIX):
+                name = urllib.unquote(key[len(ArchivedAttributes.PREFIX):].encode('utf-8'))
+                value = base64.b64decode(value)
+            elif key.startswith(ArchivedAttributes.SCHILY_PREFIX):
+                name = key[len(ArchivedAttributes.SCHILY_PREFIX):].encode('utf-8')
+                value = value.encode('utf-8')
+            else:
+                continue
+            try:
+                xattr.setxattr(path, name, value, 0, True)
+            except (IOError, OSError), e:
+                if not e.errno in AttributeReplicator.XATTR_ERRORS:
+                    raise
+    restore = staticmethod(restore)
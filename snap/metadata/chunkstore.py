@@ -0,0 +1,484 @@
+# Content addressed store deduplicating the chunks of snapshot files
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import stat
+import zlib
+import gzip
+import bisect
+import shutil
+import socket
+import hashlib
+import tempfile
+import collections
+import multiprocessing
+
+import snap
+from snap.parallel   import Parallel
+from snap.filemanager import FileManager
+from snap.exceptions import MissingDirError, MissingFileError, InvalidOperationError
+from snap.metadata.snapindex import SnapIndex
+
+# numpy is optional, if present the rolling hash is computed with it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# gear table for the rolling hash, derived from md5 so it is stable everywhere
+_GEAR = [int(hashlib.md5(chr(i)).hexdigest()[:16], 16) for i in range(256)]
+
+_MASK64 = (1 << 64) - 1
+
+if numpy is not None:
+    _GEAR_ARRAY = numpy.array(_GEAR, dtype=numpy.uint64)
+
+def _segment_candidates(task):
+    '''locate the offsets a segment of a file may be split at, module level so
+       it may be run in a process pool
+
+    @param task - tuple of the path to the file and the offset and length of the segment
+    @returns - list of the offsets in the file, as returned by ChunkStore.candidates'''
+    path, offset, length = task
+    head = min(offset, ChunkStore.WINDOW - 1)
+    with open(path, 'rb') as f:
+        f.seek(offset - head)
+        data = f.read(head + length)
+    return [offset + end for end in ChunkStore.candidates(data[head:], data[:head])]
+
+def _store_chunks(task):
+    '''store the chunks of a file not yet in the store, module level so it may
+       be run in a process pool
+
+    @param task - tuple of the store directory, the path to the file and the
+                  list of (start, end) offsets of consecutive chunks in it
+    @returns - tuple of the digests of the chunks and the number of bytes stored'''
+    storedir, path, chunks = task
+    offset = chunks[0][0]
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(chunks[-1][1] - offset)
+
+    digests = []
+    stored = 0
+    for start, end in chunks:
+        chunk = data[start - offset:end - offset]
+        digest = hashlib.sha256(chunk).hexdigest()
+        digests.append(digest)
+        stored += ChunkStore.put(storedir, digest, chunk)
+    return digests, stored
+
+class ChunkEntry(object):
+    """An entry in a chunk store snapshot manifest"""
+
+    def __init__(self, name, type, mode, uid, gid, mtime, size=0, data=''):
+        '''initialize the entry
+
+        @param name - the path of the entry relative to the snap working directory
+        @param type - 'f' for files, 'd' for directories and 'l' for symlinks
+        @param data - the comma seperated chunk digests of files, the target of symlinks'''
+        self.name = name
+        self.type = type
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.size = size
+        self.data = data
+
+    def dump(self):
+        '''return the entry serialized as a manifest line'''
+        return '%s\t%o\t%d\t%d\t%r\t%d\t%s\t%s' % (self.type, self.mode, self.uid, self.gid,
+                 self.mtime, self.size, self.data.encode('string_escape'), self.name.encode('string_escape'))
+
+    def parse(line):
+        '''return the entry serialized in the specified manifest line'''
+        type, mode, uid, gid, mtime, size, data, name = line.split('\t', 7)
+        return ChunkEntry(name.decode('string_escape'), type, int(mode, 8), int(uid), int(gid),
+                          float(mtime), int(size), data.decode('string_escape'))
+    parse = staticmethod(parse)
+
+class ChunkStore:
+    """Output format storing the contents of the snap working directory as
+       content defined chunks in a local store shared between snapshots.
+
+       Chunk boundaries are picked with a gear rolling hash so that identical
+       data is split identically regardless of where it occurs, each chunk is
+       stored once, compressed, under the sha256 of its contents. The snapshot
+       itself is a small gzipped manifest listing the entries of the working
+       directory and the digests of the chunks making up each file.
+
+       Files are chunked in three phases. The offsets the hash permits a chunk
+       to end at are located across a process pool, segment by segment, with
+       numpy if it is available. The chunks are then picked from those offsets
+       over the whole file, so boundaries do not depend on the segments. Last
+       they are read and stored across the pool. Files whose size and mtime
+       match those recorded in the previous manifest written to the store by
+       the same host, and whose chunks are all still present, are not read at
+       all. Stores may be shared between hosts, so each keeps its own copy."""
+
+    VERSION = 'snapmanifest 1'
+
+    # copies of the last manifest written to the store by each host, kept in
+    # the store directory under this name followed by the host identifier
+    LATEST = 'latest.'
+
+    # file identifying the host, its hostname is used if it does not exist
+    MACHINE_ID = '/etc/machine-id'
+
+    # chunk sizes, boundaries are where the top bits of the rolling hash
+    # masked by BOUNDARY_MASK are zero, averaging 64KB chunks
+    MIN_CHUNK = 16 * 1024
+    MAX_CHUNK = 256 * 1024
+    BOUNDARY_MASK = 0xffff << 48
+
+    # the number of bytes the rolling hash depends on
+    WINDOW = 64
+
+    # the number of bytes hashed with numpy at a time
+    HASH_BLOCK = 1024 * 1024
+
+    # files are split into segments of this size which are hashed and stored in parallel
+    SEGMENT = 16 * 1024 * 1024
+
+    def __init__(self, manifest, snapdirectory, storedir, host=None):
+        '''initialize the chunk store snapshot
+
+        @param manifest - the path to the manifest to create / read
+        @param snapdirectory - the path to the directory to store / restore
+        @param storedir - the path to the directory of the chunk store
+        @param host - identifier of the host the snapshot is of, defaults to that of this host
+        @raises - MissingDirError - if the snapdirectory is invalid'''
+        if not os.path.isdir(snapdirectory):
+            raise MissingDirError(snapdirectory + " is an invalid snap working directory ")
+        if host is None:
+            host = ChunkStore.host()
+        self.manifest = manifest
+        self.snapdirectory = snapdirectory
+        self.storedir = storedir
+        self.host = host
+
+    def host():
+        '''return the identifier of this host, its machine id if it has one, else its
+           hostname. Machine ids are used where available as cloned hosts may share names'''
+        try:
+            with open(ChunkStore.MACHINE_ID) as f:
+                machine_id = f.read().strip()
+            if machine_id != '':
+                return machine_id
+        except IOError:
+            pass
+        return socket.gethostname()
+    host = staticmethod(host)
+
+    def __latest(self):
+        '''helper to return the path to the copy of the last manifest written by the host'''
+        return os.path.join(self.storedir, ChunkStore.LATEST + self.host.replace(os.sep, '_'))
+
+    def boundaries(data):
+        '''generator yielding the (start, end) offsets of the content defined chunks of data'''
+        return ChunkStore.select(ChunkStore.candidates(data), len(data))
+    boundaries = staticmethod(boundaries)
+
+    def candidates(data, head=''):
+        '''return the offsets in data a chunk may end at, those just after the bytes
+           at which the rolling hash of the WINDOW bytes up to them has the bits of
+           BOUNDARY_MASK clear
+
+        @param data - the data to locate the offsets in
+        @param head - the data preceding it, if any, so that the offsets found do
+                      not depend on where the data was split
+        @returns - sorted list of the offsets relative to the start of data'''
+        head = head[len(head) - min(len(head), ChunkStore.WINDOW - 1):]
+        if numpy is None:
+            return ChunkStore.__scan(head + data, len(head))
+
+        # the hash of each window is the sum of the gear values of its bytes,
+        # each shifted left by its distance from the end of the window. The sums
+        # are built up by doubling the length of the windows they cover
+        ends = []
+        mask = numpy.uint64(ChunkStore.BOUNDARY_MASK)
+        for offset in xrange(0, len(data), ChunkStore.HASH_BLOCK):
+            if offset > 0:
+                head = data[offset - ChunkStore.WINDOW + 1:offset]
+            block = head + data[offset:offset + ChunkStore.HASH_BLOCK]
+            h = _GEAR_ARRAY[numpy.frombuffer(block, dtype=numpy.uint8)]
+            shift = 1
+            while shift < ChunkStore.WINDOW:
+                h[shift:] += h[:-shift] << numpy.uint64(shift)
+                shift *= 2
+            hits = numpy.flatnonzero((h & mask) == 0)
+            hits = hits[hits >= len(head)]
+            ends.extend((hits + (offset - len(head) + 1)).tolist())
+        return ends
+    candidates = staticmethod(candidates)
+
+    def __scan(buf, skip):
+        '''helper to compute the rolling hash one byte at a time, when numpy is not available'''
+        buf = bytearray(buf)
+        gear = _GEAR
+        mask = ChunkStore.BOUNDARY_MASK
+        ends = []
+        h = 0
+        for i, byte in enumerate(buf):
+            h = ((h << 1) + gear[byte]) & _MASK64
+            if not h & mask and i >= skip:
+                ends.append(i - skip + 1)
+        return ends
+    __scan = staticmethod(__scan)
+
+    def select(candidates, length, start=0):
+        '''generator yielding the (start, end) offsets of the content defined chunks
+
+        @param candidates - sorted list of the offsets chunks may end at
+        @param length - the length of the data
+        @param start - the offset of the first chunk'''
+        while start < length:
+            end = min(start + ChunkStore.MAX_CHUNK, length)
+            minimum = start + ChunkStore.MIN_CHUNK
+            if minimum < end:
+                # the first offset past the minimum chunk size, if before the maximum
+                i = bisect.bisect_right(candidates, minimum)
+                if i < len(candidates) and candidates[i] < end:
+                    end = candidates[i]
+            yield start, end
+            start = end
+    select = staticmethod(select)
+
+    def chunk_path(storedir, digest):
+        '''return the path the chunk with the specified digest is stored at'''
+        return os.path.join(storedir, digest[:2], digest[2:])
+    chunk_path = staticmethod(chunk_path)
+
+    def put(storedir, digest, chunk):
+        '''store the chunk unless it is already present
+
+        @returns - the number of bytes stored, 0 if the chunk was already present'''
+        path = ChunkStore.chunk_path(storedir, digest)
+        if os.path.exists(path):
+            return 0
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+        # written to a temp file and renamed so concurrent writers never
+        # expose a partially written chunk
+        data = zlib.compress(chunk)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+        return len(data)
+    put = staticmethod(put)
+
+    def get(storedir, digest):
+        '''return the contents of the chunk with the specified digest
+
+        @raises MissingFileError - if the chunk is not in the store'''
+        try:
+            with open(ChunkStore.chunk_path(storedir, digest), 'rb') as f:
+                return zlib.decompress(f.read())
+        except IOError:
+            raise MissingFileError("chunk " + digest + " missing from store " + storedir)
+    get = staticmethod(get)
+
+    def __entries(self):
+        '''helper to return the entries of the snap working directory and the
+           paths of the files among them'''
+        entries = []
+        paths = []
+        seperator = snap.osregistry.OS.get_path_seperator()
+        for direntry in FileManager.walk(include=[self.snapdirectory], dirs=True):
+            name = direntry.path.replace(self.snapdirectory + seperator, "")
+            try:
+                fs = direntry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            entry = ChunkEntry(name, None, stat.S_IMODE(fs.st_mode), fs.st_uid, fs.st_gid, fs.st_mtime)
+            if stat.S_ISDIR(fs.st_mode):
+                entry.type = 'd'
+            elif stat.S_ISLNK(fs.st_mode):
+                entry.type = 'l'
+                entry.data = os.readlink(direntry.path)
+            elif stat.S_ISREG(fs.st_mode):
+                entry.type = 'f'
+                entry.size = fs.st_size
+                paths.append((len(entries), direntry.path))
+            else:
+                continue
+            entries.append(entry)
+        return entries, paths
+
+    def __previous(self):
+        '''helper to return the file entries of the last manifest written to the
+           store by the host by name, empty if there is not one'''
+        latest = self.__latest()
+        if not os.path.isfile(latest):
+            return {}
+        try:
+            entries = ChunkStore(latest, self.snapdirectory, self.storedir).read()
+        except (IOError, ValueError, MissingFileError):
+            return {}
+        return dict((entry.name, entry) for entry in entries if entry.type == 'f')
+
+    def __unchanged(self, entry, previous):
+        '''helper to return true if the file entry is unchanged since the previous
+           manifest and all of its chunks are still in the store'''
+        if previous is None or previous.size != entry.size or previous.mtime != entry.mtime:
+            return False
+        for digest in filter(None, previous.data.split(',')):
+            if not os.path.exists(ChunkStore.chunk_path(self.storedir, digest)):
+                return False
+        return True
+
+    def write(self):
+        '''store the contents of the snapdirectory, writing the manifest referencing them'''
+        if self.manifest == '-':
+            raise InvalidOperationError("chunk store manifests cannot be written to stdout")
+
+        entries, paths = self.__entries()
+
+        # files unchanged since the previous manifest take their chunks from it
+        previous = self.__previous()
+        changed = []
+        for index, path in paths:
+            entry = entries[index]
+            if self.__unchanged(entry, previous.get(entry.name)):
+                entry.data = previous[entry.name].data
+            elif entry.size > 0:
+                changed.append((index, path))
+
+        # the owners of the batches of chunks submitted to be stored, in order
+        owners = collections.deque()
+
+        def batches(candidates):
+            '''generator picking the chunks of each file over the whole of it, from the
+               offsets located in its segments, and yielding them in batches to store'''
+            for index, path in changed:
+                size = entries[index].size
+                offsets = []
+                for offset in range(0, size, ChunkStore.SEGMENT):
+                    offsets += candidates.next()
+                batch = []
+                for chunk in ChunkStore.select(offsets, size):
+                    batch.append(chunk)
+                    if chunk[1] - batch[0][0] >= ChunkStore.SEGMENT or chunk[1] == size:
+                        owners.append(index)
+                        yield self.storedir, path, batch
+                        batch = []
+
+        segments = [(path, offset, min(ChunkStore.SEGMENT, entries[index].size - offset))
+                    for index, path in changed for offset in range(0, entries[index].size, ChunkStore.SEGMENT)]
+        chunks = dict((index, []) for index, path in changed)
+        stored = 0
+        jobs = Parallel.jobs()
+        pool = multiprocessing.Pool(jobs)
+        try:
+            # the segments are hashed and the chunks stored in the same pool,
+            # batches are stored as soon as the segments they span are hashed
+            candidates = Parallel.imap(pool, _segment_candidates, segments, jobs)
+            for digests, nbytes in Parallel.imap(pool, _store_chunks, batches(candidates), jobs):
+                chunks[owners.popleft()] += digests
+                stored += nbytes
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        for index in chunks:
+            entries[index].data = ','.join(chunks[index])
+
+        manifest = gzip.open(self.manifest, 'wb')
+        try:
+            manifest.write(ChunkStore.VERSION + '\n')
+            for entry in entries:
+                manifest.write(entry.dump() + '\n')
+        finally:
+            manifest.close()
+
+        # the manifest is kept in the store for the next snapshot to compare against
+        if not os.path.isdir(self.storedir):
+            os.makedirs(self.storedir)
+        fd, tmp = tempfile.mkstemp(dir=self.storedir)
+        os.close(fd)
+        shutil.copyfile(self.manifest, tmp)
+        os.rename(tmp, self.__latest())
+
+        if snap.config.options.log_level_at_least('normal'):
+            snap.callback.snapcallback.message("Stored " + str(stored) + " new bytes in chunk store " + self.storedir)
+            snap.callback.snapcallback.message("Manifest " + self.manifest + " created")
+
+    def read(self):
+        '''return the entries listed in the manifest
+
+        @raises MissingFileError - if the manifest is not valid'''
+        manifest = gzip.open(self.manifest, 'rb')
+        try:
+            if manifest.readline().rstrip('\n') != ChunkStore.VERSION:
+                raise MissingFileError(self.manifest + " is not a chunk store manifest")
+            return [ChunkEntry.parse(line.rstrip('\n')) for line in manifest]
+        finally:
+            manifest.close()
+
+    def list(self):
+        '''return the names of the entries in the manifest'''
+        return [entry.name for entry in self.read()]
+
+    def extract(self, only=None):
+        '''reassemble the entries in the manifest into the snapdirectory
+
+        @param only - optional list of names of the entries to extract along with
+                      those underneath them, defaults to all entries'''
+        entries = self.read()
+        if only is not None:
+            targets = SnapIndex.targets(only)
+            entries = [entry for entry in entries if SnapIndex.matches(entry.name, targets)]
+
+        directories = []
+        for entry in entries:
+            path = os.path.join(self.snapdirectory, entry.name)
+            parent = os.path.dirname(path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+
+            if entry.type == 'd':
+                if not os.path.isdir(path):
+                    os.mkdir(path)
+                directories.append((path, entry))
+                continue
+            elif entry.type == 'l':
+                os.symlink(entry.data, path)
+            else:
+                with open(path, 'wb') as f:
+                    for digest in filter(None, entry.data.split(',')):
+                        f.write(ChunkStore.get(self.storedir, digest))
+            ChunkStore.__set_attributes(path, entry)
+
+        # directory times are set last as extracting their contents changes them
+        for path, entry in directories:
+            ChunkStore.__set_attributes(path, entry)
+
+        if snap.config.options.log_level_at_least('normal'):
+            snap.callback.snapcallback.message("Manifest " + self.manifest + " opened")
+
+    def __set_attributes(path, entry):
+        '''helper to set the ownership, permissions and modification time of an extracted entry'''
+        if hasattr(os, 'lchown') and snap.osregistry.OSUtils.is_superuser():
+            os.lchown(path, entry.uid, entry.gid)
+        if entry.type != 'l':
+            os.chmod(path, entry.mode)
+            os.utime(path, (entry.mtime, entry.mtime))
+    __set_attributes = staticmethod(__set_attributes)
@@ -0,0 +1,308 @@
+# Parallel extraction of the members of a snapfile
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import tarfile
+import tempfile
+import collections
+import multiprocessing.pool
+
+from snap.parallel import Parallel
+from snap.metadata.attributes import ArchivedAttributes
+
+class SnapExtractor:
+    """Extracts the members of a tarball into a directory.
+
+       The tarball is read and decompressed on the calling thread, which also
+       creates directories and links as they are encountered. The contents of
+       files are written across a thread pool in blocks, at most a few per
+       thread are held in memory at a time. Ownership, permissions and times
+       are applied across the pool once everything has been written, those of
+       directories last. Paths are always joined to the target directory so
+       the working directory of the process is never changed.
+
+       If a DirectRestore is specified, the members it has destinations for
+       are instead written to temporary files alongside their destinations.
+       These are renamed into place only once every member has been written
+       and the rest of the input verified, so nothing is restored from input
+       which fails verification. Temporary files are removed on failure.
+
+       Only the data of sparse members is written, the holes between it are
+       left unwritten so the extracted files are as sparse as the originals.
+
+       Hardlinks to targets which were not extracted, as when only some of the
+       members are selected, are skipped and recorded in unresolved_links for
+       the caller to extract the data of their targets to."""
+
+    # the number of bytes of a file written by a worker at a time
+    BLOCKSIZE = 1024 * 1024
+
+    # number of members whose metadata is applied by a worker at a time
+    CHUNKSIZE = 64
+
+    def __init__(self, directory, jobs=None, restore=None):
+        '''initialize the extractor
+
+        @param directory - the directory to extract the members to
+        @param jobs - the number of threads to write with, defaults to the configured number of jobs
+        @param restore - optional DirectRestore of members to write to their destinations'''
+        if jobs is None:
+            jobs = Parallel.jobs()
+        self.directory = directory
+        self.jobs = jobs
+        self.restore = restore
+
+        # the TarInfo of hardlinks whose targets were not extracted
+        self.unresolved_links = []
+
+    def extract(self, tarball, selected=None, complete=None):
+        '''extract the members of the tarball
+
+        @param tarball - the TarFile to extract, may be opened in stream mode
+        @param selected - optional callable returning true for the members to extract,
+                          defaults to all members
+        @param complete - optional callable, see extract_members'''
+        self.extract_members(((tarball, tarinfo) for tarinfo in tarball
+                              if selected is None or selected(tarinfo)), complete)
+
+    def extract_members(self, members, complete=None):
+        '''extract the specified members, the data of each must be readable from
+        its tarball until the next member is retrieved
+
+        @param members - iterable of (TarFile, TarInfo) of the members to extract
+        @param complete - optional callable invoked once the members have been written,
+                          before any are renamed to their destinations, to read and
+                          verify the rest of the input. It raises if that fails'''
+        self.pool = multiprocessing.pool.ThreadPool(self.jobs)
+        self.pending = collections.deque()
+        self.directories = set([self.directory])
+
+        # archive names of directories -> (tarball, tarinfo), to replicate
+        # them when creating the parents of restored files
+        self.archived_directories = {}
+
+        # archive names of members being restored -> the temporary paths they
+        # are written to, hardlinks to them are linked to those paths
+        self.restoring = {}
+        try:
+            # lists of (tarball, tarinfo, path, destination) to apply the metadata of
+            metadata = []
+            directories = []
+            for tarball, tarinfo in members:
+                path = os.path.join(self.directory, tarinfo.name)
+                destination = None
+                if self.restore is not None:
+                    destination = self.restore.destination(tarinfo.name)
+
+                if tarinfo.isdir():
+                    self.__make_parents(path)
+                    if not os.path.isdir(path):
+                        os.mkdir(path, 0700)
+                    self.directories.add(path)
+                    self.archived_directories[tarinfo.name] = (tarball, tarinfo)
+                    directories.append((tarball, tarinfo, path, None))
+                    continue
+
+                if destination is not None and (tarinfo.isreg() or tarinfo.issym() or tarinfo.islnk()):
+                    directories += self.__make_destination_parents(tarinfo.name, destination)
+                    path = self.__temporary_path(destination)
+                    self.restoring[tarinfo.name] = path
+                else:
+                    destination = None
+                    self.__make_parents(path)
+
+                if tarinfo.isreg():
+                    self.__write_file(tarball, tarinfo, path, destination is not None)
+                elif tarinfo.issym() and hasattr(os, 'symlink'):
+                    self.__remove(path)
+                    os.symlink(tarinfo.linkname, path)
+                elif tarinfo.islnk() and hasattr(os, 'link'):
+                    # the target must have been created to link to it
+                    self.__wait()
+                    target = self.restoring.get(tarinfo.linkname)
+                    if target is None:
+                        target = os.path.join(self.directory, tarinfo.linkname)
+                    if not os.path.lexists(target):
+                        self.restoring.pop(tarinfo.name, None)
+                        self.unresolved_links.append(tarinfo)
+                        continue
+                    self.__remove(path)
+                    os.link(target, path)
+                else:
+                    # anything else is left to tarfile, which applies its metadata
+                    self.__wait()
+                    tarball.extract(tarinfo, self.directory)
+                    continue
+                metadata.append((tarball, tarinfo, path, destination))
+            self.__wait()
+
+            for result in Parallel.imap(self.pool, self.__apply_metadata, metadata,
+                                        self.jobs, SnapExtractor.CHUNKSIZE):
+                pass
+
+            if complete is not None:
+                complete()
+            for tarball, tarinfo, path, destination in metadata:
+                if destination is not None:
+                    os.rename(path, destination)
+                    self.restore.add(tarinfo.name)
+
+            # directories are last so nothing done to their contents afterwards
+            # can change their times
+            for result in Parallel.imap(self.pool, self.__apply_metadata, directories,
+                                        self.jobs, SnapExtractor.CHUNKSIZE):
+                pass
+            self.pool.close()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+            # remove the temporary files of any members which were not renamed into place
+            for path in self.restoring.values():
+                if os.path.lexists(path):
+                    os.remove(path)
+
+    def __make_parents(self, path):
+        '''helper to create the parent directories of the path, as tarfile would'''
+        parent = os.path.dirname(path)
+        if not parent in self.directories:
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            self.directories.add(parent)
+
+    def __make_destination_parents(self, name, destination):
+        '''helper to create the missing parent directories of a destination
+
+        @returns - list of the metadata items replicating the archived directories
+                   corresponding to those created'''
+        created = []
+        parent = os.path.dirname(destination)
+        archived = os.path.dirname(name)
+        while not parent in self.directories and not os.path.isdir(parent):
+            created.append((archived, parent))
+            parent = os.path.dirname(parent)
+            archived = os.path.dirname(archived)
+        if len(created) == 0:
+            return []
+
+        os.makedirs(created[0][1])
+        items = []
+        for archived, parent in created:
+            self.directories.add(parent)
+            if archived in self.archived_directories:
+                tarball, tarinfo = self.archived_directories[archived]
+                items.append((tarball, tarinfo, parent, None))
+        return items
+
+    def __temporary_path(self, destination):
+        '''helper to return an unused path in the directory of the destination to
+           write a member to before it is renamed into place'''
+        directory, name = os.path.split(destination)
+        return tempfile.mktemp(prefix='.' + name + '.', suffix='.snap', dir=directory)
+
+    def __remove(self, path):
+        '''helper to remove any existing file the member is to replace'''
+        if os.path.lexists(path) and not os.path.isdir(path):
+            os.remove(path)
+
+    def __write_file(self, tarball, tarinfo, path, exclusive):
+        '''helper to read the contents of the member, submitting them to be written
+
+        @param exclusive - true if the file must not already exist'''
+        # files are never written through links the member replaces
+        if os.path.islink(path):
+            os.remove(path)
+        member = tarball.extractfile(tarinfo)
+        if tarinfo.issparse():
+            self.__write_sparse(member, tarinfo, path, exclusive)
+            return
+        if tarinfo.size <= SnapExtractor.BLOCKSIZE and not exclusive:
+            self.__submit(path, 0, member.read(), True)
+            return
+
+        # larger files are created up front so their blocks can be written in any order
+        if exclusive:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600))
+        else:
+            open(path, 'wb').close()
+        offset = 0
+        while True:
+            data = member.read(SnapExtractor.BLOCKSIZE)
+            if len(data) == 0:
+                break
+            self.__submit(path, offset, data, False)
+            offset += len(data)
+
+    def __write_sparse(self, member, tarinfo, path, exclusive):
+        '''helper to submit the data sections of the sparse member to be written,
+           the file is created with its full size up front so the holes are never written'''
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        if exclusive:
+            flags |= os.O_EXCL
+        fd = os.open(path, flags, 0600)
+        try:
+            os.ftruncate(fd, tarinfo.size)
+        finally:
+            os.close(fd)
+
+        # the sections are read in the order they are stored in the
+        # archive, holes are those without a position in it
+        for section in tarinfo.sparse:
+            if not hasattr(section, 'realpos'):
+                continue
+            member.seek(section.offset)
+            remaining = section.size
+            while remaining > 0:
+                data = member.read(min(remaining, SnapExtractor.BLOCKSIZE))
+                if len(data) == 0:
+                    break
+                self.__submit(path, section.offset + section.size - remaining, data, False)
+                remaining -= len(data)
+
+    def __submit(self, path, offset, data, create):
+        '''helper to write the block in the pool, waiting for the oldest
+           blocks once the window is full'''
+        self.pending.append(self.pool.apply_async(SnapExtractor.__write_block, (path, offset, data, create)))
+        while len(self.pending) >= self.jobs * 4:
+            self.pending.popleft().get()
+
+    def __wait(self):
+        '''helper to wait for all the pending blocks to be written'''
+        while self.pending:
+            self.pending.popleft().get()
+
+    def __write_block(path, offset, data, create):
+        '''helper to write a block of a file, creating the file if specified'''
+        if create:
+            f = open(path, 'wb')
+        else:
+            f = open(path, 'r+b')
+        try:
+            f.seek(offset)
+            f.write(data)
+        finally:
+            f.close()
+    __write_block = staticmethod(__write_block)
+
+    def __apply_metadata(self, item):
+        '''helper to apply the ownership, extended attributes, permissions and times
+           of a member, failures to do so are ignored as tarfile does by default'''
+        tarball, tarinfo, path, destination = item
+        try:
+            tarball.chown(tarinfo, path)
+            if not tarinfo.issym():
+                ArchivedAttributes.restore(tarinfo, path)
+                tarball.chmod(tarinfo, path)
+                tarball.utime(tarinfo, path)
+        except tarfile.ExtractError:
+            pass
@@ -0,0 +1,64 @@
+# Replication of the hardlinks between copied files
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import threading
+
+class HardLinks:
+    """Tracks the copies made of files with more than one link so that the
+       other paths linked to the same source are linked to the copy rather than
+       copied again, and the copies share their data as the sources do.
+
+       Sources are identified by their (device, inode). A copy is only
+       recorded once it is complete, paths to the same source copied
+       concurrently with it are copied independently."""
+
+    def __init__(self):
+        # (device, inode) of a source -> path to its copy
+        self.copies = {}
+        self.lock = threading.Lock()
+
+    def link(self, fs, path):
+        '''link the path to the copy already made of the source, if any
+
+        @param fs - the lstat result of the source
+        @param path - the path the source is to be copied to
+        @returns - true if the path was linked, false if the source must be copied'''
+        if fs.st_nlink < 2 or not hasattr(os, 'link'):
+            return False
+        with self.lock:
+            copy = self.copies.get((fs.st_dev, fs.st_ino))
+        if copy is None or copy == path:
+            return False
+
+        try:
+            if os.path.lexists(path):
+                if os.path.samefile(copy, path):
+                    return True
+                os.remove(path)
+            os.link(copy, path)
+        except OSError:
+            # the copy may have been removed or the filesystem may
+            # not support links, the source is copied instead
+            return False
+        return True
+
+    def add(self, fs, path):
+        '''record the copy made of the source
+
+        @param fs - the lstat result of the source
+        @param path - the path to the copy'''
+        if fs.st_nlink < 2:
+            return
+        with self.lock:
+            self.copies.setdefault((fs.st_dev, fs.st_ino), path)
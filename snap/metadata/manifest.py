@@ -0,0 +1,137 @@
+# Compact line delimited format of the snap record files
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import xml.sax, xml.sax.handler
+
+import snap
+from snap.exceptions import MissingFileError
+
+class RecordManifest:
+    """A record file in the snap manifest format.
+
+       The first line identifies the format, its version and the kind of
+       record file. Each following line is a record, a one character tag
+       followed by tab seperated fields, escaped so that they never contain
+       tabs or newlines. Empty fields stand for values which were not set.
+
+       Records are written from and read into iterators one line at a time
+       so that neither requires the whole record file to be held in memory.
+       The XML record files written by earlier versions of snap are still
+       read, incrementally as well, and are written by the record file classes
+       in place of manifests when the xml record format is configured."""
+
+    MAGIC = 'snaprecord'
+
+    VERSION = 1
+
+    # number of bytes of xml record files parsed at a time
+    BLOCKSIZE = 64 * 1024
+
+    def __init__(self, path, kind):
+        '''initialize the manifest
+
+        @param path - the path to the record file
+        @param kind - the kind of record file, eg 'files' or 'packages\''''
+        self.path = path
+        self.kind = kind
+
+    def write_xml():
+        '''return true if the record files are to be written in the xml format
+           of earlier versions of snap rather than as manifests'''
+        return snap.config.options.record_format == 'xml'
+    write_xml = staticmethod(write_xml)
+
+    def is_manifest(path):
+        '''return true if the record file at the specified path is a manifest
+           rather than an xml record file'''
+        f = open(path, 'rb')
+        try:
+            return f.read(len(RecordManifest.MAGIC)) == RecordManifest.MAGIC
+        finally:
+            f.close()
+    is_manifest = staticmethod(is_manifest)
+
+    def escape(value):
+        '''return the field serializing the specified value'''
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, float):
+            value = repr(value)
+        elif not isinstance(value, str):
+            value = str(value)
+        return value.encode('string_escape')
+    escape = staticmethod(escape)
+
+    def write(self, records):
+        '''write the records to the manifest
+
+        @param records - iterable of (tag, list of field values), None values are recorded as unset'''
+        f = open(self.path, 'wb')
+        try:
+            f.write('%s %d %s\n' % (RecordManifest.MAGIC, RecordManifest.VERSION, self.kind))
+            escape = RecordManifest.escape
+            for tag, fields in records:
+                f.write(tag + '\t' + '\t'.join([escape(field) for field in fields]) + '\n')
+        finally:
+            f.close()
+
+    def read(self):
+        '''generator yielding the (tag, list of fields) records of the manifest, unset
+           fields are None and all others strings
+
+        @raises MissingFileError - if the file is not a manifest of the expected kind'''
+        f = open(self.path, 'rb')
+        try:
+            header = f.readline().split()
+            if len(header) != 3 or header[0] != RecordManifest.MAGIC or header[2] != self.kind:
+                raise MissingFileError(self.path + " is not a " + self.kind + " record file")
+            if int(header[1]) > RecordManifest.VERSION:
+                raise MissingFileError(self.path + " was written by a newer version of snap")
+
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                yield fields[0], [field != '' and field.decode('string_escape') or None
+                                  for field in fields[1:]]
+        finally:
+            f.close()
+
+    def read_xml(path, handler, results):
+        '''generator parsing the xml record file with the sax content handler a
+        block at a time, yielding the items it has parsed after each block
+
+        @param path - the path to the xml record file
+        @param handler - the ContentHandler parsing the record file
+        @param results - the name of the list attribute the handler appends the parsed items to'''
+        parser = xml.sax.make_parser()
+        parser.setFeature(xml.sax.handler.feature_namespaces, 0)
+        parser.setContentHandler(handler)
+        f = open(path, 'rb')
+        try:
+            while True:
+                data = f.read(RecordManifest.BLOCKSIZE)
+                if len(data) == 0:
+                    parser.close()
+                else:
+                    parser.feed(data)
+                items = getattr(handler, results)
+                if len(items) > 0:
+                    setattr(handler, results, [])
+                    for item in items:
+                        yield item
+                if len(data) == 0:
+                    break
+        finally:
+            f.close()
+    read_xml = staticmethod(read_xml)
@@ -14,10 +14,13 @@
 import xml, xml.sax, xml.sax.handler, xml.sax.saxutils
 
 import snap
+from snap.metadata.manifest import RecordManifest
 
-class Package:
+class Package(object):
     """information about a package tracked by snap"""
 
+    __slots__ = ('name', 'version')
+
     def __init__(self, name='', version=''):
         '''initialize the package
 
@@ -42,6 +45,22 @@ class PackagesRecordFile:
     def write(self, packages):
         '''generate file containing record of packages
 
+        @param packages - list of Packages to record
+        '''
+        if RecordManifest.write_xml():
+            self.write_xml(packages)
+            return
+        RecordManifest(self.packagefile, 'packages').write(PackagesRecordFile.__records(packages))
+
+    def __records(packages):
+        '''helper generating the manifest records of the packages'''
+        for package in packages:
+            yield 'p', [package.name, package.version or None]
+    __records = staticmethod(__records)
+
+    def write_xml(self, packages):
+        '''generate xml file containing record of packages, as written by earlier versions of snap
+
         @param packages - list of Packages to record
         '''
         f=open(self.packagefile, 'w')
@@ -53,16 +72,23 @@ class PackagesRecordFile:
 
     def read(self):
         '''
-        read packages from the file
+        read packages from the file as they are iterated over, xml record files are read as well
+
+        @returns - iterator over instances of Package
+        '''
+        if not RecordManifest.is_manifest(self.packagefile):
+            return self.read_xml()
+        return (Package(name=fields[0], version=fields[1] or '')
+                for tag, fields in RecordManifest(self.packagefile, 'packages').read())
+
+    def read_xml(self):
+        '''
+        read packages from an xml record file as they are iterated over, as written
+        by earlier versions of snap
 
-        @returns - list of instances of Package
+        @returns - iterator over instances of Package
         '''
-        parser = xml.sax.make_parser()
-        parser.setFeature(xml.sax.handler.feature_namespaces, 0)
-        handler = _PackagesRecordFileParser()
-        parser.setContentHandler(handler)
-        parser.parse(self.packagefile)
-        return handler.packages
+        return RecordManifest.read_xml(self.packagefile, _PackagesRecordFileParser(), 'packages')
         
 
 
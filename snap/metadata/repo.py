@@ -14,10 +14,13 @@
 import xml, xml.sax, xml.sax.handler, xml.sax.saxutils
 
 import snap
+from snap.metadata.manifest import RecordManifest
 
-class Repo:
+class Repo(object):
     """information about a repository tracked by snap"""
 
+    __slots__ = ('name', 'url')
+
     def __init__(self, name='', url=''):
         '''initialize the repository
 
@@ -42,6 +45,22 @@ class ReposRecordFile:
     def write(self, repos):
         '''generate file containing record of repositories
 
+        @param repos - list of Repos to record
+        '''
+        if RecordManifest.write_xml():
+            self.write_xml(repos)
+            return
+        RecordManifest(self.repofile, 'repos').write(ReposRecordFile.__records(repos))
+
+    def __records(repos):
+        '''helper generating the manifest records of the repos'''
+        for repo in repos:
+            yield 'r', [repo.name or None, repo.url]
+    __records = staticmethod(__records)
+
+    def write_xml(self, repos):
+        '''generate xml file containing record of repositories, as written by earlier versions of snap
+
         @param repos - list of Repos to record
         '''
         f=open(self.repofile, 'w')
@@ -55,16 +74,23 @@ class ReposRecordFile:
 
     def read(self):
         '''
-        read repos from the file
+        read repos from the file as they are iterated over, xml record files are read as well
+
+        @returns - iterator over instances of Repo
+        '''
+        if not RecordManifest.is_manifest(self.repofile):
+            return self.read_xml()
+        return (Repo(name=fields[0] or '', url=fields[1])
+                for tag, fields in RecordManifest(self.repofile, 'repos').read())
+
+    def read_xml(self):
+        '''
+        read repos from an xml record file as they are iterated over, as written
+        by earlier versions of snap
 
-        @returns - list of instances of Repo
+        @returns - iterator over instances of Repo
         '''
-        parser = xml.sax.make_parser()
-        parser.setFeature(xml.sax.handler.feature_namespaces, 0)
-        handler = _ReposRecordFileParser()
-        parser.setContentHandler(handler)
-        parser.parse(self.repofile)
-        return handler.repos
+        return RecordManifest.read_xml(self.repofile, _ReposRecordFileParser(), 'repos')
         
 
 
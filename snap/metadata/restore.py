@@ -0,0 +1,87 @@
+# Files restored straight from the snapfile to their original locations
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import threading
+
+from snap.metadata.sfile     import FilesRecordFile
+from snap.metadata.snapindex import SnapIndex
+
+class DirectRestore(object):
+    """Files to be written straight to their original locations when the
+       snapfile is extracted.
+
+       The counterpart to DirectArchive, when a direct restore is registered
+       for a snap working directory the members of the snapfile recorded in its
+       files record are extracted to where the files backend would otherwise
+       copy them, only the other members are staged in the working directory.
+       The files backend then skips the files which were restored."""
+
+    # snap working directory -> DirectRestore registered for it
+    restores = {}
+
+    def __init__(self, basedir, destinations):
+        '''initialize the direct restore
+
+        @param basedir - the snap working directory
+        @param destinations - dict of the archive names of members to their destinations'''
+        self.basedir = basedir
+        self.destinations = destinations
+        self.restored = set()
+        self.lock = threading.Lock()
+
+    def register(basedir, fs_root):
+        '''create and return a direct restore for the specified working directory
+        from the files record already extracted to it, files inherited from parent
+        snapshots are not in the snapfile and are restored as usual
+
+        @param basedir - the snap working directory
+        @param fs_root - the root of the filesystem the recorded files are restored to'''
+        basedir = os.path.abspath(basedir)
+        destinations = {}
+        recordfile = os.path.join(basedir, "files.xml")
+        if os.path.isfile(recordfile):
+            for sfile in FilesRecordFile(recordfile).read():
+                if not sfile.inherited:
+                    destinations[SnapIndex.archive_name(sfile.path)] = \
+                        os.path.join(fs_root, sfile.escaped_path(fs_root))
+        restore = DirectRestore(basedir, destinations)
+        DirectRestore.restores[basedir] = restore
+        return restore
+    register = staticmethod(register)
+
+    def unregister(basedir):
+        '''discard the direct restore registered for the specified working directory'''
+        DirectRestore.restores.pop(os.path.abspath(basedir), None)
+    unregister = staticmethod(unregister)
+
+    def lookup(basedir):
+        '''return the direct restore registered for the specified working directory, else None'''
+        if len(DirectRestore.restores) == 0:
+            return None
+        return DirectRestore.restores.get(os.path.abspath(basedir))
+    lookup = staticmethod(lookup)
+
+    def destination(self, name):
+        '''return the location the member with the specified name is to be restored to,
+           None if it is to be extracted to the working directory'''
+        return self.destinations.get(name)
+
+    def add(self, name):
+        '''record that the member with the specified name has been restored'''
+        with self.lock:
+            self.restored.add(name)
+
+    def is_restored(self, path):
+        '''return true if the file recorded with the specified path has been restored'''
+        return SnapIndex.archive_name(path) in self.restored
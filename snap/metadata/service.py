@@ -14,17 +14,24 @@
 import xml, xml.sax, xml.sax.handler, xml.sax.saxutils
 
 import snap
+from snap.metadata.manifest import RecordManifest
 
-class Service:
+class Service(object):
     """information about a service tracked by snap"""
 
-    def __init__(self, name=''):
+    __slots__ = ('name', 'directory')
+
+    def __init__(self, name='', directory=None):
         '''initialize the service
 
         @param name - the name of the service
+        @param directory - the directory the service was backed up to, relative to the
+                           snap working directory, None if it was backed up to the
+                           working directory itself as earlier versions of snap did
         '''
 
         self.name = name
+        self.directory = directory
 
 class ServicesRecordFile:
     '''a snap service record file, contains list of services configured, to restore'''
@@ -40,27 +47,57 @@ class ServicesRecordFile:
     def write(self, services):
         '''generate file containing record of services
 
+        @param services - list of Services to record
+        '''
+        if RecordManifest.write_xml():
+            self.write_xml(services)
+            return
+        RecordManifest(self.servicesfile, 'services').write(ServicesRecordFile.__records(services))
+
+    def __records(services):
+        '''helper generating the manifest records of the services'''
+        for service in services:
+            fields = [service.name]
+            if service.directory is not None:
+                fields.append(service.directory)
+            yield 's', fields
+    __records = staticmethod(__records)
+
+    def write_xml(self, services):
+        '''generate xml file containing record of services, as written by earlier versions of snap
+
         @param services - list of Services to record
         '''
         f=open(self.servicesfile, 'w')
         f.write("<services>")
         for service in services:
-            f.write('<service>' + xml.sax.saxutils.escape(service.name) + '</service>');
+            if service.directory is None:
+                f.write('<service>')
+            else:
+                f.write('<service directory=' + xml.sax.saxutils.quoteattr(service.directory) + '>')
+            f.write(xml.sax.saxutils.escape(service.name) + '</service>');
         f.write("</services>")
         f.close()
 
     def read(self):
         '''
-        read services from the file
+        read services from the file as they are iterated over, xml record files are read as well
+
+        @returns - iterator over instances of Service
+        '''
+        if not RecordManifest.is_manifest(self.servicesfile):
+            return self.read_xml()
+        return (Service(name=fields[0], directory=len(fields) > 1 and fields[1] or None)
+                for tag, fields in RecordManifest(self.servicesfile, 'services').read())
 
-        @returns - list of instances of Service
+    def read_xml(self):
         '''
-        parser = xml.sax.make_parser()
-        parser.setFeature(xml.sax.handler.feature_namespaces, 0)
-        handler = _ServicesRecordFileParser()
-        parser.setContentHandler(handler)
-        parser.parse(self.servicesfile)
-        return handler.services
+        read services from an xml record file as they are iterated over, as written
+        by earlier versions of snap
+
+        @returns - iterator over instances of Service
+        '''
+        return RecordManifest.read_xml(self.servicesfile, _ServicesRecordFileParser(), 'services')
         
 
 
@@ -74,12 +111,16 @@ class _ServicesRecordFileParser(xml.sax.handler.ContentHandler):
         # current service being processed
         self.current_service=None
 
+        # directory of the current service, if recorded
+        self.current_directory=None
+
         # flag indicating if we are evaluating a name
         self.in_service_content=False
     
     def startElement(self, name, attrs):
         if name == 'service':
             self.current_service = ''
+            self.current_directory = attrs.get('directory')
             self.in_service_content=True
 
     def characters(self, ch):
@@ -89,4 +130,5 @@ class _ServicesRecordFileParser(xml.sax.handler.ContentHandler):
     def endElement(self, name):
         if name == 'service':
             self.in_service_content = False
-            self.services.append(Service(name=xml.sax.saxutils.unescape(self.current_service)))
+            self.services.append(Service(name=xml.sax.saxutils.unescape(self.current_service),
+                                         directory=self.current_directory))
@@ -13,15 +13,25 @@
 
 import os
 import re
-import shutil
+import stat
+import itertools
 import xml, xml.sax, xml.sax.handler, xml.sax.saxutils
 
 import snap.osregistry
+from snap.copier import FileCopier
 from snap.filemanager import FileManager
+from snap.metadata.archive import DirectArchive
+from snap.metadata.attributes import AttributeReplicator
+from snap.metadata.hardlinks import HardLinks
+from snap.metadata.manifest import RecordManifest
 
 class SFile(object):
     """A generic file tracked by snap"""
 
+    # millions of sfiles may be alive at once, slots keep them from each
+    # carrying a dict of their attributes
+    __slots__ = ('path', 'size', 'mode', 'uid', 'gid', 'mtime', 'inode', 'digest', 'inherited')
+
     def windows_path_escape(path):
         '''helper to handle drive specifications in windows paths'''
         # XXX total dirty hack
@@ -52,45 +62,139 @@ class SFile(object):
 
         self.path = path
 
-        self.directory, self.name = os.path.split(self.path)
+        # attributes of the file when it was backed up, recorded so that
+        # later snapshots can determine if it has changed since
+        self.size = None
+        self.mode = None
+        self.uid = None
+        self.gid = None
+        self.mtime = None
+        self.inode = None
+        self.digest = None
+
+        # true if the contents of the file are stored in a parent snapshot
+        self.inherited = False
+
+    def directory(self):
+        '''the directory containing the file, computed when needed so that
+           reading large record files does not split every path'''
+        return os.path.dirname(self.path)
+    directory = property(directory)
+
+    def name(self):
+        '''the name of the file'''
+        return os.path.basename(self.path)
+    name = property(name)
+
+    def record_stat(self, fs):
+        '''record the size, mode, ownership, mtime and inode of the specified stat result'''
+        self.size = fs.st_size
+        self.mode = fs.st_mode
+        self.uid = fs.st_uid
+        self.gid = fs.st_gid
+        self.mtime = fs.st_mtime
+        self.inode = fs.st_ino
+
+    def unchanged_since(self, previous):
+        '''return true if the file is the same as the specified sfile recorded by an
+           earlier snapshot, files of the same size with differing attributes are
+           compared by digest if both have one
+
+           @param previous - the SFile recorded by the earlier snapshot'''
+        if self.size != previous.size:
+            return False
+        if self.mtime == previous.mtime and self.inode == previous.inode:
+            return True
+        return self.digest is not None and self.digest == previous.digest
+
+    def escaped_path(self, basedir=''):
+        '''return the path the sfile is replicated to under the specified base directory'''
+        # XXX need to incorporate a bit of a hack to handle the
+        #  drive specification in windows paths and partial paths on linux
+        if snap.osregistry.OS.is_windows():
+            return SFile.windows_path_escape(self.path)
+        elif snap.osregistry.OS.is_linux():
+            return SFile.linux_path_escape(basedir, self.path)
+        return self.path
+
+    def archive_to(self, basedir, archive):
+        '''register the sfile to be streamed into the snapfile by the direct archive
+           rather than copying it, the path is updated as if it were copied to basedir
 
-    def copy_to(self, basedir='', path_prefix=''):
+           @param basedir - the directory the file would otherwise be copied to
+           @param archive - the DirectArchive registered for the snap working directory'''
+        source_path = self.path
+        self.path = self.escaped_path(basedir)
+        name = os.path.relpath(os.path.join(basedir, self.path), archive.basedir)
+        archive.add(source_path, name)
+        return self
+
+    def stage_to(self, basedir):
+        '''back up the sfile under the specified base directory, registering it with the
+           direct archive for the directory if there is one, else copying it there
+
+           @param basedir - the snap working directory (or a directory under it)'''
+        archive = DirectArchive.lookup(basedir)
+        if archive is not None:
+            return self.archive_to(basedir, archive)
+        return self.copy_to(basedir)
+
+    def copy_to(self, basedir='', path_prefix='', fs=None, attributes=None, links=None):
         '''copy the sfile to the specified base directory, replicating the directory structure
            of the path under it
            
            @param basedir - the directory to replicate the path and copy the file to
-           @param path_prefix - an optional prefix to prepend to the sfile path'''
+           @param path_prefix - an optional prefix to prepend to the sfile path
+           @param fs - the lstat result of the file if already known
+           @param attributes - optional AttributeReplicator to queue the attributes of the
+                               file and any directories created for it to, else they are
+                               applied immediately
+           @param links - optional HardLinks to link the copy to an earlier copy of another
+                          link to the same file through, else the file is always copied'''
         source_path = os.path.join(path_prefix, self.path)
         source_dir = os.path.join(path_prefix, self.directory)
+        if attributes is None:
+            attributes = AttributeReplicator(jobs=1)
+            apply = True
+        else:
+            apply = False
         
-        # XXX need to incorporate a bit of a hack to handle the
-        #  drive specification in windows paths and partial paths on linux
-        if snap.osregistry.OS.is_windows():
-            self.path = SFile.windows_path_escape(self.path)
-        elif snap.osregistry.OS.is_linux():
-            self.path = SFile.linux_path_escape(basedir, self.path)
+        self.path = self.escaped_path(basedir)
 
         dest_path = os.path.join(basedir, self.path)
         dest_dir, dest_name = os.path.split(dest_path)
 
+        # nothing is copied if the file no longer exists
+        if fs is None:
+            try:
+                fs = os.lstat(source_path)
+            except OSError:
+                return self
+
         if not os.path.isdir(dest_dir):
-            os.makedirs(dest_dir)
-            shutil.copystat(source_dir, dest_dir)
-            ofs = os.stat(source_dir)
-            snap.osregistry.OSUtils.chown(dest_dir, uid=ofs.st_uid, gid=ofs.st_gid)
+            # files may be copied concurrently, another may have created the directory
+            try:
+                os.makedirs(dest_dir)
+                attributes.add(dest_dir, os.stat(source_dir), source_dir)
+            except OSError:
+                if not os.path.isdir(dest_dir):
+                    raise
 
-        if os.path.islink(source_path):
+        if stat.S_ISLNK(fs.st_mode):
             if os.path.isfile(dest_path):
                 os.remove(dest_path)
             realpath = os.path.realpath(source_path)
             os.symlink(realpath, dest_path)
 
-        elif os.path.isfile(source_path):
-            shutil.copyfile(source_path, dest_path)
-            shutil.copystat(source_path, dest_path)
-            ofs = os.stat(source_path)
-            snap.osregistry.OSUtils.chown(dest_path, uid=ofs.st_uid, gid=ofs.st_gid)
+        elif stat.S_ISREG(fs.st_mode):
+            if links is None or not links.link(fs, dest_path):
+                FileCopier.copy(source_path, dest_path)
+                attributes.add(dest_path, fs, source_path)
+                if links is not None:
+                    links.add(fs, dest_path)
 
+        if apply:
+            attributes.apply()
         return self
 
 class FilesRecordFile:
@@ -99,26 +203,111 @@ class FilesRecordFile:
     def __init__(self, recordfile):
        self.recordfile = recordfile
 
-    def write(self, sfiles=[]):
+       # set when the record file is read
+       self.parent = None
+       self.deleted = []
+
+    def write(self, sfiles=[], parent=None, deleted=[]):
        '''generate file containing record of specified files
 
        @param files - the list of SFiles to record
+       @param parent - the path to the parent snapfile of an incremental snapshot
+       @param deleted - the paths of the files deleted since the parent snapshot
        '''
+       if RecordManifest.write_xml():
+           self.write_xml(sfiles, parent, deleted)
+           return
+       RecordManifest(self.recordfile, 'files').write(FilesRecordFile.__records(sfiles, parent, deleted))
+
+    def __records(sfiles, parent, deleted):
+       '''helper generating the manifest records of the files record'''
+       if parent is not None:
+           yield 'p', [parent]
+       for sfile in sfiles:
+           yield 'f', [sfile.path, sfile.size, sfile.mode, sfile.uid, sfile.gid, sfile.mtime,
+                       sfile.inode, sfile.digest, sfile.inherited and 'i' or None]
+       for path in deleted:
+           yield 'd', [path]
+    __records = staticmethod(__records)
+
+    def write_xml(self, sfiles=[], parent=None, deleted=[]):
+       '''generate xml file containing record of specified files, as written by
+          earlier versions of snap, the parameters are those of write'''
        f = open(self.recordfile, 'w') 
-       f.write('<files>')
+       if parent is None:
+           f.write('<files>')
+       else:
+           f.write('<files parent=' + xml.sax.saxutils.quoteattr(parent) + '>')
        for sfile in sfiles:
-           f.write('<file>' + xml.sax.saxutils.escape(sfile.path) + '</file>')
+           f.write('<file' + FilesRecordFile.__attributes(sfile) + '>' + xml.sax.saxutils.escape(sfile.path) + '</file>')
+       for path in deleted:
+           f.write('<deleted>' + xml.sax.saxutils.escape(path) + '</deleted>')
        f.write('</files>')
        f.close()
 
+    def __attributes(sfile):
+       '''helper to return the xml attributes recording the state of the sfile'''
+       attributes = ''
+       if sfile.size is not None:
+           attributes += ' size="%d" mtime="%r" inode="%d"' % (sfile.size, sfile.mtime, sfile.inode)
+       if sfile.mode is not None:
+           attributes += ' mode="%o" uid="%d" gid="%d"' % (sfile.mode, sfile.uid, sfile.gid)
+       if sfile.digest is not None:
+           attributes += ' digest="' + sfile.digest + '"'
+       if sfile.inherited:
+           attributes += ' inherited="true"'
+       return attributes
+    __attributes = staticmethod(__attributes)
+
     def read(self):
-       '''restore the files stored in and tracked by the record file in the targetdir'''
-       parser = xml.sax.make_parser()
-       parser.setFeature(xml.sax.handler.feature_namespaces, 0)
+       '''return an iterator over the files tracked by the record file, which are read
+          from it as they are iterated over. The parent snapfile recorded by incremental
+          snapshots is set on the record file when this returns, the paths deleted since
+          it once the iterator is exhausted. Xml record files are read as well'''
+       self.parent = None
+       self.deleted = []
+       if RecordManifest.is_manifest(self.recordfile):
+           sfiles = self.__read_manifest()
+       else:
+           sfiles = self.read_xml()
+
+       # the parent is recorded before any of the files
+       first = next(sfiles, None)
+       if first is None:
+           return iter([])
+       return itertools.chain([first], sfiles)
+
+    def __read_manifest(self):
+       '''helper generating the files recorded in the manifest'''
+       for tag, fields in RecordManifest(self.recordfile, 'files').read():
+           if tag == 'f':
+               path, size, mode, uid, gid, mtime, inode, digest, inherited = fields
+               sfile = SFile(path)
+               if size is not None:
+                   sfile.size = int(size)
+                   sfile.mtime = float(mtime)
+                   sfile.inode = int(inode)
+               if mode is not None:
+                   sfile.mode = int(mode)
+                   sfile.uid = int(uid)
+                   sfile.gid = int(gid)
+               sfile.digest = digest
+               sfile.inherited = inherited == 'i'
+               yield sfile
+           elif tag == 'd':
+               self.deleted.append(fields[0])
+           elif tag == 'p':
+               self.parent = fields[0]
+
+    def read_xml(self):
+       '''generator reading the files from an xml record file, as written by earlier
+          versions of snap, the parent and deleted paths are set as they are read'''
        handler = _FilesRecordFileParser()
-       parser.setContentHandler(handler)
-       parser.parse(self.recordfile)
-       return handler.files
+       self.deleted = handler.deleted
+       for sfile in RecordManifest.read_xml(self.recordfile, handler, 'files'):
+           self.parent = handler.parent
+           yield sfile
+       self.parent = handler.parent
 
 class _FilesRecordFileParser(xml.sax.handler.ContentHandler):
     '''internal class to parse the files record file'''
@@ -127,24 +316,48 @@ class _FilesRecordFileParser(xml.sax.handler.ContentHandler):
         # list of files parsed
         self.files = []
 
-        # current data being processed
+        # the parent snapfile and paths deleted since it, if incremental
+        self.parent = None
+        self.deleted = []
+
+        # the attributes of the current file
+        self.current_attrs = None
+
+        # chunks of the current data being processed
         self.current_path = None
 
         # if we are currently evaluating a file
         self.in_file_content = False
 
     def startElement(self, name, attrs):
-        if name == 'file':
-            self.current_path = ''
+        if name == 'files':
+            self.parent = attrs.get('parent', None)
+        elif name == 'file' or name == 'deleted':
+            self.current_path = []
+            self.current_attrs = attrs.copy()
             self.in_file_content = True
 
     def characters(self, ch):
         if self.in_file_content:
             if ch != '\n':
-                self.current_path = self.current_path + ch
+                self.current_path.append(ch)
 
 
     def endElement(self, name):
         if name == 'file':
             self.in_file_content = False
-            self.files.append(SFile(xml.sax.saxutils.unescape(self.current_path)))
+            sfile = SFile(xml.sax.saxutils.unescape(''.join(self.current_path)))
+            if 'size' in self.current_attrs:
+                sfile.size = int(self.current_attrs['size'])
+                sfile.mtime = float(self.current_attrs['mtime'])
+                sfile.inode = int(self.current_attrs['inode'])
+            if 'mode' in self.current_attrs:
+                sfile.mode = int(self.current_attrs['mode'], 8)
+                sfile.uid = int(self.current_attrs['uid'])
+                sfile.gid = int(self.current_attrs['gid'])
+            sfile.digest = self.current_attrs.get('digest', None)
+            sfile.inherited = self.current_attrs.get('inherited', None) == 'true'
+            self.files.append(sfile)
+        elif name == 'deleted':
+            self.in_file_content = False
+            self.deleted.append(xml.sax.saxutils.unescape(''.join(self.current_path)))
@@ -14,11 +14,20 @@
 
 import os
 import sys
+import copy
+import stat
 import tarfile
 
 import snap
+from snap.sparse import SparseFile
+from snap.metadata.attributes import ArchivedAttributes
 from snap.filemanager import FileManager
+from snap.compression import Compression, DecompressedReader
 from snap.exceptions  import MissingDirError
+from snap.metadata.archive import DirectArchive
+from snap.metadata.extractor import SnapExtractor
+from snap.metadata.restore import DirectRestore
+from snap.metadata.snapindex import IndexingTarFile, SnapIndex
 
 # skip snapshot encyrption support on windows for the time being
 if not snap.osregistry.OS.is_windows():
@@ -26,7 +35,10 @@ if not snap.osregistry.OS.is_windows():
 
 class SnapFile:
     """The snapfile, the end result of the backup operation
-       and input into the restore operation. This is a tar guziped archive."""
+       and input into the restore operation. This is a tar archive compressed
+       with one of the codecs in snap.compression, gzip by default, and
+       encrypted as it is written if a password is set. Files linked together
+       are stored once and only the data of sparse files is stored."""
 
     def __init__(self, snapfile, snapdirectory, encryption_password=None):
         '''initialize the snapfile
@@ -42,23 +54,96 @@ class SnapFile:
         self.snapdirectory = snapdirectory
         self.encryption_password = encryption_password
 
-        if  not snap.osregistry.OS.is_windows() and self.encryption_password != None:
-            self.encryption_key = Crypto.generate_key(self.encryption_password)
-        else:
-            self.encryption_key = None
+        # skip encryption on windows for the time being
+        self.encrypted = not snap.osregistry.OS.is_windows() and self.encryption_password != None
 
-    def __prepare_file_for_tarball(tarball, fullpath, partialpath):
+    def __prepare_file_for_tarball(tarball, fullpath, partialpath, fs):
         '''set attributes of a file for inclusion in a tarball'''
         tarinfo = tarball.gettarinfo(partialpath)
         tarinfo.name = partialpath
-        fs = os.stat(fullpath)
         tarinfo.uid = fs.st_uid
         tarinfo.gid = fs.st_gid
         tarinfo.mtime = fs.st_mtime
         tarinfo.mode = fs.st_mode
+        if tarinfo.isreg() or tarinfo.isdir():
+            tarinfo.pax_headers = ArchivedAttributes.pax_headers(fullpath)
         return tarinfo
     __prepare_file_for_tarball = staticmethod(__prepare_file_for_tarball)
         
+    def __directory_tarinfo(name, fs):
+        '''return the tarinfo for a directory with the specified stat attributes'''
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.type = tarfile.DIRTYPE
+        tarinfo.uid = fs.st_uid
+        tarinfo.gid = fs.st_gid
+        tarinfo.mtime = fs.st_mtime
+        tarinfo.mode = stat.S_IMODE(fs.st_mode)
+        return tarinfo
+    __directory_tarinfo = staticmethod(__directory_tarinfo)
+
+    def __add_file(tarball, tarinfo, tfile):
+        '''write a regular file to the tarball, only its data if it is sparse.
+           Files linked to others already written are written as links to them
+           by gettarinfo, without their contents'''
+        regions = None
+        if tarinfo.isreg():
+            regions = SparseFile.regions(tfile, tarinfo.size)
+        if regions is None:
+            tarball.addfile(tarinfo, tfile)
+        else:
+            tarball.addsparse(tarinfo, tfile, regions)
+    __add_file = staticmethod(__add_file)
+
+    def __add_archive_entry(tarball, entry, directories):
+        '''write a direct archive entry to the tarball, preceeded by any of its parent
+           directories not yet written, replicating them as SFile.copy_to would'''
+        name = entry.name.replace(os.sep, "/")
+
+        # parent directories take the attributes of the directories they were
+        # copied from, symlinks to directories are replicated as directories
+        parents = []
+        source_dir = os.path.dirname(entry.source)
+        dirname = os.path.dirname(name)
+        while dirname != '' and not dirname in directories:
+            parents.append((dirname, source_dir))
+            source_dir = os.path.dirname(source_dir)
+            dirname = os.path.dirname(dirname)
+        parents.reverse()
+        for dirname, source_dir in parents:
+            try:
+                tarinfo = SnapFile.__directory_tarinfo(dirname, os.stat(source_dir))
+                tarinfo.pax_headers = ArchivedAttributes.pax_headers(source_dir)
+            except (IOError, OSError):
+                return # source removed since it was registered
+            tarball.addfile(tarinfo)
+            directories.add(dirname)
+
+        if stat.S_ISLNK(entry.fs.st_mode):
+            try:
+                tarinfo = tarball.gettarinfo(entry.source, name)
+            except OSError:
+                return # source removed since it was registered
+            tarinfo.linkname = os.path.realpath(entry.source)
+            tarball.addfile(tarinfo)
+
+        elif stat.S_ISREG(entry.fs.st_mode):
+            try:
+                tfile = open(entry.source, 'rb')
+            except IOError:
+                return # source removed since it was registered
+            try:
+                # take the size from the open file so it matches what is read
+                tarinfo = tarball.gettarinfo(arcname=name, fileobj=tfile)
+                if tarinfo.isreg():
+                    try:
+                        tarinfo.pax_headers = ArchivedAttributes.pax_headers(entry.source)
+                    except (IOError, OSError):
+                        return # source removed since it was registered
+                SnapFile.__add_file(tarball, tarinfo, tfile)
+            finally:
+                tfile.close()
+    __add_archive_entry = staticmethod(__add_archive_entry)
+
     def compress(self):
         '''create a snapfile from the snapdirectory
 
@@ -72,8 +157,16 @@ class SnapFile:
         else:
           snapfileo = open(self.snapfile, 'w')
 
-        # create the tarball
-        tarball = tarfile.open(fileobj=snapfileo, mode="w:gz")
+        # encrypt the snapshot as it is written if we've set a key
+        encrypted = snapfileo
+        if self.encrypted:
+            if snap.config.options.log_level_at_least('verbose'):
+                snap.callback.snapcallback.message("Encyrpting snapfile")
+            encrypted = Crypto.writer(self.encryption_password, snapfileo)
+
+        # create the tarball, compressing it with the configured codec
+        compressed = Compression.writer(encrypted, snap.config.options.compression)
+        tarball = IndexingTarFile.open(fileobj=compressed, mode="w|")
 
         # temp store the working directory, before changing to the snapdirectory
         cwd = os.getcwd()
@@ -81,73 +174,234 @@ class SnapFile:
         
         seperator = snap.osregistry.OS.get_path_seperator()
 
-        # copy directories into snapfile
-        for sdir in FileManager.get_all_subdirectories(os.getcwd(), recursive=True):
-            partialpath = sdir.replace(self.snapdirectory + seperator, "")
-            tarball.addfile(self.__prepare_file_for_tarball(tarball, sdir, partialpath))
+        # copy directories and files into snapfile in a single pass,
+        # directories are encountered before their contents
+        directories = set()
+        for entry in FileManager.walk(include=[os.getcwd()], dirs=True):
+            partialpath = entry.path.replace(self.snapdirectory + seperator, "")
+            try:
+                fs = entry.stat()
+            except OSError:
+                continue # skip dangling links
+            tarinfo = self.__prepare_file_for_tarball(tarball, entry.path, partialpath, fs)
+            if tarinfo.isreg():
+                with open(entry.path, 'rb') as tfile:
+                    self.__add_file(tarball, tarinfo, tfile)
+            else:
+                if tarinfo.isdir():
+                    directories.add(tarinfo.name)
+                tarball.addfile(tarinfo)
 
-        # copy files into snapfile
-        for tfile in FileManager.get_all_files(include=[os.getcwd()]):
-            partialpath = tfile.replace(self.snapdirectory + seperator, "")
-            if os.path.exists(tfile):
-                tarball.addfile(self.__prepare_file_for_tarball(tarball, tfile, partialpath), file(tfile, 'rb'))
+        # stream the files registered with the direct archive, if any,
+        # straight from their original locations
+        archive = DirectArchive.lookup(self.snapdirectory)
+        if archive is not None:
+            for entry in archive.entries:
+                self.__add_archive_entry(tarball, entry, directories)
 
-        # finish up tarball creation
+        # finish up tarball creation, following it with the index
+        #  of its members if the codec permits
         tarball.close()
+        compressed.close()
+        if compressed.codec.FOOTER_SIZE > 0:
+            compressed.write_index(SnapIndex.build(tarball.offsets, compressed.chunks).dump())
+        encrypted.close()
         if self.snapfile != '-':
           snapfileo.close()
 
-        # encrypt the snapshot if we've set a key
-        if not snap.osregistry.OS.is_windows() and self.encryption_key != None:
-            if snap.config.options.log_level_at_least('verbose'):
-                snap.callback.snapcallback.message("Encyrpting snapfile")
-            Crypto.encrypt_file(self.encryption_key, self.snapfile, self.snapfile + ".enc")
-            FileManager.mv(self.snapfile + ".enc", self.snapfile)
-
         if snap.config.options.log_level_at_least('normal'):
             snap.callback.snapcallback.message("Snapfile " + self.snapfile + " created")
 
         # restore the working directory
         os.chdir(cwd)
 
+    def __open(self):
+        '''helper to open the snapfile for reading, if snapfile == '-' read from stdin'''
+        if self.snapfile == '-':
+          return sys.stdin
+        return open(self.snapfile, 'rb')
+
+    def __decrypted(self, snapfileo):
+        '''helper to return a file object decrypting the snapfile as it is read if
+           we've set a key, else the snapfile itself'''
+        if not self.encrypted:
+            return snapfileo
+        if snap.config.options.log_level_at_least('verbose'):
+            snap.callback.snapcallback.message("Decyrpting snapfile")
+        return Crypto.reader(self.encryption_password, snapfileo)
+
+    def __close(self, snapfileo, decrypted):
+        '''helper to close the snapfile and the decrypting reader wrapping it'''
+        if decrypted is not snapfileo:
+            decrypted.close()
+        if self.snapfile != '-':
+            snapfileo.close()
+
+    def __read_index(self, snapfileo):
+        '''helper to return the codec and index of the snapfile, the index is None
+           if the snapfile does not have one or cannot be seeked'''
+        if self.snapfile == '-' or not hasattr(snapfileo, 'seek'):
+            return None, None
+        codec, index = Compression.read_index(snapfileo)
+        if index is not None:
+            index = SnapIndex.parse(index)
+        return codec, index
+
+    def list(self):
+        '''return the names of the members of the snapfile, read from its index if
+           it has one, else by scanning the snapfile'''
+        snapfileo = self.__open()
+        decrypted = snapfileo
+        try:
+            decrypted = self.__decrypted(snapfileo)
+            codec, index = self.__read_index(decrypted)
+            if index is not None:
+                return index.names()
+
+            if codec is not None:
+                decrypted.seek(0)
+            tarball = tarfile.open(fileobj=Compression.reader(decrypted), mode="r|")
+            names = [tarinfo.name for tarinfo in tarball]
+            tarball.close()
+            return names
+        finally:
+            self.__close(snapfileo, decrypted)
+
+    def __extractor(self):
+        '''helper to return the extractor to extract members with, writing those
+           of any direct restore registered for the snapdirectory to their destinations'''
+        return SnapExtractor(self.snapdirectory, restore=DirectRestore.lookup(self.snapdirectory))
+
+    def __verifier(self, decrypted):
+        '''helper to return a callable reading the rest of the decrypted snapfile, so
+           that the chunks after the end of the tarball are verified before any member
+           is renamed to its destination, None if the snapfile is not encrypted'''
+        if not self.encrypted:
+            return None
+        def verify():
+            while len(decrypted.read(Compression.READSIZE)) > 0:
+                pass
+        return verify
+
+    def __read_member(decrypted, codec, entry):
+        '''helper to return the tarball positioned at the indexed member and its TarInfo'''
+        # decompress from the start of the chunk, skipping to the member
+        decrypted.seek(entry.chunk)
+        reader = DecompressedReader(decrypted, codec)
+        reader.read(entry.offset)
+        tarball = tarfile.open(fileobj=reader, mode="r|")
+        return tarball, tarball.next()
+    __read_member = staticmethod(__read_member)
+
+    def __linked_members(tarball, links):
+        '''helper to return the members to extract in place of the specified hardlinks,
+           whose targets were not extracted. The first link to each target takes
+           its data and any others are linked to the first
+
+        @param tarball - the TarFile to read the targets from
+        @param links - list of the TarInfo of the hardlinks
+        @returns - iterable of (TarFile, TarInfo) of the members to extract'''
+        targets = {}
+        for link in links:
+            targets.setdefault(link.linkname, []).append(link)
+        for tarinfo in tarball:
+            if len(targets) == 0:
+                break
+            if not tarinfo.name in targets:
+                continue
+            first = None
+            for link in targets.pop(tarinfo.name):
+                if first is None:
+                    member = copy.copy(tarinfo)
+                    member.name = first = link.name
+                else:
+                    member = copy.copy(link)
+                    member.linkname = first
+                yield tarball, member
+    __linked_members = staticmethod(__linked_members)
+
+    def extract_only(self, names):
+        '''extract the specified members of the snapfile and those underneath them
+           into the snapdirectory. If the snapfile is indexed only the chunks containing
+           the members are read and decompressed, else the snapfile is scanned for them.
+           Hardlinks to members which are not extracted are extracted with their data
+
+        @param names - the names of the members to extract, relative to the snapdirectory'''
+        snapfileo = self.__open()
+        decrypted = snapfileo
+        try:
+            decrypted = self.__decrypted(snapfileo)
+            codec, index = self.__read_index(decrypted)
+            if index is not None:
+                entries = dict((entry.name, entry) for entry in index.entries)
+                extracted = set()
+
+                # link targets which were not selected -> the first link extracted with their data
+                linked = {}
+                for entry in index.select(names):
+                    tarball, tarinfo = self.__read_member(decrypted, codec, entry)
+                    if tarinfo.islnk() and tarinfo.linkname in linked:
+                        tarinfo.linkname = linked[tarinfo.linkname]
+                    elif tarinfo.islnk() and not tarinfo.linkname in extracted and \
+                         tarinfo.linkname in entries:
+                        tarball.close()
+                        tarball, target = self.__read_member(decrypted, codec, entries[tarinfo.linkname])
+                        linked[tarinfo.linkname] = target.name = tarinfo.name
+                        tarinfo = target
+                    tarball.extract(tarinfo, self.snapdirectory)
+                    if not tarinfo.issym():
+                        ArchivedAttributes.restore(tarinfo, os.path.join(self.snapdirectory, tarinfo.name))
+                    tarball.close()
+                    extracted.add(tarinfo.name)
+
+            else:
+                if codec is not None:
+                    decrypted.seek(0)
+                targets = SnapIndex.targets(names)
+                tarball = tarfile.open(fileobj=Compression.reader(decrypted), mode="r|")
+                extractor = self.__extractor()
+                extractor.extract(tarball,
+                    lambda tarinfo: SnapIndex.matches(tarinfo.name, targets),
+                    self.__verifier(decrypted))
+                tarball.close()
+
+                # the targets of any links which were not selected precede
+                # them, so they are extracted from another scan of the snapfile
+                links = extractor.unresolved_links
+                if len(links) > 0 and self.snapfile == '-':
+                    for link in links:
+                        snap.callback.snapcallback.warn("Could not extract " + link.name +
+                                                        " linked to " + link.linkname + " from stdin")
+                elif len(links) > 0:
+                    decrypted.seek(0)
+                    tarball = tarfile.open(fileobj=Compression.reader(decrypted), mode="r|")
+                    extractor.extract_members(self.__linked_members(tarball, links),
+                                              self.__verifier(decrypted))
+                    tarball.close()
+        finally:
+            self.__close(snapfileo, decrypted)
+
+        if snap.config.options.log_level_at_least('normal'):
+            snap.callback.snapcallback.message("Snapfile " + self.snapfile + " opened")
+
     def extract(self):
         '''extract the snapfile into the snapdirectory
         
         @raises - MissingFileError if the snapfile does not exist
         '''
+        snapfileo = self.__open()
 
-        # decrypt the file if we've set a key
-        if not snap.osregistry.OS.is_windows() and self.encryption_key != None:
-            if snap.config.options.log_level_at_least('verbose'):
-                snap.callback.snapcallback.message("Decyrpting snapfile")
-            Crypto.decrypt_file(self.encryption_key, self.snapfile, self.snapfile + ".dec")
-            FileManager.mv(self.snapfile + ".dec", self.snapfile)
-
-        # if snapfile == '-' read from stdin
-        snapfileo = None
-        if self.snapfile == '-':
-          snapfileo = sys.stdin
-        else:
-          snapfileo = open(self.snapfile, 'r')
-
-        # open the tarball
-        tarball = tarfile.open(fileobj=snapfileo)
-
-        # temp store the working directory, before changing to the snapdirectory
-        cwd = os.getcwd()
-        os.chdir(self.snapdirectory)
+        # open the tarball, decrypting it as it is read if we've set a key
+        # and detecting the codec it was compressed with
+        decrypted = self.__decrypted(snapfileo)
+        tarball = tarfile.open(fileobj=Compression.reader(decrypted), mode="r|")
 
-        # extract files from it
-        for tarinfo in tarball:
-            tarball.extract(tarinfo)
+        # extract files from it, writing them in parallel
+        self.__extractor().extract(tarball, complete=self.__verifier(decrypted))
 
         # close it out
         tarball.close()
-        if self.snapfile != '-':
-          snapfileo.close()
+        self.__close(snapfileo, decrypted)
 
         if snap.config.options.log_level_at_least('normal'):
             snap.callback.snapcallback.message("Snapfile " + self.snapfile + " opened")
-
-        # restore the working directory
-        os.chdir(cwd)
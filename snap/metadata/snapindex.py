@@ -0,0 +1,206 @@
+# Index of the members of a snapfile, permitting random access to them
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import copy
+import bisect
+import tarfile
+
+class IndexingTarFile(tarfile.TarFile):
+    """TarFile recording the offset of the header of each member it writes,
+       which can also write sparse files as old GNU sparse members. Members
+       carrying pax records, such as their extended attributes, are written
+       in the pax format, the others in the format of the archive"""
+
+    # number of (offset, length) entries of the sparse map in the member
+    # header and in each of the extended headers following it
+    SPARSE_HEADER_ENTRIES = 4
+    SPARSE_EXTENDED_ENTRIES = 21
+
+    def __init__(self, *args, **kwargs):
+        # list of (name, offset of the member header in the uncompressed archive)
+        self.offsets = []
+        tarfile.TarFile.__init__(self, *args, **kwargs)
+
+    def addfile(self, tarinfo, fileobj=None):
+        self.offsets.append((tarinfo.name.rstrip('/'), self.offset))
+        if len(tarinfo.pax_headers) == 0 or self.format == tarfile.PAX_FORMAT:
+            tarfile.TarFile.addfile(self, tarinfo, fileobj)
+            return
+
+        archive_format = self.format
+        self.format = tarfile.PAX_FORMAT
+        try:
+            tarfile.TarFile.addfile(self, tarinfo, fileobj)
+        finally:
+            self.format = archive_format
+
+    def addsparse(self, tarinfo, fileobj, regions):
+        '''add a regular file to the archive storing only the specified data regions
+        of it, the holes between them are recreated when the member is extracted
+
+        @param tarinfo - the TarInfo of the file, with its full size
+        @param fileobj - the file to read the regions from
+        @param regions - list of (offset, length) of the data in the file, in order'''
+        self._check("aw")
+        self.offsets.append((tarinfo.name.rstrip('/'), self.offset))
+
+        tarinfo = copy.copy(tarinfo)
+        realsize = tarinfo.size
+        tarinfo.type = tarfile.GNUTYPE_SPARSE
+        tarinfo.size = sum([length for offset, length in regions])
+        buf = tarinfo.tobuf(tarfile.GNU_FORMAT, self.encoding, self.errors)
+
+        # the sparse map is written to the unused space at the end of the
+        # header, any entries that do not fit to the extended headers after it.
+        # GNU tar takes the size of the file from the end of the last entry
+        # so a file ending in a hole is terminated with an empty one
+        sparsemap = list(regions)
+        if len(sparsemap) == 0 or sum(sparsemap[-1]) < realsize:
+            sparsemap.append((realsize, 0))
+        entries = [tarfile.itn(offset, 12, tarfile.GNU_FORMAT) + tarfile.itn(length, 12, tarfile.GNU_FORMAT)
+                   for offset, length in sparsemap]
+        first = entries[:IndexingTarFile.SPARSE_HEADER_ENTRIES]
+        extended = entries[IndexingTarFile.SPARSE_HEADER_ENTRIES:]
+        header = buf[-tarfile.BLOCKSIZE:]
+        header = header[:386] + "".join(first).ljust(96, tarfile.NUL) + \
+                 (len(extended) > 0 and "\1" or tarfile.NUL) + \
+                 tarfile.itn(realsize, 12, tarfile.GNU_FORMAT) + header[495:]
+        header = header[:148] + "        " + header[156:]
+        header = header[:148] + "%06o\0" % tarfile.calc_chksums(header)[0] + header[155:]
+        buf = buf[:-tarfile.BLOCKSIZE] + header
+        if len(tarinfo.pax_headers) > 0:
+            buf = tarfile.TarInfo._create_pax_generic_header(tarinfo.pax_headers, tarfile.XHDTYPE) + buf
+
+        step = IndexingTarFile.SPARSE_EXTENDED_ENTRIES
+        for i in range(0, len(extended), step):
+            more = i + step < len(extended)
+            buf += "".join(extended[i:i + step]).ljust(504, tarfile.NUL) + \
+                   (more and "\1" or tarfile.NUL) + tarfile.NUL * 7
+        self.fileobj.write(buf)
+        self.offset += len(buf)
+
+        # the regions are written one after the other, padded if the
+        # file has been truncated since they were located
+        for offset, length in regions:
+            fileobj.seek(offset)
+            remaining = length
+            while remaining > 0:
+                data = fileobj.read(min(remaining, tarfile.RECORDSIZE))
+                if len(data) == 0:
+                    data = tarfile.NUL * min(remaining, tarfile.RECORDSIZE)
+                self.fileobj.write(data)
+                remaining -= len(data)
+        blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            self.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        self.offset += blocks * tarfile.BLOCKSIZE
+
+        tarinfo.size = realsize
+        self.members.append(tarinfo)
+
+class SnapIndexEntry(object):
+    """Location of a member in a snapfile"""
+
+    def __init__(self, name, chunk, offset):
+        '''initialize the entry
+
+        @param name - the name of the member in the archive
+        @param chunk - the offset of the compressed chunk containing the member header
+        @param offset - the offset of the member header in the uncompressed chunk'''
+        self.name = name
+        self.chunk = chunk
+        self.offset = offset
+
+class SnapIndex:
+    """Index written after the compressed data of a snapfile, mapping each member
+       to the independently compressed chunk its header starts in, so that
+       members can be listed and extracted without decompressing the rest.
+
+       The index is a text document, a version line followed by a line of
+       'chunk offset<TAB>offset in chunk<TAB>escaped name' per member."""
+
+    VERSION = 'snapindex 1'
+
+    def __init__(self, entries=[]):
+        self.entries = entries
+
+    def build(members, chunks):
+        '''return the index of the specified members
+
+        @param members - list of (name, uncompressed offset) of the members, as
+                         recorded in the offsets of an IndexingTarFile
+        @param chunks - list of (uncompressed offset, compressed offset) of the chunks
+                        the archive was compressed in, as recorded by a CompressedWriter'''
+        starts = [start for start, chunk in chunks]
+        entries = []
+        for name, offset in members:
+            start, chunk = chunks[bisect.bisect_right(starts, offset) - 1]
+            entries.append(SnapIndexEntry(name, chunk, offset - start))
+        return SnapIndex(entries)
+    build = staticmethod(build)
+
+    def dump(self):
+        '''return the index serialized as a string'''
+        lines = [SnapIndex.VERSION]
+        for entry in self.entries:
+            lines.append('%d\t%d\t%s' % (entry.chunk, entry.offset, entry.name.encode('string_escape')))
+        return '\n'.join(lines) + '\n'
+
+    def parse(data):
+        '''return the index serialized in the specified string, None if it is not an index'''
+        lines = data.split('\n')
+        if lines[0] != SnapIndex.VERSION:
+            return None
+        entries = []
+        for line in lines[1:]:
+            if line == '':
+                continue
+            chunk, offset, name = line.split('\t', 2)
+            entries.append(SnapIndexEntry(name.decode('string_escape'), int(chunk), int(offset)))
+        return SnapIndex(entries)
+    parse = staticmethod(parse)
+
+    def names(self):
+        '''return the names of the members in the index'''
+        return [entry.name for entry in self.entries]
+
+    def archive_name(path):
+        '''return the archive name corresponding to the specified relative path'''
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        return path.replace(os.sep, '/').rstrip('/')
+    archive_name = staticmethod(archive_name)
+
+    def targets(names):
+        '''return the set of archive names corresponding to the specified paths'''
+        return set(SnapIndex.archive_name(name) for name in names)
+    targets = staticmethod(targets)
+
+    def matches(name, targets):
+        '''return true if the member name is one of the targets or is underneath one of them
+
+        @param name - the name of the member
+        @param targets - set of names as returned by SnapIndex.targets'''
+        while name != '':
+            if name in targets:
+                return True
+            name = name.rpartition('/')[0]
+        return False
+    matches = staticmethod(matches)
+
+    def select(self, names):
+        '''return the entries of the members with the specified names or underneath them'''
+        targets = SnapIndex.targets(names)
+        return [entry for entry in self.entries if SnapIndex.matches(entry.name, targets)]
@@ -14,6 +14,7 @@
 import config, callback
 from snap.metadata.snapfile import SnapFile
 from snap.metadata.tdl      import TDLFile
+from snap.metadata.chunkstore import ChunkStore
 from snap.exceptions        import InvalidOperationError
 
 class OutputFormatter:
@@ -30,16 +31,49 @@ class OutputFormatter:
     elif output_format == "tdl":
       TDLFile(tdlfile=outfile,
               snapdirectory=snapdir).write()
+    elif output_format == "chunkstore":
+      cls.__chunk_store(outfile, snapdir, encryption_password).write()
 
   @classmethod
   def retrieve(cls, output_format, **args):
     infile = args['infile']
     snapdir = args['snapdirectory']
     encryption_password = args['encryption_password']
+    only = args.get('only', None)
 
     if output_format == "snapfile":
-      SnapFile(snapfile=infile,
-               snapdirectory=snapdir,
-               encryption_password=encryption_password).extract()
+      snapfile = SnapFile(snapfile=infile,
+                          snapdirectory=snapdir,
+                          encryption_password=encryption_password)
+      if only:
+        snapfile.extract_only(only)
+      else:
+        snapfile.extract()
     elif output_format == "tdl":
       raise InvalidOperationError("cannot use snap to restore tdls")
+    elif output_format == "chunkstore":
+      cls.__chunk_store(infile, snapdir, encryption_password).extract(only)
+
+  @classmethod
+  def list(cls, output_format, **args):
+    infile = args['infile']
+    snapdir = args['snapdirectory']
+    encryption_password = args['encryption_password']
+
+    if output_format == "snapfile":
+      return SnapFile(snapfile=infile,
+                      snapdirectory=snapdir,
+                      encryption_password=encryption_password).list()
+    elif output_format == "tdl":
+      raise InvalidOperationError("cannot use snap to list tdls")
+    elif output_format == "chunkstore":
+      return cls.__chunk_store(infile, snapdir, encryption_password).list()
+
+  @classmethod
+  def __chunk_store(cls, manifest, snapdir, encryption_password):
+    '''helper to return the chunk store snapshot with the specified manifest'''
+    if encryption_password:
+      raise InvalidOperationError("chunk store snapshots cannot be encrypted")
+    return ChunkStore(manifest=manifest,
+                      snapdirectory=snapdir,
+                      storedir=config.options.chunk_store)
@@ -0,0 +1,99 @@
+# Helpers to run snap operations across pools of workers
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import collections
+import multiprocessing
+import multiprocessing.pool
+
+import snap
+
+def _map_chunk(args):
+    '''apply a function to a chunk of items, module level so it may be pickled'''
+    func, chunk = args
+    return [func(item) for item in chunk]
+
+class Parallel:
+    """Bounded, order preserving parallel map over thread and process pools"""
+
+    def cpu_count():
+        '''return the number of cpus available, defaulting to 1 if it cannot be determined'''
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+    cpu_count = staticmethod(cpu_count)
+
+    def jobs():
+        '''return the number of workers to run in parallel, as configured or
+           defaulting to the number of cpus'''
+        if snap.config.options.jobs:
+            return snap.config.options.jobs
+        return Parallel.cpu_count()
+    jobs = staticmethod(jobs)
+
+    def imap(pool, func, iterable, workers, chunksize=1):
+        '''generator applying func to each item in iterable across the pool, yielding
+        the results in the order of the items.
+
+        Unlike Pool.imap the iterable is consumed lazily, at most a few chunks per
+        worker are in flight at any time so memory use stays bounded no matter how
+        many items are produced.
+
+        @param pool - the multiprocessing Pool or ThreadPool to run func in
+        @param func - the function to apply, must be picklable for process pools
+        @param iterable - the items to apply the function to
+        @param workers - the number of workers in the pool
+        @param chunksize - the number of items to send to a worker at a time'''
+        window = workers * 4
+        pending = collections.deque()
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) >= chunksize:
+                pending.append(pool.apply_async(_map_chunk, ((func, chunk),)))
+                chunk = []
+                if len(pending) >= window:
+                    for result in pending.popleft().get():
+                        yield result
+
+        if len(chunk) > 0:
+            pending.append(pool.apply_async(_map_chunk, ((func, chunk),)))
+
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    imap = staticmethod(imap)
+
+    def run(func, items, jobs=None):
+        '''apply func to each of the items across a thread pool of its own,
+        for work such as running external commands which waits on other processes
+
+        @param func - the function to apply
+        @param items - the items to apply the function to
+        @param jobs - the maximum number of threads to run, defaults to the configured number of jobs
+        @returns - list of the results, in the order of the items'''
+        items = list(items)
+        if len(items) == 0:
+            return []
+        if jobs is None:
+            jobs = Parallel.jobs()
+        jobs = min(jobs, len(items))
+        pool = multiprocessing.pool.ThreadPool(jobs)
+        try:
+            results = list(Parallel.imap(pool, func, items, jobs))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return results
+    run = staticmethod(run)
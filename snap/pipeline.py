@@ -0,0 +1,127 @@
+# Parallel pipeline used by the files backends to classify and copy files
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import stat
+import multiprocessing.pool
+
+import snap
+from snap.digest           import FileDigest
+from snap.parallel         import Parallel
+from snap.metadata.sfile   import SFile
+from snap.metadata.archive import DirectArchive
+from snap.metadata.attributes import AttributeReplicator
+from snap.metadata.hardlinks import HardLinks
+
+class FilePipeline:
+    """Bounded walk -> classify -> copy pipeline.
+
+       Each stage is a generator consuming the previous one, the classify and
+       copy stages run across their own thread pools. Results are yielded in the
+       order the files were walked so the record files written from them are
+       deterministic."""
+
+    # number of paths handed to a worker thread at a time
+    CHUNKSIZE = 32
+
+    def __init__(self, jobs=None, cache=None):
+        '''initialize the pipeline
+
+        @param jobs - the number of threads to run each stage with, defaults
+                      to the configured number of jobs
+        @param cache - optional StatCache to reuse the verdicts and digests of
+                       files unchanged since previous backups from'''
+        if jobs is None:
+            jobs = Parallel.jobs()
+        self.jobs = jobs
+        self.cache = cache
+
+    def __run(self, func, items):
+        '''helper to run func over the items across a thread pool of its own'''
+        pool = multiprocessing.pool.ThreadPool(self.jobs)
+        try:
+            for result in Parallel.imap(pool, func, items, self.jobs, FilePipeline.CHUNKSIZE):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def classify(self, files, modified, context_for=None):
+        '''generator yielding a (path, modified) tuple for each of the specified files
+
+        @param files - iterable of paths to classify
+        @param modified - callable returning true if a path should be backed up
+        @param context_for - callable returning the context string the verdicts of
+                             a path are cached under, required if the pipeline has a cache'''
+        if self.cache is not None:
+            modified = self.cache.cached_modified(modified, context_for)
+        return self.__run(lambda path: (path, modified(path)), files)
+
+    def copy(self, classified, basedir, parent=None):
+        '''generator copying the modified files to basedir, yielding the SFiles
+        corresponding to those copied with their size, mtime and inode recorded.
+        Files which cannot be read are skipped. The attributes of the copies are
+        replicated in batches, those of the directories created once all are copied.
+        Files linked to others already copied are linked to their copies.
+
+        If a direct archive is registered for basedir the files are registered
+        with it, in order, rather than being copied.
+
+        @param classified - iterable of (path, modified) tuples
+        @param basedir - the directory to copy the files to
+        @param parent - optional dict of paths to SFiles recorded by a parent snapshot,
+                        files unchanged since are yielded as inherited and not copied'''
+        archive = DirectArchive.lookup(basedir)
+        digests = snap.config.options.file_digests
+        cache = self.cache
+        attributes = AttributeReplicator(self.jobs)
+        links = HardLinks()
+
+        def copy_file(path):
+            if not os.access(path, os.R_OK):
+                return None
+            sfile = SFile(path)
+            try:
+                fs = os.lstat(path)
+            except OSError:
+                return None
+            sfile.record_stat(fs)
+            if digests and stat.S_ISREG(fs.st_mode):
+                if cache is not None:
+                    sfile.digest = cache.digest(path, fs)
+                if sfile.digest is None:
+                    sfile.digest = FileDigest.hash_file(path)
+                    if cache is not None:
+                        cache.record(path, fs, digest=sfile.digest)
+
+            if parent is not None:
+                previous = parent.get(sfile.escaped_path(basedir))
+                if previous is not None and sfile.unchanged_since(previous):
+                    sfile.path = sfile.escaped_path(basedir)
+                    sfile.inherited = True
+                    return sfile
+
+            if archive is not None:
+                return sfile
+            return sfile.copy_to(basedir, fs=fs, attributes=attributes, links=links)
+
+        modified = (path for path, is_modified in classified if is_modified)
+        for sfile in self.__run(copy_file, modified):
+            if sfile is not None:
+                if archive is not None and not sfile.inherited:
+                    sfile.archive_to(basedir, archive)
+                yield sfile
+
+        # the ownership, permissions and times of the copies are set once they are all made
+        attributes.apply()
@@ -0,0 +1,83 @@
+# Detection of the data regions of sparse files
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import sys
+import errno
+
+# python 2 does not define the lseek whences locating data and holes,
+# they are only used where the platform is known to support them
+SEEK_DATA = getattr(os, 'SEEK_DATA', None)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', None)
+if SEEK_DATA is None and sys.platform.startswith('linux'):
+    SEEK_DATA, SEEK_HOLE = 3, 4
+
+class SparseFile:
+    """Locates the data in sparse files so only it need be copied or archived.
+
+       A file is only probed with SEEK_DATA / SEEK_HOLE if fewer blocks are
+       allocated to it than its size requires, so files which are not sparse
+       cost no more than the stat result already collected for them."""
+
+    # errors indicating the filesystem cannot locate the holes in files
+    UNSUPPORTED = tuple(getattr(errno, name) for name in ('EINVAL', 'ENOTSUP', 'EOPNOTSUPP', 'ENOSYS')
+                        if hasattr(errno, name))
+
+    def is_sparse(fs):
+        '''return true if the file with the specified stat result may have holes'''
+        blocks = getattr(fs, 'st_blocks', None)
+        return SEEK_DATA is not None and blocks is not None and blocks * 512 < fs.st_size
+    is_sparse = staticmethod(is_sparse)
+
+    def regions(fileobj, size=None):
+        '''return the data regions of the open file if it is sparse
+
+        @param fileobj - the file to locate the data in, it is left positioned at its start
+        @param size - the size of the file to consider, defaults to its current size
+        @returns - list of (offset, length) of the data in the file, in order, or None if
+                   the file is not sparse or its holes cannot be located'''
+        fd = fileobj.fileno()
+        fs = os.fstat(fd)
+        if size is None:
+            size = fs.st_size
+        if not SparseFile.is_sparse(fs):
+            return None
+
+        regions = []
+        offset = 0
+        try:
+            while offset < size:
+                try:
+                    start = os.lseek(fd, offset, SEEK_DATA)
+                except OSError, e:
+                    # nothing but a hole remains
+                    if e.errno == errno.ENXIO:
+                        break
+                    raise
+                if start >= size:
+                    break
+                end = min(os.lseek(fd, start, SEEK_HOLE), size)
+                regions.append((start, end - start))
+                offset = end
+        except OSError, e:
+            if e.errno in SparseFile.UNSUPPORTED:
+                return None
+            raise
+        finally:
+            os.lseek(fd, 0, os.SEEK_SET)
+            fileobj.seek(0)
+
+        if len(regions) == 1 and regions[0] == (0, size):
+            return None
+        return regions
+    regions = staticmethod(regions)
@@ -0,0 +1,197 @@
+# Persistent cache of the classification verdicts and digests of files
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import time
+import sqlite3
+import threading
+
+import snap
+
+class StatCache:
+    """On disk cache of what previous backups determined about each file.
+
+       For each path the device, inode, size, mtime and ctime the file had are
+       stored along with whether it was found to be modified and the digest of
+       its contents. The cached values are only used while the file still has
+       the same stat values, so any change to it, including one that preserves
+       its mtime, is picked up by the ctime changing.
+
+       Verdicts are additionally keyed by a context string describing what
+       the file was compared against (eg the package owning it), so that they
+       are recomputed after the package is upgraded.
+
+       Entries not seen for MAX_AGE seconds are evicted when the cache is
+       closed, as are the least recently seen once there are more than MAX_ENTRIES."""
+
+    # entries not seen by a backup within this many seconds are evicted
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    # the maximum number of entries kept
+    MAX_ENTRIES = 1000000
+
+    # number of updates written to the database at a time
+    BATCHSIZE = 1024
+
+    def __init__(self, path):
+        '''open the cache, creating it if it does not exist
+
+        @param path - the path to the cache database'''
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # the connection is shared between the pipeline threads, guarded by the lock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, ' +
+                        'dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, ' +
+                        'ctime_ns INTEGER, context TEXT, modified INTEGER, digest TEXT, seen INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS files_seen ON files (seen)')
+        self.now = int(time.time())
+
+        # path -> row of the updates not yet written to the database
+        self.pending = {}
+
+    def configured():
+        '''return the configured cache, None if it is disabled or cannot be opened'''
+        path = snap.config.options.stat_cache
+        if not path:
+            return None
+        try:
+            return StatCache(path)
+        except (OSError, sqlite3.Error), e:
+            if snap.config.options.log_level_at_least('verbose'):
+                snap.callback.snapcallback.warn("Could not open stat cache " + path + ": " + str(e))
+            return None
+    configured = staticmethod(configured)
+
+    def key(fs):
+        '''return the (dev, inode, size, mtime_ns, ctime_ns) tuple of the stat result'''
+        mtime_ns = getattr(fs, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(round(fs.st_mtime * 1000000000))
+        ctime_ns = getattr(fs, 'st_ctime_ns', None)
+        if ctime_ns is None:
+            ctime_ns = int(round(fs.st_ctime * 1000000000))
+        return (fs.st_dev, fs.st_ino, fs.st_size, mtime_ns, ctime_ns)
+    key = staticmethod(key)
+
+    def __row(self, path, fs):
+        '''helper to return the row cached for the path if it is still valid
+        for the stat result, must be called with the lock held'''
+        row = self.pending.get(path)
+        if row is None:
+            row = self.db.execute('SELECT dev, inode, size, mtime_ns, ctime_ns, context, modified, digest, seen ' +
+                                  'FROM files WHERE path = ?', (path,)).fetchone()
+            if row is None:
+                return None
+            row = list(row)
+        if tuple(row[:5]) != StatCache.key(fs):
+            return None
+
+        # entries in use are kept from being evicted
+        if row[8] != self.now:
+            row[8] = self.now
+            self.__update(path, row)
+        return row
+
+    def __update(self, path, row):
+        '''helper to queue the row to be written, must be called with the lock held'''
+        self.pending[path] = row
+        if len(self.pending) >= StatCache.BATCHSIZE:
+            self.__flush()
+
+    def __flush(self):
+        '''helper to write the pending rows, must be called with the lock held'''
+        self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            [[path] + row for path, row in self.pending.items()])
+        self.pending = {}
+
+    def verdict(self, path, fs, context):
+        '''return the cached modification verdict of the file, None if there is not one
+
+        @param path - the path to the file
+        @param fs - the current lstat result of the file
+        @param context - string describing what the file is compared against'''
+        with self.lock:
+            row = self.__row(path, fs)
+            if row is None or row[5] != context or row[6] is None:
+                return None
+            return bool(row[6])
+
+    def digest(self, path, fs):
+        '''return the cached md5 digest of the contents of the file, None if there is not one'''
+        with self.lock:
+            row = self.__row(path, fs)
+            if row is None:
+                return None
+            return row[7]
+
+    def record(self, path, fs, context=None, modified=None, digest=None):
+        '''cache the verdict and / or digest of the file with the specified stat
+        result, values not specified are kept if the file has not changed
+
+        @param path - the path to the file
+        @param fs - the lstat result of the file from before the values were computed
+        @param context - string describing what the file was compared against
+        @param modified - boolean indicating if the file was found to be modified
+        @param digest - the md5 digest of the contents of the file'''
+        with self.lock:
+            row = self.__row(path, fs)
+            if row is None:
+                row = list(StatCache.key(fs)) + [None, None, None, self.now]
+            if modified is not None:
+                row[5] = context
+                row[6] = int(modified)
+            if digest is not None:
+                row[7] = digest
+            self.__update(path, row)
+
+    def cached_modified(self, modified, context_for):
+        '''return a callable wrapping the modified callable, returning the cached
+        verdicts of files unchanged since they were last classified and caching
+        the verdicts of those which are not
+
+        @param modified - callable returning true if a path should be backed up
+        @param context_for - callable returning the context string of a path'''
+        def cached(path):
+            try:
+                fs = os.lstat(path)
+            except OSError:
+                return modified(path)
+            context = context_for(path)
+            verdict = self.verdict(path, fs, context)
+            if verdict is None:
+                verdict = modified(path)
+                self.record(path, fs, context, verdict)
+            return verdict
+        return cached
+
+    def evict(self):
+        '''remove the entries not seen recently and the oldest beyond the maximum entries'''
+        with self.lock:
+            self.__flush()
+            self.db.execute('DELETE FROM files WHERE seen < ?', (self.now - StatCache.MAX_AGE,))
+            count = self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            if count > StatCache.MAX_ENTRIES:
+                self.db.execute('DELETE FROM files WHERE path IN (SELECT path FROM files ' +
+                                'ORDER BY seen LIMIT ?)', (count - StatCache.MAX_ENTRIES,))
+
+    def close(self):
+        '''write the pending updates, evict stale entries and close the cache'''
+        self.evict()
+        self.db.commit()
+        self.db.close()
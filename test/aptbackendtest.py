@@ -117,6 +117,12 @@ class AptBackendTest(unittest.TestCase):
                 encoded = PackageRegistry.encode('apt', pkg.name)
                 self.assertIn(encoded, record_package_names)
 
+    def testConffilesIndex(self):
+        backup_target = snap.backends.files.sapt.Sapt()
+        # base-files ships /etc/debian_version as a conffile
+        self.assertIn('/etc/debian_version', backup_target.conffiles)
+        self.assertNotIn('/bin/ls', backup_target.conffiles)
+
     def testBackupFiles(self):
         f=open(self.fs_root + "/foo" , 'w')
         f.write("foo")
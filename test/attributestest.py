@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#
+# test/attributestest.py unit test suite for snap.metadata.attributes
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import stat
+import shutil
+import tarfile
+import unittest
+
+from snap.metadata.sfile import SFile
+from snap.metadata.attributes import AttributeReplicator, ArchivedAttributes, xattr
+
+class AttributeReplicatorTest(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.join(os.path.dirname(__file__), "data", "attributes")
+        self.source = os.path.join(self.basedir, "source")
+        self.dest = os.path.join(self.basedir, "dest")
+        os.makedirs(os.path.join(self.source, "subdir"))
+        for i in range(10):
+            path = os.path.join(self.source, "subdir", str(i))
+            f = open(path, 'w')
+            f.write(str(i))
+            f.close()
+            os.chmod(path, 0600 + i)
+            os.utime(path, (1000000000 + i, 1000000000 + i))
+        os.chmod(os.path.join(self.source, "subdir"), 0750)
+        os.utime(os.path.join(self.source, "subdir"), (1200000000, 1200000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def testBatchedCopy(self):
+        batchsize = AttributeReplicator.BATCHSIZE
+        AttributeReplicator.BATCHSIZE = 4
+        try:
+            attributes = AttributeReplicator(jobs=2)
+            for i in range(10):
+                path = os.path.join("subdir", str(i))
+                SFile(path).copy_to(self.dest, path_prefix=self.source, attributes=attributes)
+            attributes.apply()
+        finally:
+            AttributeReplicator.BATCHSIZE = batchsize
+
+        for i in range(10):
+            fs = os.stat(os.path.join(self.dest, "subdir", str(i)))
+            self.assertEqual(0600 + i, stat.S_IMODE(fs.st_mode))
+            self.assertEqual(1000000000 + i, fs.st_mtime)
+
+        # the directory is replicated after its contents are copied
+        fs = os.stat(os.path.join(self.dest, "subdir"))
+        self.assertEqual(0750, stat.S_IMODE(fs.st_mode))
+        self.assertEqual(1200000000, fs.st_mtime)
+
+    def testCopyWithoutReplicator(self):
+        path = os.path.join("subdir", "3")
+        SFile(path).copy_to(self.dest, path_prefix=self.source)
+        fs = os.stat(os.path.join(self.dest, path))
+        self.assertEqual(0603, stat.S_IMODE(fs.st_mode))
+        self.assertEqual(1000000003, fs.st_mtime)
+
+    def testMissingSource(self):
+        sfile = SFile(os.path.join("subdir", "missing")).copy_to(self.dest, path_prefix=self.source)
+        self.assertEqual(os.path.join("subdir", "missing"), sfile.path)
+        self.assertFalse(os.path.exists(self.dest))
+
+    @unittest.skipIf(xattr is None, "the xattr module is not installed")
+    def testArchivedAttributes(self):
+        source = os.path.join(self.source, "subdir", "0")
+        value = "binary\0\xff value"
+        try:
+            xattr.setxattr(source, "user.snap test", value)
+        except (IOError, OSError):
+            self.skipTest("the filesystem does not support user extended attributes")
+
+        # the attributes are stored as ascii pax records and applied from them
+        tarinfo = tarfile.TarInfo("subdir/0")
+        tarinfo.pax_headers = ArchivedAttributes.pax_headers(source)
+        self.assertIn(u'LIBARCHIVE.xattr.user.snap%20test', tarinfo.pax_headers)
+        ArchivedAttributes.restore(tarinfo, os.path.join(self.source, "subdir", "1"))
+        self.assertEqual(value, xattr.getxattr(os.path.join(self.source, "subdir", "1"), "user.snap test"))
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#
+# test/chunkstoretest.py unit test suite for snap.metadata.chunkstore
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import random
+import shutil
+import hashlib
+import unittest
+
+from snap.metadata.chunkstore import ChunkStore
+
+class ChunkStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.join(os.path.dirname(__file__), "data", "chunkstore")
+        self.storedir = os.path.join(self.basedir, "store")
+        self.snapdir = os.path.join(self.basedir, "snap")
+        os.makedirs(os.path.join(self.snapdir, "etc"))
+        os.makedirs(self.storedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def testBoundaries(self):
+        data = ''.join(chr(random.randint(0, 255)) for i in range(1024 * 1024))
+        boundaries = list(ChunkStore.boundaries(data))
+        self.assertEqual(0, boundaries[0][0])
+        self.assertEqual(len(data), boundaries[-1][1])
+        for start, end in boundaries[:-1]:
+            self.assertTrue(end - start >= ChunkStore.MIN_CHUNK)
+            self.assertTrue(end - start <= ChunkStore.MAX_CHUNK)
+
+        # chunks after an insertion resynchronize with the original ones
+        inserted = data[:1000] + 'inserted' + data[1000:]
+        original = set(data[start:end] for start, end in boundaries)
+        shifted = [inserted[start:end] for start, end in ChunkStore.boundaries(inserted)]
+        self.assertTrue(len([chunk for chunk in shifted if chunk in original]) >= len(shifted) - 2)
+
+    def testCandidatesSplit(self):
+        # the offsets located do not depend on where the data is split
+        data = os.urandom(512 * 1024)
+        candidates = ChunkStore.candidates(data)
+        self.assertTrue(len(candidates) > 0)
+        for split in (1, 63, 100000, 300001):
+            self.assertEqual(candidates, ChunkStore.candidates(data[:split]) +
+                             [split + end for end in ChunkStore.candidates(data[split:], data[:split])])
+
+    def testSegmentedWrite(self):
+        data = os.urandom(1024 * 1024)
+        with open(os.path.join(self.snapdir, "etc", "foo"), 'wb') as f:
+            f.write(data)
+
+        # chunks span the segments the file is processed in
+        segment = ChunkStore.SEGMENT
+        ChunkStore.SEGMENT = 100000
+        try:
+            manifest = os.path.join(self.basedir, "snap.manifest")
+            ChunkStore(manifest, self.snapdir, self.storedir).write()
+        finally:
+            ChunkStore.SEGMENT = segment
+        entry = [entry for entry in ChunkStore(manifest, self.snapdir, self.storedir).read() if entry.name == 'etc/foo'][0]
+        self.assertEqual([hashlib.sha256(data[start:end]).hexdigest() for start, end in ChunkStore.boundaries(data)],
+                         entry.data.split(','))
+
+    def testUnchangedFiles(self):
+        path = os.path.join(self.snapdir, "etc", "foo")
+        with open(path, 'wb') as f:
+            f.write(os.urandom(256 * 1024))
+        os.utime(path, (1000000000, 1000000000))
+
+        def digests(name):
+            store = ChunkStore(os.path.join(self.basedir, name), self.snapdir, self.storedir)
+            store.write()
+            return [entry.data for entry in store.read() if entry.name == 'etc/foo'][0]
+        first = digests("snap1.manifest")
+
+        # files with the size and mtime recorded in the previous manifest are not read
+        with open(path, 'r+b') as f:
+            f.write('changed')
+        os.utime(path, (1000000000, 1000000000))
+        self.assertEqual(first, digests("snap2.manifest"))
+
+        # unless their chunks are no longer in the store
+        digest = first.split(',')[0]
+        os.remove(ChunkStore.chunk_path(self.storedir, digest))
+        self.assertNotEqual(first, digests("snap3.manifest"))
+
+    def testUnchangedFilesPerHost(self):
+        path = os.path.join(self.snapdir, "etc", "foo.conf")
+        def write(host, contents):
+            with open(path, 'wb') as f:
+                f.write(contents)
+            os.utime(path, (1000000000, 1000000000))
+            store = ChunkStore(os.path.join(self.basedir, host + ".manifest"), self.snapdir, self.storedir, host)
+            store.write()
+            return [entry.data for entry in store.read() if entry.name == 'etc/foo.conf'][0]
+
+        # hosts sharing the store only reuse the chunks of their own previous snapshots
+        first = write("a", 'a' * 1024)
+        second = write("b", 'b' * 1024)
+        self.assertNotEqual(first, second)
+        self.assertEqual(hashlib.sha256('b' * 1024).hexdigest(), second)
+        self.assertEqual(first, write("a", 'c' * 1024))
+
+    def testPutGet(self):
+        digest = hashlib.sha256('foobar').hexdigest()
+        self.assertTrue(ChunkStore.put(self.storedir, digest, 'foobar') > 0)
+        self.assertEqual(0, ChunkStore.put(self.storedir, digest, 'foobar'))
+        self.assertEqual('foobar', ChunkStore.get(self.storedir, digest))
+
+    def testWriteExtract(self):
+        data = ''.join(chr(random.randint(0, 255)) for i in range(512 * 1024))
+        with open(os.path.join(self.snapdir, "etc", "foo"), 'wb') as f:
+            f.write(data)
+        with open(os.path.join(self.snapdir, "etc", "empty"), 'w') as f:
+            pass
+        os.symlink("foo", os.path.join(self.snapdir, "etc", "link"))
+
+        manifest = os.path.join(self.basedir, "snap1.manifest")
+        ChunkStore(manifest, self.snapdir, self.storedir).write()
+        stored = sum(len(files) for root, dirs, files in os.walk(self.storedir))
+
+        # a second snapshot of the same data stores nothing new
+        with open(os.path.join(self.snapdir, "etc", "bar"), 'wb') as f:
+            f.write(data)
+        ChunkStore(os.path.join(self.basedir, "snap2.manifest"), self.snapdir, self.storedir).write()
+        self.assertEqual(stored, sum(len(files) for root, dirs, files in os.walk(self.storedir)))
+
+        self.assertEqual(['etc', 'etc/empty', 'etc/foo', 'etc/link'],
+                         sorted(ChunkStore(manifest, self.snapdir, self.storedir).list()))
+
+        restoredir = os.path.join(self.basedir, "restore")
+        os.makedirs(restoredir)
+        ChunkStore(manifest, restoredir, self.storedir).extract()
+        self.assertEqual(data, open(os.path.join(restoredir, "etc", "foo"), 'rb').read())
+        self.assertEqual('', open(os.path.join(restoredir, "etc", "empty")).read())
+        self.assertEqual("foo", os.readlink(os.path.join(restoredir, "etc", "link")))
+
+        onlydir = os.path.join(self.basedir, "only")
+        os.makedirs(onlydir)
+        ChunkStore(manifest, onlydir, self.storedir).extract(only=['etc/empty'])
+        self.assertEqual(['empty'], os.listdir(os.path.join(onlydir, "etc")))
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+#
+# test/compressiontest.py unit test suite for snap.compression
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import gzip
+import unittest
+import StringIO
+
+from snap.exceptions  import ArgError
+from snap.compression import Compression, GzipCodec, NoneCodec, XzCodec, ZstdCodec
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        # a few blocks worth of data, partially compressible
+        self.data = os.urandom(Compression.BLOCKSIZE) + 'snap' * Compression.BLOCKSIZE
+
+    def compress(self, codec, jobs=4):
+        out = StringIO.StringIO()
+        writer = Compression.writer(out, codec, jobs)
+        for offset in range(0, len(self.data), 10000):
+            writer.write(self.data[offset:offset + 10000])
+        writer.close()
+        return out.getvalue()
+
+    def decompress(self, compressed):
+        reader = Compression.reader(StringIO.StringIO(compressed))
+        chunks = []
+        while True:
+            chunk = reader.read(10240)
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def testInvalidCodec(self):
+        self.assertRaises(ArgError, Compression.codec, 'foo')
+
+    def testDetect(self):
+        self.assertIsInstance(Compression.detect('\x1f\x8b\x08'), GzipCodec)
+        self.assertIsInstance(Compression.detect('ustar'), NoneCodec)
+
+    def testGzip(self):
+        compressed = self.compress('gzip')
+        self.assertLess(len(compressed), len(self.data))
+        self.assertEqual(self.data, self.decompress(compressed))
+
+        # the concatenated members are readable by the standard gzip module
+        self.assertEqual(self.data, gzip.GzipFile(fileobj=StringIO.StringIO(compressed)).read())
+
+    def testSerialGzip(self):
+        self.assertEqual(self.compress('gzip', jobs=4), self.compress('gzip', jobs=1))
+
+    def testNone(self):
+        compressed = self.compress('none')
+        self.assertEqual(self.data, compressed)
+        self.assertEqual(self.data, self.decompress(compressed))
+
+    @unittest.skipUnless(XzCodec().available(), "lzma not installed")
+    def testXz(self):
+        self.assertEqual(self.data, self.decompress(self.compress('xz')))
+
+    @unittest.skipUnless(ZstdCodec().available(), "zstandard not installed")
+    def testZstd(self):
+        self.assertEqual(self.data, self.decompress(self.compress('zstd')))
@@ -89,6 +89,10 @@ class ConfigTest(unittest.TestCase):
         self.assertEqual('/tmp/test-snap-shot', snap.config.options.snapfile)
         self.assertEqual('quiet', snap.config.options.log_level)
         self.assertEqual('foobar', snap.config.options.encryption_password)
+        self.assertTrue(snap.config.options.file_digests)
+        self.assertEqual(4, snap.config.options.jobs)
+        self.assertTrue(snap.config.options.direct_archive)
+        self.assertEqual('gzip', snap.config.options.compression)
         
         self.assertIn("postgresql_password", snap.config.options.service_options.keys())
         self.assertEqual("postgres", snap.config.options.service_options["postgresql_password"])
@@ -114,6 +118,22 @@ class ConfigTest(unittest.TestCase):
         self.assertEqual(context.exception.message, 'Must specify valid output format')
         pass
 
+    def testValidateRecordFormat(self):
+        # ensure that if an unknown record format is specified, exception is thrown
+        orig_options = snap.config.options
+        snap.config.options = snap.config.ConfigOptions()
+        snap.config.options.mode = snap.config.ConfigOptions.BACKUP
+        snap.config.options.snapfile = '/tmp/test-snap-shot'
+        snap.config.options.record_format = 'yaml'
+        config = snap.config.Config()
+        try:
+            with self.assertRaises(snap.exceptions.ArgError) as context:
+                config.verify_integrity()
+            self.assertEqual(context.exception.message, 'Must specify valid record format')
+        finally:
+            snap.config.options = orig_options
+        pass
+
     def testValidateRestoreSnapFile(self):
         # ensure that if snapfile is not set, error is thrown
         snap.config.options.mode = snap.config.ConfigOptions.RESTORE
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# test/copiertest.py unit test suite for snap.copier
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import shutil
+import unittest
+
+from snap.copier import FileCopier
+from snap.sparse import SparseFile
+
+class FileCopierTest(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.join(os.path.dirname(__file__), "data", "copier")
+        os.makedirs(self.basedir)
+        self.source = os.path.join(self.basedir, "source")
+        self.dest = os.path.join(self.basedir, "dest")
+        self.contents = os.urandom(3 * 1024 * 1024 + 17)
+        f = open(self.source, 'wb')
+        f.write(self.contents)
+        f.close()
+        FileCopier.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+        FileCopier.unsupported = {}
+        FileCopier.reset()
+
+    def read(self, path):
+        f = open(path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def testCopy(self):
+        method = FileCopier.copy(self.source, self.dest)
+        self.assertIn(method, FileCopier.METHODS)
+        self.assertEqual(self.contents, self.read(self.dest))
+        self.assertEqual([1, len(self.contents)], FileCopier.counters[method])
+        self.assertIn(method, FileCopier.summary())
+
+    def testFallback(self):
+        # with every other method found unsupported, the buffered copy is used
+        src_dev = os.stat(self.source).st_dev
+        FileCopier.unsupported[(src_dev, src_dev)] = set([FileCopier.REFLINK,
+                                                          FileCopier.COPY_FILE_RANGE, FileCopier.SENDFILE])
+        self.assertEqual(FileCopier.BUFFERED, FileCopier.copy(self.source, self.dest))
+        self.assertEqual(self.contents, self.read(self.dest))
+        self.assertEqual([1, len(self.contents)], FileCopier.counters[FileCopier.BUFFERED])
+
+    def testCopyRemaining(self):
+        # copying starts from the current position of the source
+        src = open(self.source, 'rb')
+        dst = open(self.dest, 'wb')
+        src.seek(1000)
+        FileCopier.copyfileobj(src, dst)
+        src.close()
+        dst.close()
+        self.assertEqual(self.contents[1000:], self.read(self.dest))
+
+    def testSameFile(self):
+        self.assertRaises(shutil.Error, FileCopier.copy, self.source, self.source)
+        self.assertEqual(self.contents, self.read(self.source))
+
+    def testEmptyFile(self):
+        open(self.source, 'wb').close()
+        FileCopier.copy(self.source, self.dest)
+        self.assertEqual('', self.read(self.dest))
+        self.assertEqual(None, FileCopier.summary())
+
+        # empty files do not mark the kernel methods as unsupported
+        for unsupported in FileCopier.unsupported.values():
+            self.assertFalse(FileCopier.COPY_FILE_RANGE in unsupported)
+
+    def testSparseFile(self):
+        # the holes of sparse files are not written to their copies
+        f = open(self.source, 'wb')
+        f.seek(1024 * 1024)
+        f.write(self.contents[:1000])
+        f.truncate(8 * 1024 * 1024)
+        f.close()
+        if not SparseFile.is_sparse(os.stat(self.source)):
+            self.skipTest("the filesystem does not support sparse files")
+
+        for unsupported in [set(), set([FileCopier.REFLINK, FileCopier.COPY_FILE_RANGE, FileCopier.SENDFILE])]:
+            src_dev = os.stat(self.source).st_dev
+            FileCopier.unsupported[(src_dev, src_dev)] = unsupported
+            FileCopier.copy(self.source, self.dest)
+            self.assertEqual(self.read(self.source), self.read(self.dest))
+            self.assertTrue(SparseFile.is_sparse(os.stat(self.dest)))
@@ -14,9 +14,14 @@
 # GNU General Public License for more details.
 
 import os
+import struct
+import hashlib
 import unittest
+from StringIO import StringIO
+from Crypto.Cipher import AES
 
 from snap.crypto import Crypto
+from snap.exceptions import IntegrityError
 from snap.filemanager import FileManager
 
 class CryptoTest(unittest.TestCase):
@@ -48,3 +53,89 @@ class CryptoTest(unittest.TestCase):
 
         os.remove(temp_file_path)
         os.remove(temp_file_path + ".enc")
+
+    def testStreamingSeek(self):
+        data = ''.join(chr(i % 251) for i in range(100000))
+
+        encrypted = StringIO()
+        writer = Crypto.writer("secret_key", encrypted, jobs=2)
+        writer.write(data[:1001])
+        writer.write(data[1001:])
+        writer.close()
+        self.assertNotIn(data[:64], encrypted.getvalue())
+
+        encrypted.seek(0)
+        reader = Crypto.reader("secret_key", encrypted, jobs=2)
+        self.assertEqual(data[:10], reader.read(10))
+        reader.seek(12345)
+        self.assertEqual(data[12345:12400], reader.read(55))
+        self.assertEqual(12400, reader.tell())
+        reader.seek(-7, 2)
+        self.assertEqual(data[-7:], reader.read())
+        reader.close()
+
+    def testChunkIntegrity(self):
+        chunksize = Crypto.CHUNKSIZE
+        Crypto.CHUNKSIZE = 1024
+        try:
+            data = os.urandom(5000)
+            encrypted = StringIO()
+            writer = Crypto.writer("secret_key", encrypted, jobs=2)
+            writer.write(data)
+            writer.close()
+        finally:
+            Crypto.CHUNKSIZE = chunksize
+        contents = encrypted.getvalue()
+
+        reader = Crypto.reader("secret_key", StringIO(contents), jobs=2)
+        self.assertEqual(data, reader.read())
+        reader.close()
+
+        # a modified chunk is detected before its data is returned
+        corrupted = contents[:Crypto.HEADER_SIZE + 1500] + 'X' + contents[Crypto.HEADER_SIZE + 1501:]
+        reader = Crypto.reader("secret_key", StringIO(corrupted), jobs=1)
+        self.assertEqual(data[:1024], reader.read(1024))
+        self.assertRaises(IntegrityError, reader.read, 1)
+
+        # as is a truncated container, or the wrong password
+        reader = Crypto.reader("secret_key", StringIO(contents[:-(1000 + Crypto.TAG_SIZE)]), jobs=1)
+        self.assertRaises(IntegrityError, reader.read)
+        reader = Crypto.reader("wrong_key", StringIO(contents), jobs=1)
+        self.assertRaises(IntegrityError, reader.read)
+
+    def testInvalidHeader(self):
+        salt = '\x00' * Crypto.SALT_SIZE
+        for iterations, chunksize in ((0, 1024), (Crypto.MAX_ITERATIONS + 1, 1024),
+                                      (1, 0), (1, Crypto.MAX_CHUNKSIZE + 1)):
+            header = Crypto.MAGIC + salt + struct.pack(Crypto.HEADER_FORMAT, iterations, chunksize)
+            self.assertRaises(IntegrityError, Crypto.reader, "secret_key", StringIO(header), 1)
+
+    def testLegacyDecrypt(self):
+        key = Crypto.generate_key("secret_key")
+        iv = '\x01' * 16
+        legacy = struct.pack('<Q', 6) + iv + AES.new(key, AES.MODE_CBC, iv).encrypt("foobar" + ' ' * 10)
+
+        reader = Crypto.reader("secret_key", StringIO(legacy))
+        self.assertEqual("foobar", reader.read())
+
+    def testLegacyDecryptBoundedReads(self):
+        key = Crypto.generate_key("secret_key")
+        iv = '\x02' * 16
+        data = os.urandom(300000)
+        padded = data + ' ' * (-len(data) % AES.block_size)
+        legacy = struct.pack('<Q', len(data)) + iv + AES.new(key, AES.MODE_CBC, iv).encrypt(padded)
+
+        class RecordingFile(StringIO):
+            def read(self, size=-1):
+                self.sizes.append(size)
+                return StringIO.read(self, size)
+        recording = RecordingFile(legacy)
+        recording.sizes = []
+
+        # the container spans several reads, none of them unbounded
+        reader = Crypto.reader("secret_key", recording)
+        self.assertEqual(data[:1000], reader.read(1000))
+        self.assertEqual(data[1000:], reader.read(len(data)))
+        self.assertEqual('', reader.read(1))
+        self.assertTrue(len(recording.sizes) > 4)
+        self.assertTrue(all(0 <= size <= 64 * 1024 for size in recording.sizes))
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+#
+# test/digesttest.py unit test suite for snap.digest
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import hashlib
+import unittest
+
+from snap.digest import FileDigest
+
+class FileDigestTest(unittest.TestCase):
+    def setUp(self):
+        self.data_path = os.path.join(os.path.dirname(__file__), "data", "tmp")
+        self.file1 = os.path.join(self.data_path, "file1")
+        self.file2 = os.path.join(self.data_path, "subdir", "file2")
+
+    def testHashFile(self):
+        contents = open(self.file1, 'rb').read()
+        self.assertEqual(hashlib.md5(contents).hexdigest(), FileDigest.hash_file(self.file1))
+        self.assertEqual(hashlib.sha256(contents).hexdigest(),
+                         FileDigest.hash_file(self.file1, 'sha256', chunksize=1))
+
+    def testMatches(self):
+        size = os.path.getsize(self.file1)
+        digest = FileDigest.hash_file(self.file1)
+        self.assertTrue(FileDigest.matches(self.file1, size, digest))
+        self.assertTrue(FileDigest.matches(self.file1, None, digest.upper()))
+        self.assertFalse(FileDigest.matches(self.file1, size + 1, digest))
+        self.assertFalse(FileDigest.matches(self.file1, size, '0' * 32))
+        self.assertFalse(FileDigest.matches(self.file1 + "-missing", None, digest))
+
+    def testClassify(self):
+        digests = { self.file1 : (None, FileDigest.hash_file(self.file1), 'md5'),
+                    self.file2 : (None, '0' * 32, 'md5') }
+        unowned = os.path.join(self.data_path, "unowned")
+
+        classified = list(FileDigest.classify([self.file1, unowned, self.file2],
+                                              digests.get, lambda path: 'fallback',
+                                              processes=2))
+        self.assertEqual([(self.file1, False), (unowned, 'fallback'), (self.file2, True)],
+                         classified)
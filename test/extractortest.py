@@ -0,0 +1,157 @@
+#!/usr/bin/python
+#
+# test/extractortest.py unit test suite for snap.metadata.extractor
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import stat
+import shutil
+import tarfile
+import unittest
+from StringIO import StringIO
+
+from snap.osregistry import OS
+from snap.exceptions import IntegrityError
+from snap.metadata.extractor import SnapExtractor
+from snap.metadata.restore import DirectRestore
+
+class SnapExtractorTest(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.join(os.path.dirname(__file__), "data", "extractor")
+        os.makedirs(self.basedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def archive(self, members):
+        '''helper to return a tarball streaming the specified (tarinfo, data) members'''
+        data = StringIO()
+        tarball = tarfile.open(fileobj=data, mode="w|")
+        for tarinfo, contents in members:
+            if contents is None:
+                tarball.addfile(tarinfo)
+            else:
+                tarinfo.size = len(contents)
+                tarball.addfile(tarinfo, StringIO(contents))
+        tarball.close()
+        data.seek(0)
+        return tarfile.open(fileobj=data, mode="r|")
+
+    def member(self, name, type=tarfile.REGTYPE, mode=0644, mtime=1000000000, linkname=''):
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.type = type
+        tarinfo.mode = mode
+        tarinfo.mtime = mtime
+        tarinfo.linkname = linkname
+        return tarinfo
+
+    def testExtract(self):
+        blocksize = SnapExtractor.BLOCKSIZE
+        SnapExtractor.BLOCKSIZE = 1000
+        try:
+            large = ''.join(chr(i % 256) for i in range(4500))
+            tarball = self.archive([
+                (self.member("etc", tarfile.DIRTYPE, 0750, 1200000000), None),
+                (self.member("etc/large", mode=0600), large),
+                (self.member("etc/small"), "small"),
+                (self.member("home/user/nested"), "nested"),
+                (self.member("etc/link", tarfile.SYMTYPE, linkname="small"), None)])
+            SnapExtractor(self.basedir, jobs=2).extract(tarball)
+        finally:
+            SnapExtractor.BLOCKSIZE = blocksize
+
+        etc = os.path.join(self.basedir, "etc")
+        self.assertEqual(large, open(os.path.join(etc, "large"), 'rb').read())
+        self.assertEqual("small", open(os.path.join(etc, "small")).read())
+        self.assertEqual("nested", open(os.path.join(self.basedir, "home", "user", "nested")).read())
+        self.assertEqual(0600, stat.S_IMODE(os.stat(os.path.join(etc, "large")).st_mode))
+        self.assertEqual(1000000000, os.stat(os.path.join(etc, "small")).st_mtime)
+        self.assertEqual(0750, stat.S_IMODE(os.stat(etc).st_mode))
+        self.assertEqual(1200000000, os.stat(etc).st_mtime)
+        if not OS.is_windows():
+            self.assertEqual("small", os.readlink(os.path.join(etc, "link")))
+
+    def testExtractSelected(self):
+        tarball = self.archive([(self.member("foo"), "foo"), (self.member("bar"), "bar")])
+        SnapExtractor(self.basedir, jobs=2).extract(tarball, lambda tarinfo: tarinfo.name == "bar")
+        self.assertEqual(["bar"], os.listdir(self.basedir))
+
+    def testDirectRestore(self):
+        staging = os.path.join(self.basedir, "staging")
+        root = os.path.join(self.basedir, "root")
+        os.makedirs(staging)
+        os.makedirs(os.path.join(root, "etc"))
+        open(os.path.join(root, "etc", "hosts"), 'w').write("old")
+
+        tarball = self.archive([
+            (self.member("etc", tarfile.DIRTYPE, 0750, 1200000000), None),
+            (self.member("etc/hosts", mode=0600), "hosts"),
+            (self.member("etc/conf.d", tarfile.DIRTYPE, 0700, 1200000000), None),
+            (self.member("etc/conf.d/app"), "app"),
+            (self.member("packages.xml"), "packages")])
+        restore = DirectRestore(staging, {"etc/hosts"     : os.path.join(root, "etc", "hosts"),
+                                          "etc/conf.d/app": os.path.join(root, "etc", "conf.d", "app")})
+        SnapExtractor(staging, jobs=2, restore=restore).extract(tarball)
+
+        # recorded files are written to their destinations, replacing what was there
+        self.assertEqual("hosts", open(os.path.join(root, "etc", "hosts")).read())
+        self.assertEqual(0600, stat.S_IMODE(os.stat(os.path.join(root, "etc", "hosts")).st_mode))
+        self.assertEqual("app", open(os.path.join(root, "etc", "conf.d", "app")).read())
+        self.assertEqual(["app"], os.listdir(os.path.join(root, "etc", "conf.d")))
+        self.assertEqual(0700, stat.S_IMODE(os.stat(os.path.join(root, "etc", "conf.d")).st_mode))
+        self.assertEqual(sorted(["conf.d", "hosts"]), sorted(os.listdir(os.path.join(root, "etc"))))
+        self.assertTrue(restore.is_restored("etc/hosts"))
+        self.assertTrue(restore.is_restored("etc/conf.d/app"))
+
+        # everything else is staged
+        self.assertEqual("packages", open(os.path.join(staging, "packages.xml")).read())
+        self.assertFalse(os.path.exists(os.path.join(staging, "etc", "hosts")))
+
+    @unittest.skipIf(OS.is_windows(), "hard links not currently supported on windows")
+    def testDirectRestoreHardLink(self):
+        staging = os.path.join(self.basedir, "staging")
+        root = os.path.join(self.basedir, "root")
+        os.makedirs(staging)
+        os.makedirs(root)
+
+        # links to restored files are linked to them at their destinations
+        tarball = self.archive([
+            (self.member("foo"), "foo"),
+            (self.member("bar", tarfile.LNKTYPE, linkname="foo"), None)])
+        restore = DirectRestore(staging, {"foo": os.path.join(root, "foo"),
+                                          "bar": os.path.join(root, "bar")})
+        SnapExtractor(staging, jobs=2, restore=restore).extract(tarball)
+        self.assertTrue(os.path.samefile(os.path.join(root, "foo"), os.path.join(root, "bar")))
+        self.assertEqual("foo", open(os.path.join(root, "bar")).read())
+        self.assertTrue(restore.is_restored("bar"))
+        self.assertEqual(sorted(["bar", "foo"]), sorted(os.listdir(root)))
+
+    def testDirectRestoreFailedVerification(self):
+        staging = os.path.join(self.basedir, "staging")
+        root = os.path.join(self.basedir, "root")
+        os.makedirs(staging)
+        os.makedirs(root)
+        open(os.path.join(root, "hosts"), 'w').write("old")
+
+        # nothing is renamed into place if the rest of the input fails verification
+        def complete():
+            self.assertEqual(2, len([name for name in os.listdir(root) if name.endswith(".snap")]))
+            raise IntegrityError("encrypted snapfile chunk 1 failed verification")
+        tarball = self.archive([(self.member("hosts"), "hosts"), (self.member("app"), "app")])
+        restore = DirectRestore(staging, {"hosts": os.path.join(root, "hosts"),
+                                          "app"  : os.path.join(root, "app")})
+        extractor = SnapExtractor(staging, jobs=2, restore=restore)
+        self.assertRaises(IntegrityError, extractor.extract, tarball, complete=complete)
+        self.assertEqual(["hosts"], os.listdir(root))
+        self.assertEqual("old", open(os.path.join(root, "hosts")).read())
+        self.assertFalse(restore.is_restored("hosts"))
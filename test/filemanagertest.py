@@ -110,3 +110,28 @@ class FileManagerTest(unittest.TestCase):
         subdirs = FileManager.get_all_subdirectories(data_path, recursive=False)
         self.assertIn(os.path.join(data_path, "tmp"), subdirs)
         self.assertNotIn(os.path.join(data_path, "tmp/subdir"), subdirs)
+
+    def testIterFiles(self):
+        data_path = os.path.join(os.path.dirname(__file__), "data", "tmp")
+        files = FileManager.iter_files(include=[data_path])
+        self.assertFalse(isinstance(files, list))
+
+        # nested includes should not be walked twice
+        files = list(FileManager.iter_files(include=[data_path, os.path.join(data_path, "subdir")]))
+        self.assertEqual(1, files.count(os.path.join(data_path, "subdir", "file2")))
+        self.assertIn(os.path.join(data_path, "file1"), files)
+
+    def testWalk(self):
+        data_path = os.path.join(os.path.dirname(__file__), "data", "tmp")
+        entries = list(FileManager.walk(include=[data_path], dirs=True))
+        paths = [entry.path for entry in entries]
+        self.assertIn(os.path.join(data_path, "subdir"), paths)
+        self.assertIn(os.path.join(data_path, "subdir", "file2"), paths)
+        self.assertLess(paths.index(os.path.join(data_path, "subdir")),
+                        paths.index(os.path.join(data_path, "subdir", "file2")))
+
+        for entry in entries:
+            self.assertEqual(os.lstat(entry.path).st_size, entry.stat(follow_symlinks=False).st_size)
+
+        paths = [entry.path for entry in FileManager.walk(include=[data_path])]
+        self.assertNotIn(os.path.join(data_path, "subdir"), paths)
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+#
+# test/filematchertest.py unit test suite for snap.filematcher
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import unittest
+
+from snap.filematcher import FileMatcher
+from snap.filemanager import FileManager
+
+class FileMatcherTest(unittest.TestCase):
+    def testExcludesPath(self):
+        matcher = FileMatcher(['/home/jsmith', '/etc/passwd'])
+        self.assertTrue(matcher.excludes('/home/jsmith'))
+        self.assertTrue(matcher.excludes('/home/jsmith/docs/foo'))
+        self.assertTrue(matcher.excludes('/etc/passwd'))
+        self.assertFalse(matcher.excludes('/home/jsmithers'))
+        self.assertFalse(matcher.excludes('/home'))
+        self.assertFalse(matcher.excludes('/etc/passwd-'))
+
+    def testExcludesGlobs(self):
+        matcher = FileMatcher(['*.log', '/home/*/.cache'])
+        self.assertTrue(matcher.excludes('/var/log/messages.log'))
+        self.assertTrue(matcher.excludes('/home/jsmith/.cache'))
+        self.assertTrue(matcher.excludes('/home/jsmith/.cache/foo'))
+        self.assertFalse(matcher.excludes('/home/jsmith/sub/.cache'))
+        self.assertFalse(matcher.excludes('/var/log/messages'))
+
+    def testExcludesRegex(self):
+        matcher = FileMatcher(['re:.*~'])
+        self.assertTrue(matcher.excludes('/etc/hosts~'))
+        self.assertFalse(matcher.excludes('/etc/hosts'))
+
+    def testExcludesMultiplePatterns(self):
+        # every pattern is anchored, not just the last one combined
+        matcher = FileMatcher(['*.log', '*.tmp', '/home/*/.cache', '/srv/*/x', 're:.*~', 're:/opt/.*\\.bak'])
+        self.assertTrue(matcher.excludes('/var/foo.log'))
+        self.assertTrue(matcher.excludes('/var/foo.tmp'))
+        self.assertFalse(matcher.excludes('/var/foo.logger'))
+        self.assertFalse(matcher.excludes('/var/foo.tmpl'))
+        self.assertTrue(matcher.excludes('/home/a/.cache'))
+        self.assertFalse(matcher.excludes('/home/a/.cachefoo'))
+        self.assertTrue(matcher.excludes('/srv/a/x'))
+        self.assertFalse(matcher.excludes('/srv/a/xy'))
+        self.assertTrue(matcher.excludes('/etc/hosts~'))
+        self.assertFalse(matcher.excludes('/etc/hosts~.new'))
+        self.assertTrue(matcher.excludes('/opt/app.bak'))
+        self.assertFalse(matcher.excludes('/opt/app.bak.d'))
+
+    def testExcludesChild(self):
+        matcher = FileMatcher(['/home/jsmith', '*.log'])
+        node = matcher.subtree('/home')
+        self.assertEqual((True, node['jsmith']), matcher.excludes_child(node, 'jsmith', '/home/jsmith'))
+        self.assertEqual((False, None), matcher.excludes_child(node, 'mmorsi', '/home/mmorsi'))
+        self.assertEqual((True, None), matcher.excludes_child(None, 'foo.log', '/tmp/foo.log'))
+        self.assertEqual(None, matcher.subtree('/var'))
+
+    def testWalkWithGlobs(self):
+        data_path = os.path.join(os.path.dirname(__file__), "data", "tmp")
+        files = FileManager.get_all_files(include=[data_path], exclude=['file*'])
+        self.assertEqual([], files)
+
+        files = FileManager.get_all_files(include=[os.path.join(data_path, '*')],
+                                          exclude=[os.path.join(data_path, 'sub*')])
+        self.assertEqual([os.path.join(data_path, "file1")], files)
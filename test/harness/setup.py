@@ -20,11 +20,14 @@ import shutil
 import tarfile
 import tempfile
 import subprocess
-import xml.dom.minidom
 
 # used to generate random uuid / mac
 import virtinst.util
 
+from snap.metadata.sfile   import FilesRecordFile
+from snap.metadata.package import PackagesRecordFile
+from snap.metadata.service import ServicesRecordFile
+
 # some parameters to use when building the package
 SNAP_VERSION='0.6'
 RPM_RELEASE='8'
@@ -221,18 +224,12 @@ def verify_snapshot(os_name):
     assert "packages.xml" in paths
     assert "files.xml"    in paths
     
-    doc = xml.dom.minidom.parse("services.xml")
-    elements = []
-    for element in doc.documentElement.childNodes:
-      elements.append(element.firstChild.data)
+    elements = [service.name for service in ServicesRecordFile("services.xml").read()]
     
     assert "iptables"   in elements
     assert "postgresql" in elements
     
-    doc = xml.dom.minidom.parse("packages.xml")
-    elements = []
-    for element in doc.documentElement.childNodes:
-      elements.append(element.firstChild.data)
+    elements = [package.name for package in PackagesRecordFile("packages.xml").read()]
     
     assert "mediawiki"           in elements
     if os_name == 'fedora':
@@ -240,10 +237,7 @@ def verify_snapshot(os_name):
     elif os_name == 'ubuntu':
         assert "postgresql"   in elements
     
-    doc = xml.dom.minidom.parse("files.xml")
-    elements = []
-    for element in doc.documentElement.childNodes:
-      elements.append(element.firstChild.data)
+    elements = [sfile.path for sfile in FilesRecordFile("files.xml").read()]
     
     assert "etc/dummy.conf"   in elements
     assert "var/dummy.data"   not in elements
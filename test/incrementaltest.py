@@ -0,0 +1,63 @@
+#!/usr/bin/python
+#
+# test/incrementaltest.py unit test suite for snap.incremental
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import shutil
+import unittest
+
+from snap.incremental       import Incremental
+from snap.metadata.sfile    import SFile, FilesRecordFile
+from snap.metadata.snapfile import SnapFile
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.join(os.path.dirname(__file__), "data", "incremental")
+        os.makedirs(self.basedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def snapshot(self, name, contents, sfiles, parent=None):
+        '''helper to create a snapfile containing the specified files and record'''
+        snapdir = os.path.join(self.basedir, name + "-dir")
+        os.makedirs(os.path.join(snapdir, "etc"))
+        for path, content in contents.items():
+            with open(os.path.join(snapdir, path), 'w') as f:
+                f.write(content)
+        FilesRecordFile(os.path.join(snapdir, "files.xml")).write(sfiles, parent)
+
+        snapfile = os.path.join(self.basedir, name + ".tgz")
+        SnapFile(snapfile, snapdir).compress()
+        return snapfile
+
+    def testExtractInherited(self):
+        foo = SFile(os.path.join("etc", "foo"))
+        bar = SFile(os.path.join("etc", "bar"))
+        grandparent = self.snapshot("grandparent", {foo.path : "foo"}, [foo])
+
+        bar.inherited = False
+        foo.inherited = True
+        parent = self.snapshot("parent", {bar.path : "bar"}, [foo, bar], grandparent)
+
+        manifest = Incremental(parent).manifest()
+        self.assertEqual(set([foo.path, bar.path]), set(manifest.keys()))
+        self.assertTrue(manifest[foo.path].inherited)
+
+        restoredir = os.path.join(self.basedir, "restore")
+        os.makedirs(restoredir)
+        missing = Incremental(parent).extract_inherited([foo.path, bar.path, "missing"], restoredir)
+        self.assertEqual(set(["missing"]), missing)
+        self.assertEqual("foo", open(os.path.join(restoredir, foo.path)).read())
+        self.assertEqual("bar", open(os.path.join(restoredir, bar.path)).read())
@@ -0,0 +1,48 @@
+#!/usr/bin/python
+#
+# test/manifesttest.py unit test suite for snap.metadata.manifest
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import unittest
+
+from snap.exceptions import MissingFileError
+from snap.metadata.manifest import RecordManifest
+
+class RecordManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(os.path.dirname(__file__), "data", "manifest-out")
+
+    def tearDown(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def testReadWrite(self):
+        records = [('a', ['tab\tnewline\nbackslash\\', 1, 2.5, None]),
+                   ('b', [u'unicode \xe9', ''])]
+        RecordManifest(self.path, 'test').write(iter(records))
+        self.assertTrue(RecordManifest.is_manifest(self.path))
+
+        read = list(RecordManifest(self.path, 'test').read())
+        self.assertEqual([('a', ['tab\tnewline\nbackslash\\', '1', '2.5', None]),
+                          ('b', ['unicode \xc3\xa9', None])], read)
+
+    def testInvalidManifest(self):
+        RecordManifest(self.path, 'test').write([])
+        self.assertRaises(MissingFileError, list, RecordManifest(self.path, 'other').read())
+
+        f = open(self.path, 'w')
+        f.write('<files></files>')
+        f.close()
+        self.assertFalse(RecordManifest.is_manifest(self.path))
+        self.assertRaises(MissingFileError, list, RecordManifest(self.path, 'test').read())
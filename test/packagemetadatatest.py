@@ -16,6 +16,7 @@
 import os
 import unittest
 
+import snap.config
 from snap.filemanager import FileManager
 from snap.metadata.package import Package, PackagesRecordFile
 
@@ -30,9 +31,40 @@ class PackageMetadataTest(unittest.TestCase):
         package_record_file.write(packages)
         contents = FileManager.read_file(file_path)
 
+        self.assertEqual("snaprecord 1 packages\np\tfoo\t1\np\tbaz\t0.1\np\tbar\t\n", contents)
+
+        packages = list(PackagesRecordFile(file_path).read())
+        self.assertEqual(['foo', 'baz', 'bar'], [package.name for package in packages])
+        self.assertEqual(['1', '0.1', ''], [package.version for package in packages])
+        os.remove(file_path)
+
+    def testWriteXmlPackageRecordFile(self):
+        file_path = os.path.join(os.path.dirname(__file__), "data/packages-out.xml")
+        packages  = [Package(name='foo', version='1'),
+                     Package(name='baz', version='0.1'),
+                     Package(name='bar')]
+
+        package_record_file = PackagesRecordFile(file_path)
+        package_record_file.write_xml(packages)
+        contents = FileManager.read_file(file_path)
+
         self.assertEqual("<packages><package>foo</package><package>baz</package><package>bar</package></packages>", contents)
         os.remove(file_path)
 
+    def testWritePackageRecordFileXmlFormat(self):
+        file_path = os.path.join(os.path.dirname(__file__), "data/packages-out.xml")
+
+        orig_record_format = snap.config.options.record_format
+        snap.config.options.record_format = 'xml'
+        try:
+            PackagesRecordFile(file_path).write([Package(name='foo', version='1')])
+        finally:
+            snap.config.options.record_format = orig_record_format
+        contents = FileManager.read_file(file_path)
+
+        self.assertEqual("<packages><package>foo</package></packages>", contents)
+        os.remove(file_path)
+
     def testReadPackageRecordFile(self):
         file_path = os.path.join(os.path.dirname(__file__), "data/packagefile.xml")
         packages = PackagesRecordFile(file_path).read()
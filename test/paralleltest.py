@@ -0,0 +1,48 @@
+#!/usr/bin/python
+#
+# test/paralleltest.py unit test suite for snap.parallel
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import unittest
+import multiprocessing.pool
+
+from snap.parallel import Parallel
+
+class ParallelTest(unittest.TestCase):
+    def testImapPreservesOrder(self):
+        pool = multiprocessing.pool.ThreadPool(4)
+        results = list(Parallel.imap(pool, lambda x: x * 2, xrange(100), 4, chunksize=3))
+        pool.close()
+        pool.join()
+        self.assertEqual([x * 2 for x in xrange(100)], results)
+
+    def testImapIsLazy(self):
+        consumed = []
+        def items():
+            for x in xrange(1000):
+                consumed.append(x)
+                yield x
+
+        pool = multiprocessing.pool.ThreadPool(2)
+        results = Parallel.imap(pool, lambda x: x, items(), 2)
+        self.assertEqual(0, results.next())
+        self.assertTrue(len(consumed) < 1000)
+        pool.close()
+        pool.join()
+
+    def testRun(self):
+        self.assertEqual([x * 2 for x in xrange(10)], Parallel.run(lambda x: x * 2, xrange(10), 3))
+        self.assertEqual([], Parallel.run(lambda x: x, []))
+
+    def testCpuCount(self):
+        self.assertTrue(Parallel.cpu_count() >= 1)
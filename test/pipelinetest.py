@@ -0,0 +1,46 @@
+#!/usr/bin/python
+#
+# test/pipelinetest.py unit test suite for snap.pipeline
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import shutil
+import unittest
+
+from snap.pipeline    import FilePipeline
+from snap.filemanager import FileManager
+from snap.osregistry  import OS
+
+class FilePipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.data_path = os.path.join(os.path.dirname(__file__), "data", "tmp")
+        self.basedir = os.path.join(os.path.dirname(__file__), "data", "pipeline-out")
+        os.mkdir(self.basedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def testClassify(self):
+        files = ['a', 'bb', 'ccc', 'dddd'] * 50
+        classified = list(FilePipeline(jobs=4).classify(files, lambda path: len(path) % 2 == 0))
+        self.assertEqual([(path, len(path) % 2 == 0) for path in files], classified)
+
+    @unittest.skipUnless(OS.is_linux(), "only relevant for linux")
+    def testCopy(self):
+        files = FileManager.get_all_files(include=[self.data_path])
+        classified = [(path, True) for path in files] + [(self.data_path + "/missing", False)]
+
+        sfiles = list(FilePipeline(jobs=2).copy(classified, self.basedir))
+        self.assertEqual(len(files), len(sfiles))
+        for sfile in sfiles:
+            self.assertTrue(os.path.isfile(os.path.join(self.basedir, sfile.path)))
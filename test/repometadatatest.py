@@ -29,6 +29,22 @@ class RepoMetadataTest(unittest.TestCase):
         repo_record_file.write(repos)
         contents = FileManager.read_file(file_path)
 
+        self.assertEqual("snaprecord 1 repos\nr\tyum.morsi.org\thttp://yum.morsi.org\n" +
+                         "r\tapt.morsi.org\thttp://apt.morsi.org\n", contents)
+        repos = list(ReposRecordFile(file_path).read())
+        self.assertEqual(['yum.morsi.org', 'apt.morsi.org'], [repo.name for repo in repos])
+        self.assertEqual(['http://yum.morsi.org', 'http://apt.morsi.org'], [repo.url for repo in repos])
+        os.remove(file_path)
+
+    def testWriteXmlReposRecordFile(self):
+        file_path = os.path.join(os.path.dirname(__file__), "data/repos-out.xml")
+        repos  = [Repo(name='yum.morsi.org', url='http://yum.morsi.org'),
+                  Repo(name='apt.morsi.org', url='http://apt.morsi.org')]
+
+        repo_record_file = ReposRecordFile(file_path)
+        repo_record_file.write_xml(repos)
+        contents = FileManager.read_file(file_path)
+
         self.assertEqual("<repos><repo>http://yum.morsi.org</repo><repo>http://apt.morsi.org</repo></repos>", contents)
         os.remove(file_path)
 
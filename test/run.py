@@ -28,29 +28,58 @@ sys.path.append("../snap/")
 import snap
 import callback
 
+import attributestest
+import chunkstoretest
+import compressiontest
 import configtest
+import copiertest
+import digesttest
+import extractortest
 import filemanagertest
+import filematchertest
+import incrementaltest
+import manifesttest
 import packagemetadatatest
 import repometadatatest
 import servicesmetadatatest
 import sfilemetadatatest
 import snapfiletest
+import snapindextest
+import sparsetest
+import statcachetest
 import tdltest
 import osregistrytest
+import paralleltest
+import pipelinetest
 import snaptest
 import servicedispatchertest
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(attributestest.AttributeReplicatorTest))
+    suite.addTest(unittest.makeSuite(chunkstoretest.ChunkStoreTest))
+    suite.addTest(unittest.makeSuite(compressiontest.CompressionTest))
     suite.addTest(unittest.makeSuite(configtest.ConfigTest))
+    suite.addTest(unittest.makeSuite(copiertest.FileCopierTest))
+    suite.addTest(unittest.makeSuite(digesttest.FileDigestTest))
+    suite.addTest(unittest.makeSuite(extractortest.SnapExtractorTest))
     suite.addTest(unittest.makeSuite(filemanagertest.FileManagerTest))
+    suite.addTest(unittest.makeSuite(filematchertest.FileMatcherTest))
+    suite.addTest(unittest.makeSuite(incrementaltest.IncrementalTest))
+    suite.addTest(unittest.makeSuite(manifesttest.RecordManifestTest))
     suite.addTest(unittest.makeSuite(packagemetadatatest.PackageMetadataTest))
     suite.addTest(unittest.makeSuite(repometadatatest.RepoMetadataTest))
     suite.addTest(unittest.makeSuite(servicesmetadatatest.ServicesMetadataTest))
     suite.addTest(unittest.makeSuite(sfilemetadatatest.SFileMetadataTest))
     suite.addTest(unittest.makeSuite(snapfiletest.SnapFileTest))
+    suite.addTest(unittest.makeSuite(snapindextest.SnapIndexTest))
+    suite.addTest(unittest.makeSuite(snapindextest.IndexingTarFileTest))
+    suite.addTest(unittest.makeSuite(sparsetest.SparseFileTest))
+    suite.addTest(unittest.makeSuite(statcachetest.StatCacheTest))
     suite.addTest(unittest.makeSuite(tdltest.TDLFileTest))
     suite.addTest(unittest.makeSuite(osregistrytest.OsRegistryTest))
+    suite.addTest(unittest.makeSuite(paralleltest.ParallelTest))
+    suite.addTest(unittest.makeSuite(pipelinetest.FilePipelineTest))
     suite.addTest(unittest.makeSuite(servicedispatchertest.ServiceDispatcherTest))
     suite.addTest(unittest.makeSuite(snaptest.SnapBaseTest))
     
@@ -23,7 +23,8 @@ import unittest
 import subprocess
 
 from snap.filemanager import FileManager
-from snap.metadata.service import ServicesRecordFile
+from snap.compression import Compression
+from snap.metadata.service import Service, ServicesRecordFile
 from snap.metadata.sfile import SFile
 from snap.osregistry import OS
     
@@ -104,6 +105,58 @@ class ServiceDispatcherTest(unittest.TestCase):
             service_names.append(service.name)
         self.assertIn("mock", service_names)
 
+    def testDispatcherServiceDirectories(self):
+        snap.backends.services.adapters.mock.Mock.mock_is_available = True
+        orig_log_level = snap.config.options.log_level
+        snap.config.options.log_level = 'verbose'
+        snap.callback.snapcallback.clear()
+
+        # each service is backed up to and restored from its own directory
+        dispatcher = snap.backends.services.dispatcher.Dispatcher()
+        try:
+            dispatcher.backup(self.basedir, include=['mock'])
+            dispatcher.restore(self.basedir)
+        finally:
+            snap.config.options.log_level = orig_log_level
+        service_dir = os.path.join(self.basedir, "services", "mock")
+        self.assertTrue(os.path.isdir(service_dir))
+        self.assertEqual(service_dir, snap.backends.services.adapters.mock.Mock.backup_dir)
+        self.assertEqual(service_dir, snap.backends.services.adapters.mock.Mock.restore_dir)
+
+        # with the messages logged while doing so tagged with the service
+        self.assertIn("[mock] Backing up service mock", snap.callback.snapcallback.messages)
+        self.assertIn("[mock] Restoring service mock", snap.callback.snapcallback.messages)
+
+        # the original callback is reinstated afterwards
+        self.assertFalse(isinstance(snap.callback.snapcallback, snap.callback.TaggedCallback))
+
+        # services recorded by earlier versions of snap are restored from the working directory
+        ServicesRecordFile(os.path.join(self.basedir, "services.xml")).write_xml([Service(name='mock')])
+        dispatcher.restore(self.basedir)
+        self.assertEqual(self.basedir, snap.backends.services.adapters.mock.Mock.restore_dir)
+
+    @unittest.skipIf(OS.is_windows(), "relies on posix commands")
+    def testDumpLoadCommand(self):
+        dumpfile = os.path.join(self.basedir, "dump")
+        outfile = os.path.join(self.basedir, "out")
+        dispatcher = snap.backends.services.dispatcher.Dispatcher
+
+        # the output of the command is compressed as it is written
+        self.assertEqual(0, dispatcher.dump_command(["echo", "some dump"], dumpfile))
+        self.assertEqual('\x1f\x8b', open(dumpfile, 'rb').read(2))
+
+        # and decompressed as it is streamed to the loading command
+        self.assertEqual(0, dispatcher.load_command(dumpfile, ["sh", "-c", "cat > " + outfile]))
+        self.assertEqual("some dump\n", FileManager.read_file(outfile))
+
+        # uncompressed dumps are streamed as is
+        open(dumpfile, 'w').write("plain dump")
+        dispatcher.load_command(dumpfile, ["sh", "-c", "cat > " + outfile])
+        self.assertEqual("plain dump", FileManager.read_file(outfile))
+
+        # commands exiting without reading the dump are tolerated
+        self.assertEqual(0, dispatcher.load_command(dumpfile, ["true"]))
+
     def testNoBackupIfNotAvailable(self):
         snap.backends.services.adapters.mock.Mock.mock_is_available = False
         snap.backends.services.adapters.mock.Mock.is_available_called = False
@@ -165,6 +218,20 @@ class ServiceDispatcherTest(unittest.TestCase):
         self.assertEqual(snap.backends.services.adapters.postgresql.Postgresql.set_pgpassword_env()['PGPASSWORD'],
                          snap.config.options.service_options['postgresql_password'])
         
+    def testPostgresqlParallelDump(self):
+        orig_options = snap.config.options.service_options.copy()
+        try:
+            self.assertFalse(snap.backends.services.adapters.postgresql.Postgresql.parallel_dump())
+            snap.config.options.service_options['postgresql_parallel_dump'] = 'true'
+            self.assertTrue(snap.backends.services.adapters.postgresql.Postgresql.parallel_dump())
+        finally:
+            snap.config.options.service_options = orig_options
+
+    def testPostgresqlQuoteIdentifier(self):
+        self.assertEqual(snap.backends.services.adapters.postgresql.Postgresql.quote_identifier('snaptest'), '"snaptest"')
+        self.assertEqual(snap.backends.services.adapters.postgresql.Postgresql.quote_identifier('snap-test'), '"snap-test"')
+        self.assertEqual(snap.backends.services.adapters.postgresql.Postgresql.quote_identifier('snap"test'), '"snap""test"')
+
     def testPostgresqlDbExists(self):
         is_running = self.dispatcher.service_running('postgresql')
         self.dispatcher.start_service('postgresql')
@@ -287,10 +354,11 @@ class ServiceDispatcherTest(unittest.TestCase):
         currently_running = self.dispatcher.service_running(snap.backends.services.adapters.mysql.Mysql.DAEMON)
         self.assertEqual(already_running, currently_running)
 
-        # assert the db dump exists and has the db dump
-        self.assertTrue(os.path.isfile(self.basedir + "/dump.mysql"))
-        c = FileManager.read_file(self.basedir + "/dump.mysql")
-        self.assertEqual(1, len(re.findall('CREATE DATABASE.*snaptest', c)))
+        # assert the db has been dumped to its own compressed file
+        dumpfile = os.path.join(self.basedir, "databases", "snaptest.mysql")
+        self.assertTrue(os.path.isfile(dumpfile))
+        c = Compression.reader(open(dumpfile, 'rb')).read()
+        self.assertEqual(1, len(re.findall('Database: snaptest', c)))
 
         # finally cleanup
         self.dispatcher.start_service(snap.backends.services.adapters.mysql.Mysql.DAEMON)
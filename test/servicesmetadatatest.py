@@ -29,9 +29,34 @@ class ServicesMetadataTest(unittest.TestCase):
         service_record_file.write(services)
         contents = FileManager.read_file(file_path)
 
+        self.assertEqual("snaprecord 1 services\ns\tfoo\ns\tbaz\n", contents)
+        self.assertEqual(['foo', 'baz'], [service.name for service in ServicesRecordFile(file_path).read()])
+        os.remove(file_path)
+
+    def testWriteXmlServicesRecordFile(self):
+        file_path = os.path.join(os.path.dirname(__file__), "data/services-out.xml")
+        services  = [Service(name='foo'),
+                     Service(name='baz')]
+
+        service_record_file = ServicesRecordFile(file_path)
+        service_record_file.write_xml(services)
+        contents = FileManager.read_file(file_path)
+
         self.assertEqual("<services><service>foo</service><service>baz</service></services>", contents)
         os.remove(file_path)
 
+    def testServiceDirectories(self):
+        file_path = os.path.join(os.path.dirname(__file__), "data/services-out.xml")
+        services  = [Service(name='foo', directory=os.path.join('services', 'foo')),
+                     Service(name='baz')]
+
+        for write in [ServicesRecordFile.write, ServicesRecordFile.write_xml]:
+            write(ServicesRecordFile(file_path), services)
+            read = list(ServicesRecordFile(file_path).read())
+            self.assertEqual(['foo', 'baz'], [service.name for service in read])
+            self.assertEqual([os.path.join('services', 'foo'), None], [service.directory for service in read])
+        os.remove(file_path)
+
     def testReadServicesRecordFile(self):
         file_path = os.path.join(os.path.dirname(__file__), "data/servicesfile.xml")
         services = ServicesRecordFile(file_path).read()
@@ -17,9 +17,12 @@ import os
 import shutil
 import unittest
 
+import snap.config
 from snap.osregistry import OS, OSUtils
 from snap.filemanager    import FileManager
 from snap.metadata.sfile import SFile, FilesRecordFile
+from snap.metadata.hardlinks import HardLinks
+from snap.metadata.manifest import RecordManifest
 
 class SFileMetadataTest(unittest.TestCase):
     def setUp(self):
@@ -49,8 +52,128 @@ class SFileMetadataTest(unittest.TestCase):
         files_record_file.write(files)
         contents = FileManager.read_file(self.dest)
 
+        self.assertEqual("snaprecord 1 files\n" +
+                         "f\t" + path1 + "\t\t\t\t\t\t\t\t\n" +
+                         "f\t" + path2 + "\t\t\t\t\t\t\t\t\n", contents)
+
+    def testWriteXmlFilesRecordFile(self):
+        path1 = os.path.join("some", "path")
+        path2 = os.path.join("another", "path")
+        self.dest = os.path.join(os.path.dirname(__file__), "data", "files-out.xml")
+        files = [SFile(path=path1),
+                  SFile(path=path2)]
+
+        files_record_file = FilesRecordFile(self.dest)
+        files_record_file.write_xml(files)
+        contents = FileManager.read_file(self.dest)
+
         self.assertEqual("<files><file>" + path1 + "</file><file>" + path2 + "</file></files>", contents)
 
+    def testWriteFilesRecordFileXmlFormat(self):
+        path = os.path.join("some", "path")
+        self.dest = os.path.join(os.path.dirname(__file__), "data", "files-out.xml")
+
+        # the xml record format writes the files record as write_xml does
+        orig_record_format = snap.config.options.record_format
+        snap.config.options.record_format = 'xml'
+        try:
+            FilesRecordFile(self.dest).write([SFile(path=path)], deleted=['/gone'])
+        finally:
+            snap.config.options.record_format = orig_record_format
+        contents = FileManager.read_file(self.dest)
+
+        self.assertEqual("<files><file>" + path + "</file><deleted>/gone</deleted></files>", contents)
+
+        record_file = FilesRecordFile(self.dest)
+        self.assertEqual([path], [sfile.path for sfile in record_file.read()])
+        self.assertEqual(['/gone'], record_file.deleted)
+
+    def testFilesRecordFileAttributes(self):
+        self.dest = os.path.join(os.path.dirname(__file__), "data", "files-out.xml")
+        fs = os.lstat(__file__)
+        sfile = SFile(path="tab\tseperated")
+        sfile.record_stat(fs)
+        sfile.digest = 'abcdef'
+
+        # the attributes are preserved by both the manifest and xml formats
+        for write in (FilesRecordFile.write, FilesRecordFile.write_xml):
+            write(FilesRecordFile(self.dest), [sfile])
+            files = list(FilesRecordFile(self.dest).read())
+            self.assertEqual(1, len(files))
+            self.assertEqual(sfile.path, files[0].path)
+            self.assertEqual((fs.st_size, fs.st_mode, fs.st_uid, fs.st_gid, fs.st_mtime, fs.st_ino, 'abcdef'),
+                             (files[0].size, files[0].mode, files[0].uid, files[0].gid,
+                              files[0].mtime, files[0].inode, files[0].digest))
+
+    def testIncrementalFilesRecordFile(self):
+        self.dest = os.path.join(os.path.dirname(__file__), "data", "files-out.xml")
+        changed = SFile(path=os.path.join("some", "path"))
+        changed.record_stat(os.stat(__file__))
+        changed.digest = 'abcdef'
+        inherited = SFile(path=os.path.join("another", "path"))
+        inherited.record_stat(os.stat(__file__))
+        inherited.inherited = True
+
+        files_record_file = FilesRecordFile(self.dest)
+        files_record_file.write([changed, inherited], parent='/tmp/parent.tgz',
+                                deleted=[os.path.join("deleted", "path")])
+
+        # the parent is set before the files are read, the deleted paths after
+        files_record_file = FilesRecordFile(self.dest)
+        files = files_record_file.read()
+        self.assertEqual('/tmp/parent.tgz', files_record_file.parent)
+        files = list(files)
+        self.assertEqual([os.path.join("deleted", "path")], files_record_file.deleted)
+        self.assertEqual([changed.path, inherited.path], [sfile.path for sfile in files])
+        self.assertEqual(os.stat(__file__).st_mtime, files[0].mtime)
+        self.assertEqual('abcdef', files[0].digest)
+        self.assertFalse(files[0].inherited)
+        self.assertTrue(files[1].inherited)
+        self.assertTrue(files[1].unchanged_since(inherited))
+
+    def testSFileSlots(self):
+        sfile = SFile(path=os.path.join("some", "path"))
+        self.assertFalse(hasattr(sfile, '__dict__'))
+        self.assertEqual("some", sfile.directory)
+        self.assertEqual("path", sfile.name)
+        self.assertRaises(AttributeError, setattr, sfile, 'unknown', True)
+
+    def testUnchangedSince(self):
+        previous = SFile(path=__file__)
+        previous.record_stat(os.stat(__file__))
+
+        current = SFile(path=__file__)
+        current.record_stat(os.stat(__file__))
+        self.assertTrue(current.unchanged_since(previous))
+
+        # touched files are compared by digest
+        current.mtime += 1
+        self.assertFalse(current.unchanged_since(previous))
+        current.digest = previous.digest = 'abcdef'
+        self.assertTrue(current.unchanged_since(previous))
+
+        current.size += 1
+        self.assertFalse(current.unchanged_since(previous))
+
+    def testReadXmlFilesRecordFileIncrementally(self):
+        self.dest = os.path.join(os.path.dirname(__file__), "data", "files-out.xml")
+        paths = [os.path.join("path", str(i)) for i in range(100)]
+        FilesRecordFile(self.dest).write_xml([SFile(path) for path in paths], parent='/tmp/parent.tgz',
+                                             deleted=[os.path.join("deleted", "path")])
+
+        blocksize = RecordManifest.BLOCKSIZE
+        RecordManifest.BLOCKSIZE = 64
+        try:
+            record = FilesRecordFile(self.dest)
+            files = record.read()
+            self.assertEqual('/tmp/parent.tgz', record.parent)
+            self.assertEqual(paths[0], next(files).path)
+            self.assertEqual([], record.deleted)
+            self.assertEqual(paths[1:], [sfile.path for sfile in files])
+            self.assertEqual([os.path.join("deleted", "path")], record.deleted)
+        finally:
+            RecordManifest.BLOCKSIZE = blocksize
+
     def testReadFilesRecordFile(self):
         file_path = os.path.join(os.path.dirname(__file__), "data", "recordfile.xml")
         files = FilesRecordFile(file_path).read()
@@ -100,6 +223,35 @@ class SFileMetadataTest(unittest.TestCase):
         
         shutil.rmtree(os.path.join(basedir, "source"))
 
+    @unittest.skipIf(OS.is_windows(), "hard links not currently supported on windows")
+    def testSFileCopyHardLinksTo(self):
+        basedir = os.path.join(os.path.dirname(__file__), "data")
+        self.source_dir = os.path.join(basedir, "source", "subdir")
+        self.dest_dir = os.path.join(basedir, "dest")
+
+        os.makedirs(self.source_dir)
+        f = open(os.path.join(self.source_dir, "foo"), 'w')
+        f.write("foo")
+        f.close()
+        os.link(os.path.join(self.source_dir, "foo"), os.path.join(self.source_dir, "bar"))
+
+        # the second link is linked to the copy of the first
+        links = HardLinks()
+        for name in ["foo", "bar"]:
+            SFile(path=os.path.join("source", "subdir", name)).copy_to(self.dest_dir, path_prefix=basedir, links=links)
+        dest_foo = os.path.join(self.dest_dir, "source", "subdir", "foo")
+        dest_bar = os.path.join(self.dest_dir, "source", "subdir", "bar")
+        self.assertTrue(os.path.samefile(dest_foo, dest_bar))
+        self.assertEqual("foo", FileManager.read_file(dest_bar))
+
+        # without the tracker each is copied
+        shutil.rmtree(self.dest_dir)
+        for name in ["foo", "bar"]:
+            SFile(path=os.path.join("source", "subdir", name)).copy_to(self.dest_dir, path_prefix=basedir)
+        self.assertFalse(os.path.samefile(dest_foo, dest_bar))
+
+        shutil.rmtree(os.path.join(basedir, "source"))
+
     @unittest.skipIf(OS.is_windows(), "symbolic links not currently supported on windows")
     def testSFileCopyLinkTo(self):     
         basedir = os.path.join(os.path.dirname(__file__), "data")
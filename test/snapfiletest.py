@@ -14,13 +14,25 @@
 # GNU General Public License for more details.
 
 import os
+import shutil
 import tarfile
+import tempfile
 import unittest
 
+import snap.config
 from snap.exceptions  import MissingDirError
+from snap.osregistry  import OS
+from snap.sparse    import SparseFile
 from snap.metadata.snapfile import SnapFile
+from snap.metadata.archive  import DirectArchive
 
 class SnapFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
     def testInvalidSnapdirectoryShouldRaiseError(self):
         with self.assertRaises(MissingDirError) as context:
             SnapFile('foo', '/invalid/dir')
@@ -40,6 +52,155 @@ class SnapFileTest(unittest.TestCase):
 
         #os.remove(os.path.join(snapdir, "test-snapfile.tgz"))
 
+    def testCompressDirectArchive(self):
+        datadir = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
+        basedir = self.tempdir
+        snapdir = os.path.join(basedir, "direct-snapdir")
+        os.mkdir(snapdir)
+        with open(os.path.join(snapdir, "files.xml"), 'w') as f:
+            f.write("<files></files>")
+
+        archive = DirectArchive.register(snapdir)
+        try:
+            # directories under the working directory share its archive
+            self.assertIs(archive, DirectArchive.lookup(os.path.join(snapdir, "services", "httpd")))
+            self.assertIsNone(DirectArchive.lookup(basedir))
+            source = os.path.join(datadir, "tmp", "subdir", "file2")
+            self.assertTrue(archive.add(source, os.path.join("data", "tmp", "subdir", "file2")))
+            self.assertFalse(archive.add(os.path.join(basedir, "missing"), "missing"))
+            SnapFile(os.path.join(basedir, "test-direct-snapfile.tgz"), snapdir).compress()
+        finally:
+            DirectArchive.unregister(snapdir)
+        self.assertIsNone(DirectArchive.lookup(snapdir))
+
+        tarball = tarfile.open(os.path.join(basedir, "test-direct-snapfile.tgz"), "r:gz")
+        members = dict((tarinfo.name, tarinfo) for tarinfo in tarball)
+        self.assertIn("files.xml", members)
+        self.assertTrue(members["data"].isdir())
+        self.assertTrue(members["data/tmp/subdir"].isdir())
+        self.assertEqual(open(source).read(), tarball.extractfile("data/tmp/subdir/file2").read())
+        self.assertNotIn("missing", members)
+
+    @unittest.skipIf(OS.is_windows(), "hard links not currently supported on windows")
+    def testSparseAndLinkedFiles(self):
+        snapdir = os.path.join(self.tempdir, "sparse-snapdir")
+        os.makedirs(snapdir)
+        sparse = os.path.join(snapdir, "sparse")
+        f = open(sparse, 'wb')
+        for i in range(10):
+            f.seek(i * 1024 * 1024)
+            f.write("data %d" % i)
+        f.truncate(16 * 1024 * 1024)
+        f.close()
+        with open(os.path.join(snapdir, "foo"), 'w') as f:
+            f.write("foo")
+        os.link(os.path.join(snapdir, "foo"), os.path.join(snapdir, "bar"))
+
+        snapfile_path = os.path.join(self.tempdir, "test-sparse-snapfile.tgz")
+        SnapFile(snapfile_path, snapdir).compress()
+
+        # the linked file is stored once, the sparse file without its holes
+        tarball = tarfile.open(snapfile_path, "r:gz")
+        members = dict((tarinfo.name, tarinfo) for tarinfo in tarball)
+        linked = [members["foo"], members["bar"]]
+        self.assertEqual(1, len([tarinfo for tarinfo in linked if tarinfo.islnk()]))
+        if SparseFile.is_sparse(os.stat(sparse)):
+            self.assertTrue(members["sparse"].issparse())
+            self.assertTrue(os.path.getsize(snapfile_path) < 1024 * 1024)
+        self.assertEqual(open(sparse, 'rb').read(), tarball.extractfile("sparse").read())
+        tarball.close()
+
+        extractdir = os.path.join(self.tempdir, "sparse-extractdir")
+        os.makedirs(extractdir)
+        SnapFile(snapfile_path, extractdir).extract()
+        self.assertEqual(open(sparse, 'rb').read(), open(os.path.join(extractdir, "sparse"), 'rb').read())
+        if SparseFile.is_sparse(os.stat(sparse)):
+            self.assertTrue(SparseFile.is_sparse(os.stat(os.path.join(extractdir, "sparse"))))
+        self.assertTrue(os.path.samefile(os.path.join(extractdir, "foo"), os.path.join(extractdir, "bar")))
+
+    def testListSnapFile(self):
+        snapdir = os.path.join(os.path.dirname(__file__), "data")
+        snapfile = SnapFile(os.path.join(snapdir, "test-snapfile.tgz"), snapdir)
+        snapfile.compress()
+
+        # the index is used to list the snapfile
+        names = snapfile.list()
+        self.assertIn(os.path.join("tmp", "file1"), names)
+        self.assertIn(os.path.join("tmp", "subdir", "file2"), names)
+
+        # it is scanned when there is no index
+        existing = SnapFile(os.path.join(snapdir, "existing-snapfile.tgz"), snapdir)
+        self.assertIn("packagefile.xml", existing.list())
+
+    def testExtractOnly(self):
+        datadir = os.path.join(os.path.dirname(__file__), "data")
+        snapfile_path = os.path.join(self.tempdir, "test-snapfile.tgz")
+        SnapFile(snapfile_path, datadir).compress()
+
+        snapdir = os.path.join(self.tempdir, "only-snapdir")
+        os.makedirs(snapdir)
+        SnapFile(snapfile_path, snapdir).extract_only([os.path.join("tmp", "subdir")])
+
+        self.assertTrue(os.path.exists(os.path.join(snapdir, "tmp", "subdir", "file2")))
+        self.assertFalse(os.path.exists(os.path.join(snapdir, "tmp", "file1")))
+
+    @unittest.skipIf(OS.is_windows(), "hard links not currently supported on windows")
+    def testExtractOnlyLinkedOutsideSelection(self):
+        snapdir = os.path.join(self.tempdir, "linked-snapdir")
+        for name in ("a", "b", "c"):
+            os.makedirs(os.path.join(snapdir, name))
+        with open(os.path.join(snapdir, "a", "x"), 'w') as f:
+            f.write("linked")
+        os.link(os.path.join(snapdir, "a", "x"), os.path.join(snapdir, "b", "y"))
+        os.link(os.path.join(snapdir, "a", "x"), os.path.join(snapdir, "c", "z"))
+
+        # the snapfile is indexed by default, unindexed without compression
+        compression = snap.config.options.compression
+        try:
+            for codec in (compression, 'none'):
+                snap.config.options.compression = codec
+                snapfile_path = os.path.join(self.tempdir, "test-linked-snapfile-" + codec)
+                SnapFile(snapfile_path, snapdir).compress()
+
+                # whichever of the files is stored with the data, the others are linked to it
+                tarball = tarfile.open(snapfile_path)
+                links = [tarinfo for tarinfo in tarball if tarinfo.islnk()]
+                tarball.close()
+                self.assertEqual(2, len(links))
+                selected = [os.path.dirname(link.name) for link in links]
+
+                extractdir = os.path.join(self.tempdir, "linked-extractdir-" + codec)
+                os.makedirs(extractdir)
+                SnapFile(snapfile_path, extractdir).extract_only(selected)
+                paths = [os.path.join(extractdir, link.name) for link in links]
+                self.assertEqual("linked", open(paths[0]).read())
+                self.assertTrue(os.path.samefile(paths[0], paths[1]))
+                self.assertFalse(os.path.exists(os.path.join(extractdir, links[0].linkname)))
+        finally:
+            snap.config.options.compression = compression
+
+    @unittest.skipIf(OS.is_windows(), "encryption is not supported on windows")
+    def testEncryptedSnapFile(self):
+        datadir = os.path.join(os.path.dirname(__file__), "data")
+        snapfile_path = os.path.join(self.tempdir, "test-encrypted-snapfile.tgz")
+        SnapFile(snapfile_path, os.path.join(datadir, "tmp"), "secret").compress()
+        self.assertNotEqual('\x1f\x8b', open(snapfile_path, 'rb').read(2))
+
+        snapfile = SnapFile(snapfile_path, datadir, "secret")
+        self.assertIn(os.path.join("subdir", "file2"), snapfile.list())
+
+        # the index is read through the decrypting reader
+        snapdir = os.path.join(self.tempdir, "encrypted-only-snapdir")
+        os.makedirs(snapdir)
+        SnapFile(snapfile_path, snapdir, "secret").extract_only(["subdir"])
+        self.assertTrue(os.path.exists(os.path.join(snapdir, "subdir", "file2")))
+        self.assertFalse(os.path.exists(os.path.join(snapdir, "file1")))
+
+        snapdir = os.path.join(self.tempdir, "encrypted-snapdir")
+        os.makedirs(snapdir)
+        SnapFile(snapfile_path, snapdir, "secret").extract()
+        self.assertTrue(os.path.exists(os.path.join(snapdir, "file1")))
+
     def testExtractSnapFile(self):
         snap_file_path = os.path.join(os.path.dirname(__file__), "data/existing-snapfile.tgz")
         snapdir = os.path.join(os.path.dirname(__file__), "data/new-snapdir/")
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+#
+# test/snapindextest.py unit test suite for snap.metadata.snapindex
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import tarfile
+import unittest
+from StringIO import StringIO
+
+from snap.metadata.snapindex import IndexingTarFile, SnapIndex
+
+class SnapIndexTest(unittest.TestCase):
+    def testBuild(self):
+        members = [('etc', 0), ('etc/foo', 512), ('etc/bar', 2048), ('home/big', 4096)]
+        chunks = [(0, 0), (1024, 300), (4096, 700)]
+        index = SnapIndex.build(members, chunks)
+
+        self.assertEqual(['etc', 'etc/foo', 'etc/bar', 'home/big'], index.names())
+        self.assertEqual([(0, 0), (0, 512), (300, 1024), (700, 0)],
+                         [(entry.chunk, entry.offset) for entry in index.entries])
+
+    def testDumpParse(self):
+        index = SnapIndex.build([('etc/foo', 0), ('etc/tab\tnew\nline', 512)], [(0, 0)])
+        parsed = SnapIndex.parse(index.dump())
+        self.assertEqual(index.names(), parsed.names())
+        self.assertEqual([0, 512], [entry.offset for entry in parsed.entries])
+
+        self.assertIsNone(SnapIndex.parse('not an index'))
+
+    def testSelect(self):
+        index = SnapIndex.build([('etc', 0), ('etc/foo', 512), ('etc/foobar', 1024), ('files.xml', 2048)], [(0, 0)])
+        self.assertEqual(['etc/foo', 'files.xml'],
+                         [entry.name for entry in index.select(['etc/foo', 'files.xml'])])
+        self.assertEqual(['etc', 'etc/foo', 'etc/foobar'],
+                         [entry.name for entry in index.select(['etc/'])])
+
+class IndexingTarFileTest(unittest.TestCase):
+    def testPaxRecords(self):
+        records = {u'LIBARCHIVE.xattr.user.snap': u'dGVzdA=='}
+        data = StringIO()
+        tarball = IndexingTarFile.open(fileobj=data, mode="w|")
+        for name, pax_headers in (("plain", {}), ("xattrs", records)):
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = 4
+            tarinfo.pax_headers = pax_headers
+            tarball.addfile(tarinfo, StringIO("data"))
+
+        # sparse members carry their records ahead of their gnu header
+        tarinfo = tarfile.TarInfo("sparse")
+        tarinfo.size = 8192
+        tarinfo.pax_headers = records
+        tarball.addsparse(tarinfo, StringIO("data" + "\0" * 8188), [(0, 4)])
+        tarball.close()
+
+        data.seek(0)
+        tarball = tarfile.open(fileobj=data, mode="r|")
+        members = dict((tarinfo.name, (tarinfo, tarball.extractfile(tarinfo).read())) for tarinfo in tarball)
+        self.assertEqual({}, members["plain"][0].pax_headers)
+        self.assertEqual(records, members["xattrs"][0].pax_headers)
+        self.assertEqual("data", members["xattrs"][1])
+        self.assertEqual(records, members["sparse"][0].pax_headers)
+        self.assertTrue(members["sparse"][0].issparse())
+        self.assertEqual("data" + "\0" * 8188, members["sparse"][1])
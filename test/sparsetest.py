@@ -0,0 +1,75 @@
+#!/usr/bin/python
+#
+# test/sparsetest.py unit test suite for snap.sparse
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import shutil
+import unittest
+
+from snap.sparse import SparseFile
+
+class SparseFileTest(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.join(os.path.dirname(__file__), "data", "sparse")
+        os.makedirs(self.basedir)
+        self.path = os.path.join(self.basedir, "sparse")
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def write_sparse(self, path, size, regions):
+        '''helper to write a file of the specified size with data at the (offset, data) regions,
+           returning true if the filesystem left it sparse'''
+        f = open(path, 'wb')
+        for offset, data in regions:
+            f.seek(offset)
+            f.write(data)
+        f.truncate(size)
+        f.close()
+        return SparseFile.is_sparse(os.stat(path))
+
+    def testRegions(self):
+        mb = 1024 * 1024
+        if not self.write_sparse(self.path, 4 * mb, [(mb, 'x' * 100), (3 * mb, 'y' * 100)]):
+            self.skipTest("the filesystem does not support sparse files")
+
+        f = open(self.path, 'rb')
+        regions = SparseFile.regions(f)
+        self.assertEqual(0, f.tell())
+        f.close()
+
+        # the filesystem may round the regions out to its blocks
+        self.assertEqual(2, len(regions))
+        for (offset, length), expected in zip(regions, [mb, 3 * mb]):
+            self.assertTrue(offset <= expected and expected + 100 <= offset + length)
+
+        # only the specified size of the file is considered
+        f = open(self.path, 'rb')
+        self.assertEqual(1, len(SparseFile.regions(f, 2 * mb)))
+        f.close()
+
+    def testHoleOnly(self):
+        if not self.write_sparse(self.path, 1024 * 1024, []):
+            self.skipTest("the filesystem does not support sparse files")
+        f = open(self.path, 'rb')
+        self.assertEqual([], SparseFile.regions(f))
+        f.close()
+
+    def testNotSparse(self):
+        f = open(self.path, 'wb')
+        f.write('x' * 100000)
+        f.close()
+        f = open(self.path, 'rb')
+        self.assertIsNone(SparseFile.regions(f))
+        f.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+#
+# test/statcachetest.py unit test suite for snap.statcache
+#
+# (C) Copyright 2011 Mo Morsi (mo@morsi.org)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, Version 3,
+# as published by the Free Software Foundation
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import shutil
+import unittest
+
+from snap.digest    import FileDigest
+from snap.statcache import StatCache
+
+class StatCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.join(os.path.dirname(__file__), "data", "statcache")
+        os.makedirs(self.basedir)
+        self.cachefile = os.path.join(self.basedir, "cache", "statcache.db")
+        self.foo = os.path.join(self.basedir, "foo")
+        with open(self.foo, 'w') as f:
+            f.write("foo")
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def testRecordVerdict(self):
+        cache = StatCache(self.cachefile)
+        fs = os.lstat(self.foo)
+        self.assertIsNone(cache.verdict(self.foo, fs, 'pkg-1'))
+        cache.record(self.foo, fs, 'pkg-1', True)
+        cache.record(self.foo, fs, digest='abcd')
+        cache.close()
+
+        cache = StatCache(self.cachefile)
+        self.assertTrue(cache.verdict(self.foo, fs, 'pkg-1'))
+        self.assertEqual('abcd', cache.digest(self.foo, fs))
+
+        # verdicts computed against something else are not reused
+        self.assertIsNone(cache.verdict(self.foo, fs, 'pkg-2'))
+
+        # nor is anything once the file changes
+        with open(self.foo, 'w') as f:
+            f.write("foobar")
+        fs = os.lstat(self.foo)
+        self.assertIsNone(cache.verdict(self.foo, fs, 'pkg-1'))
+        self.assertIsNone(cache.digest(self.foo, fs))
+        cache.close()
+
+    def testCachedModified(self):
+        calls = []
+        def modified(path):
+            calls.append(path)
+            return False
+
+        cache = StatCache(self.cachefile)
+        cached = cache.cached_modified(modified, lambda path: 'pkg')
+        self.assertFalse(cached(self.foo))
+        self.assertFalse(cached(self.foo))
+        self.assertEqual([self.foo], calls)
+        cache.close()
+
+    def testClassify(self):
+        expected = (3, FileDigest.hash_file(self.foo), 'md5')
+        cache = StatCache(self.cachefile)
+        classified = list(FileDigest.classify([self.foo], lambda path: expected, None, 1,
+                                              cache, lambda path: 'pkg'))
+        self.assertEqual([(self.foo, False)], classified)
+        self.assertFalse(cache.verdict(self.foo, os.lstat(self.foo), 'pkg'))
+        cache.close()
+
+    def testEvict(self):
+        cache = StatCache(self.cachefile)
+        cache.record(self.foo, os.lstat(self.foo), 'pkg', True)
+        cache.now += StatCache.MAX_AGE + 1
+        cache.evict()
+        self.assertEqual(0, cache.db.execute('SELECT COUNT(*) FROM files').fetchone()[0])
+        cache.close()
@@ -135,6 +135,15 @@ class YumBackendTest(unittest.TestCase):
     #        decoded = PackageRegistry.decode('yum', pkg)
     #        self.assertIn(decoded, installed_package_names)
 
+    def testInstalledFilesIndex(self):
+        backup_target = snap.backends.files.syum.Syum()
+        pkg, buildtime, size, digest, mode = backup_target.installed_files['/bin/rpm']
+        self.assertEqual('rpm', pkg)
+        self.assertEqual(os.stat('/bin/rpm').st_size, size)
+
+        for pkg in yum.YumBase().rpmdb.getProvides('/etc/yum.conf'):
+            self.assertEqual(pkg.name, backup_target.installed_files['/etc/yum.conf'][0])
+
     def testBackupFiles(self):
         f=open(self.fs_root + "/foo" , 'w')
         f.write("foo")